@@ -1,7 +1,11 @@
+from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.exceptions import ValidationError
+import django.contrib.auth as auth
 
 from .models import CustomUser
+from . import hashing
 from common.django_utils import AsyncFormMixin, AsyncModelFormMixin
 
 class CustomUserCreationForm(UserCreationForm, AsyncModelFormMixin):
@@ -13,5 +17,49 @@ class CustomUserCreationForm(UserCreationForm, AsyncModelFormMixin):
             'email', 'firstName', 'lastName', 'password1', 'password2', 'is_writer',
         )
 
+    async def asave(self) -> CustomUser:
+        """
+        Saves the user like `save`, but the password is hashed by the
+        processes of `account.hashing.executor`.
+        """
+        user: CustomUser = forms.ModelForm.save(self, commit = False)
+        user.password = await hashing.amake_password(self.cleaned_data['password1'])
+        await user.asave()
+        return user
+
 class CustomAuthenticationForm(AuthenticationForm, AsyncFormMixin):
-    pass
+    """
+    `AuthenticationForm` authenticates the user in `clean`, ie, in a thread
+    of `sync_to_async`. With `ais_valid` this form authenticates afterwards
+    instead, through `aauthenticate` (see
+    'common.auth.SubscriptionModelBackend'). `is_valid` still authenticates
+    in `clean`.
+    """
+    _authenticating_later = False
+
+    def clean(self):
+        if self._authenticating_later:
+            return self.cleaned_data
+        return super().clean()
+
+    async def ais_valid(self) -> bool:
+        # Only the fields are validated here, no query: no need for a thread
+        self._authenticating_later = True
+        try:
+            if not self.is_valid():
+                return False
+        finally:
+            self._authenticating_later = False
+        self.user_cache = await auth.aauthenticate(
+            self.request,
+            username = self.cleaned_data['username'],
+            password = self.cleaned_data['password'],
+        )
+        try:
+            if self.user_cache is None:
+                raise self.get_invalid_login_error()
+            self.confirm_login_allowed(self.user_cache)
+        except ValidationError as ex:
+            self.add_error(None, ex)
+            return False
+        return True
@@ -0,0 +1,177 @@
+"""
+Password hashing off the request threads.
+
+Hashing a password (PBKDF2 with hundreds of thousands of iterations) is
+deliberately slow and CPU bound. `hashlib` releases the GIL while it
+hashes, so threads could hash in parallel too, but they would be threads
+of the process serving the requests, with no bound on how many hash at
+once. Pools of processes keep that CPU work out of the serving process (its
+event loop and its threads) and bound it to their size. `hash_passwords`
+spreads a bulk of passwords over a pool of one process per CPU by default.
+
+The hashing of the requests (logging in, registering) goes to `executor`,
+a pool of PASSWORD_HASHING_WORKERS processes of its own, through
+`amake_password` and `averify_password`. So a burst of logins can't take
+the threads of `sync_to_async` (nor the event loop) away from the ORM and
+the templates of the other requests. The pool is bounded: once
+PASSWORD_HASHING_MAX_QUEUE hashes are waiting for a process, new ones are
+rejected with `HashingOverloadedError`. Its load (jobs in flight and
+queued, completed, failed and rejected) can be checked with
+`executor.snapshot()`.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/auth/passwords/
+    https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+"""
+
+__all__ = (
+    'new_process_pool',
+    'hash_passwords',
+    'HashingExecutor',
+    'HashingOverloadedError',
+    'executor',
+    'amake_password',
+    'averify_password',
+)
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Sequence
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+
+# Below this, starting the processes costs more than it saves
+MIN_PASSWORDS_FOR_POOL = 16
+
+def _init_worker(settings_module: str):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+def new_process_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """
+    Returns a pool of processes ready to use Django's hashers. The
+    processes are spawned, not forked, since forking a process with
+    threads (eg, an ASGI server) or open DB connections isn't safe.
+    """
+    return ProcessPoolExecutor(
+        max_workers = workers,
+        mp_context = multiprocessing.get_context('spawn'),
+        initializer = _init_worker,
+        initargs = (os.environ['DJANGO_SETTINGS_MODULE'],),
+    )
+
+def hash_passwords(passwords: Sequence[str | None], *, workers: int | None = None) -> list[str]:
+    """
+    Returns the hashes of `passwords` (as `make_password` does, ie, an
+    unusable password for `None`), in the same order.
+    """
+    if len(passwords) < MIN_PASSWORDS_FOR_POOL or workers == 1:
+        return [make_password(password) for password in passwords]
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per process: fewer round trips, but still balanced
+    chunk_size = max(1, len(passwords) // (workers * 4))
+    with new_process_pool(workers) as pool:
+        return list(pool.map(make_password, passwords, chunksize = chunk_size))
+
+class HashingOverloadedError(Exception):
+    pass
+
+class HashingExecutor:
+    """
+    A pool of `workers` processes that accepts at most `max_queue` jobs
+    waiting for a process. The processes are started on the first job (or
+    by `astart`, from the ASGI lifespan).
+    """
+    def __init__(self, *, workers: int, max_queue: int):
+        if workers < 1 or max_queue < 0:
+            raise ValueError(f'Invalid hashing executor: {workers} workers, {max_queue} queued')
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: ProcessPoolExecutor | None = None
+        self._in_flight = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._busy_time = 0.0
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._in_flight - self.workers)
+
+    def snapshot(self) -> dict:
+        return {
+            'workers': self.workers,
+            'in_flight': self._in_flight,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'max_queued': self._max_queued,
+            'completed': self._completed,
+            'failed': self._failed,
+            'rejected': self._rejected,
+            # Of the completed jobs, waiting included
+            'avg_seconds': self._busy_time / self._completed if self._completed else 0.0,
+        }
+
+    async def arun(self, function: Callable, *args):
+        """
+        Runs `function(*args)` in a process of the pool. Raises
+        `HashingOverloadedError`, right away, if the queue is full.
+        """
+        if self._in_flight >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise HashingOverloadedError(f'{self.queued} password hashes already waiting')
+        if self._pool is None:
+            self._pool = new_process_pool(self.workers)
+
+        self._in_flight += 1
+        self._max_queued = max(self._max_queued, self.queued)
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool, function, *args)
+        except BaseException as ex:
+            # Failed or cancelled (eg, the client went away)
+            self._failed += 1
+            if isinstance(ex, BrokenProcessPool):
+                # A process died (eg, killed for its memory): the next job starts a new pool
+                self._pool = None
+            raise
+        finally:
+            self._in_flight -= 1
+        self._completed += 1
+        self._busy_time += time.monotonic() - started_at
+        return result
+
+    async def astart(self):
+        """
+        Starts the processes, so that the first logins don't wait for them
+        to spawn and set up Django.
+        """
+        await asyncio.gather(*(self.arun(os.getpid) for _ in range(self.workers)))
+
+    async def ashutdown(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown)
+
+executor = HashingExecutor(
+    workers = settings.PASSWORD_HASHING_WORKERS,
+    max_queue = settings.PASSWORD_HASHING_MAX_QUEUE,
+)
+
+async def amake_password(password: str | None) -> str:
+    return await executor.arun(make_password, password)
+
+async def averify_password(password: str, encoded: str) -> tuple[bool, bool]:
+    """
+    Returns, as `verify_password`, whether `password` matches `encoded` and
+    whether `encoded` must be updated (ie, its hasher or work factor is no
+    longer the preferred one).
+    """
+    return await executor.arun(verify_password, password, encoded)
@@ -0,0 +1,76 @@
+"""
+Creates the users listed in a CSV file (eg, the subscribers of a company),
+with `CustomUser.objects.bulk_create_users`: passwords hashed by a pool of
+processes, a single query for the emails already taken, and batched
+inserts.
+
+The CSV has the columns 'email', 'firstName', 'lastName' and, optionally,
+'password' (empty or missing: the user gets an unusable password, and can
+set one with the password reset) and 'is_writer'.
+
+Usage examples:
+    python manage.py provision_users subscribers.csv
+    python manage.py provision_users writers.csv --writers --workers 8
+
+See:
+    https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+"""
+
+import csv
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.models import CustomUser, FIRST_NAME_MAXLEN, LAST_NAME_MAXLEN
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+class Command(BaseCommand):
+    help = 'Creates the users listed in a CSV file, in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type = Path, help = 'CSV file with the users')
+        parser.add_argument('--writers', action = 'store_true', help = 'Create all the users as writers')
+        parser.add_argument('--batch-size', type = int, default = 1_000, help = 'Users per INSERT')
+        parser.add_argument(
+            '--workers', type = int,
+            help = 'Processes hashing the passwords (default: one per CPU)',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        users = list(self.read_users(Path(options['path']), options['writers']))
+        read_at = time.monotonic()
+        try:
+            created, skipped = CustomUser.objects.bulk_create_users(
+                users, batch_size = options['batch_size'], hash_workers = options['workers'],
+            )
+        except ValueError as ex:
+            raise CommandError(str(ex))
+
+        for email in skipped:
+            self.stderr.write(f'Skipped (already exists or repeated): {email}')
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} users created, {len(skipped)} skipped, in {elapsed:.1f}s '
+            f'({len(created) / (time.monotonic() - read_at):.0f} users/s)'
+        ))
+
+    def read_users(self, path: Path, all_writers: bool):
+        with path.open(newline = '', encoding = 'utf-8') as file:
+            reader = csv.DictReader(file)
+            missing = {'email', 'firstName', 'lastName'} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+            for row in reader:
+                first_name, last_name = row['firstName'].strip(), row['lastName'].strip()
+                if not (first_name and last_name) or len(first_name) > FIRST_NAME_MAXLEN or len(last_name) > LAST_NAME_MAXLEN:
+                    raise CommandError(f'Line {reader.line_num}: invalid first or last name')
+                yield {
+                    'email': row['email'],
+                    'password': row.get('password') or None,
+                    'firstName': first_name,
+                    'lastName': last_name,
+                    'is_writer': all_writers or (row.get('is_writer') or '').strip().lower() in TRUE_VALUES,
+                }
@@ -0,0 +1,62 @@
+"""
+Deletes the expired sessions from the 'django_session' table, in batches.
+
+Django's `clearsessions` deletes them all with a single DELETE, which on a
+big table holds the write lock (SQLite) or the rows' locks for as long as
+it takes. Here each batch of `--batch-size` expired sessions is deleted in
+a statement (and transaction) of its own, with an optional `--pause`
+between batches, so logins and the other writes keep going meanwhile.
+
+With the 'cached_db' engine, an expired session may still be in the cache,
+but Django checks the expiry date of the sessions it loads. With the
+'cache' and 'signed_cookies' engines the table is no longer used, and this
+only deletes what was left from before.
+
+Usage examples:
+    python manage.py purge_sessions
+    python manage.py purge_sessions --batch-size 500 --pause 0.1
+    python manage.py purge_sessions --dry-run
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/http/sessions/#clearing-the-session-store
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+class Command(BaseCommand):
+    help = 'Deletes the expired sessions from the database, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int, default = 1_000, help = 'Sessions per DELETE')
+        parser.add_argument('--pause', type = float, default = 0.0, help = 'Seconds between batches')
+        parser.add_argument('--dry-run', action = 'store_true', help = 'Only count the expired sessions')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        if settings.SESSION_BACKEND in ('cache', 'signed_cookies'):
+            self.stdout.write(f"The '{settings.SESSION_BACKEND}' session engine doesn't use the database")
+
+        # Sessions expiring while this runs are left for the next run
+        now = timezone.now()
+        expired = Session.objects.filter(expire_date__lt = now)
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} expired sessions')
+            return
+
+        started_at = time.monotonic()
+        deleted = 0
+        while keys := list(expired.values_list('session_key', flat = True)[:batch_size]):
+            deleted += Session.objects.filter(session_key__in = keys).delete()[0]
+            self.stdout.write(f'{deleted} expired sessions deleted')
+            if options['pause'] and len(keys) == batch_size:
+                time.sleep(options['pause'])
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired sessions deleted in {elapsed:.1f}s'))
@@ -9,7 +9,10 @@ See:
     https://docs.djangoproject.com/en/5.1/topics/auth/customizing/#a-full-example
 """
 
+from typing import Iterable
+
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _t
 
 class CustomUserManager(BaseUserManager):
@@ -36,6 +39,57 @@ class CustomUserManager(BaseUserManager):
         user.save()
         return user
 
+    def bulk_create_users(
+            self,
+            users: Iterable[dict],
+            *,
+            batch_size: int = 1_000,
+            hash_workers: int | None = None,
+    ) -> tuple[list, list[str]]:
+        """
+        Creates many users at once, eg, when onboarding the subscribers of a
+        company. Each user is a dict with the 'email', the 'password' (or
+        `None`, for an unusable password) and any other field.
+
+        Unlike `create_user` in a loop, the passwords are hashed in parallel
+        (see 'account.hashing'), the emails already taken are found with a
+        single query and the users are inserted with `bulk_create`, in
+        batches of `batch_size`, in a single transaction.
+
+        Returns the users created and the (normalized) emails skipped
+        because they were taken or repeated.
+        """
+        from .hashing import hash_passwords
+
+        new_users: dict[str, dict] = {}
+        skipped = []
+        for user in users:
+            fields = dict(user)
+            email = self.normalize_email(str(fields.pop('email', '')).strip())
+            if not email:
+                raise ValueError(_t('The given email must be a non-empty string.'))
+            if email in new_users:
+                skipped.append(email)
+            else:
+                new_users[email] = fields
+
+        taken = set(self.filter(email__in = new_users).values_list('email', flat = True))
+        skipped.extend(taken)
+        for email in taken:
+            del new_users[email]
+
+        hashes = hash_passwords(
+            [fields.pop('password', None) for fields in new_users.values()],
+            workers = hash_workers,
+        )
+        created = [
+            self.model(email = email, password = password_hash, **fields)
+            for (email, fields), password_hash in zip(new_users.items(), hashes)
+        ]
+        with transaction.atomic():
+            self.bulk_create(created, batch_size = batch_size)
+        return created, skipped
+
     def create_superuser(self, email:str, password: str, **extras):
         """
         From a source of the Internet:
@@ -1,3 +1,153 @@
-from django.test import TestCase
+import asyncio
+import os
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from account import hashing
+from account.forms import CustomAuthenticationForm
+from account.models import CustomUser
+from common import rate_limit
+
+class HashingTestCase(TestCase):
+    """
+    The hashing processes are spawned once per class, and stopped after it.
+    """
+    @classmethod
+    def tearDownClass(cls):
+        async_to_sync(hashing.executor.ashutdown)()
+        super().tearDownClass()
+
+class CustomAuthenticationFormTests(HashingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('a@x.com', 'right password', firstName = 'A', lastName = 'B')
+
+    def form(self, password: str) -> CustomAuthenticationForm:
+        request = RequestFactory().post('/')
+        return CustomAuthenticationForm(request, data = {'username': 'a@x.com', 'password': password})
+
+    def test_is_valid_still_authenticates(self):
+        form = self.form('wrong password')
+        self.assertFalse(form.is_valid())
+        self.assertIsNone(form.get_user())
+        self.assertTrue(form.non_field_errors())
+
+    async def test_ais_valid_authenticates_once(self):
+        with mock.patch.object(hashing, 'averify_password', wraps = hashing.averify_password) as averify:
+            form = self.form('right password')
+            self.assertTrue(await form.ais_valid())
+            self.assertEqual(form.get_user().pk, self.user.pk)
+            form = self.form('wrong password')
+            self.assertFalse(await form.ais_valid())
+            self.assertIsNone(form.get_user())
+            self.assertTrue(form.non_field_errors())
+        self.assertEqual(averify.call_count, 2)
+
+    async def test_failed_logins_are_not_checked_again_by_model_backend(self):
+        with mock.patch.object(ModelBackend, 'aauthenticate') as aauthenticate, \
+                mock.patch.object(ModelBackend, 'authenticate', autospec = True,
+                                  side_effect = ModelBackend.authenticate) as authenticate:
+            self.assertFalse(await self.form('wrong password').ais_valid())
+            self.assertFalse(await sync_to_async(self.form('wrong password').is_valid)())
+        aauthenticate.assert_not_called()
+        # Only through `super()`, by SubscriptionModelBackend
+        self.assertEqual(authenticate.call_count, 1)
+
+    async def test_sessions_of_model_backend_still_load_their_user(self):
+        await self.async_client.aforce_login(self.user, backend = 'django.contrib.auth.backends.ModelBackend')
+        response = await self.async_client.get(reverse('login'))
+        # Logged in: sent to the dashboard
+        self.assertEqual(response.status_code, 302)
+
+    async def test_ais_valid_leaves_is_valid_authenticating(self):
+        form = self.form('wrong password')
+        self.assertFalse(await form.ais_valid())
+        self.assertFalse(form._authenticating_later)
+
+class HashingExecutorTests(TestCase):
+    def setUp(self):
+        self.executor = hashing.HashingExecutor(workers = 1, max_queue = 0)
+        self.addCleanup(async_to_sync(self.executor.ashutdown))
+
+    async def test_failures_are_counted_apart(self):
+        await self.executor.arun(os.getpid)
+        with self.assertRaises(ValueError):
+            await self.executor.arun(int, 'not a number')
+
+        snapshot = self.executor.snapshot()
+        self.assertEqual(snapshot['completed'], 1)
+        self.assertEqual(snapshot['failed'], 1)
+        self.assertEqual(snapshot['in_flight'], 0)
+
+    async def test_rejects_beyond_the_queue(self):
+        await self.executor.arun(os.getpid)
+        busy = asyncio.create_task(self.executor.arun(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        with self.assertRaises(hashing.HashingOverloadedError):
+            await self.executor.arun(os.getpid)
+        await busy
+
+        snapshot = self.executor.snapshot()
+        self.assertEqual(snapshot['completed'], 2)
+        self.assertEqual(snapshot['rejected'], 1)
+        self.assertEqual(snapshot['failed'], 0)
+
+class TokenBucketTests(SimpleTestCase):
+    def test_bursts_then_refills(self):
+        limiter = rate_limit.TokenBucketLimiter('test-refill', capacity = 2, period = 10)
+        bucket = None
+        for _ in range(2):
+            bucket, wait = limiter.take(bucket, now = 100)
+            self.assertEqual(wait, 0)
+        bucket, wait = limiter.take(bucket, now = 100)
+        self.assertAlmostEqual(wait, 5)
+        bucket, wait = limiter.take(bucket, now = 105)
+        self.assertEqual(wait, 0)
+        self.assertEqual((limiter.allowed, limiter.rejected), (3, 1))
+
+    async def arequest(self, view, method: str = 'post', remote_addr: str = '127.0.0.1') -> HttpResponse:
+        request = getattr(AsyncRequestFactory(), method)('/')
+        request.META['REMOTE_ADDR'] = remote_addr
+        return await view(request)
+
+    async def test_rejects_with_retry_after(self):
+        for limiter_class in (rate_limit.TokenBucketLimiter, rate_limit.CacheTokenBucketLimiter):
+            with self.subTest(limiter_class = limiter_class.__name__):
+                await cache.aclear()
+                limiter = limiter_class('test-view', capacity = 1, period = 60)
+
+                @rate_limit.arate_limited([(limiter, rate_limit.client_ip)])
+                async def view(request):
+                    return HttpResponse()
+
+                self.assertEqual((await self.arequest(view)).status_code, 200)
+                response = await self.arequest(view)
+                self.assertEqual(response.status_code, 429)
+                self.assertEqual(response['Retry-After'], '60')
+                # Another client, a request without key and a GET aren't limited
+                self.assertEqual((await self.arequest(view, remote_addr = '10.0.0.1')).status_code, 200)
+                self.assertEqual((await self.arequest(view, remote_addr = '')).status_code, 200)
+                self.assertEqual((await self.arequest(view, 'get')).status_code, 200)
+                self.assertEqual((limiter.allowed, limiter.rejected), (2, 1))
+
+class LoginRateLimitTests(TestCase):
+    async def test_login_is_rejected_once_the_email_bucket_is_empty(self):
+        email = 'flood@x.com'
+        limiter = next(limiter for limiter in rate_limit._limiters if limiter.name == 'login-email')
+        while not await limiter.atake(email):
+            pass
+
+        with mock.patch.object(hashing, 'averify_password') as averify:
+            response = await self.async_client.post(
+                reverse('login'), {'username': email.upper(), 'password': 'whatever'},
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        averify.assert_not_called()
@@ -1,54 +1,84 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.http import HttpRequest, HttpResponse
 from django.contrib.auth.decorators import login_required
 import django.contrib.auth as auth
 
+from common import rate_limit
 from common.auth import aanonymous_required
 
 from .forms import CustomAuthenticationForm, CustomUserCreationForm
+from .hashing import HashingOverloadedError
 from common.django_utils import arender, alogout
 from .models import CustomUser
 
+OVERLOADED_MESSAGE = 'Too many people are signing in right now. Please try again in a moment.'
+
+def auth_rate_limits(action: str, email_field: str) -> list:
+    """
+    Returns the rate limit rules (see 'common.rate_limit') of the attempts
+    to `action`, keyed by client IP and by the submitted email.
+    """
+    rules = []
+    for by, key_function, capacity in (
+            ('ip', rate_limit.client_ip, settings.AUTH_RATE_LIMIT_PER_IP),
+            ('email', rate_limit.post_field(email_field), settings.AUTH_RATE_LIMIT_PER_EMAIL),
+    ):
+        if capacity:
+            limiter = rate_limit.token_bucket(
+                f'{action}-{by}',
+                capacity = capacity,
+                period = settings.AUTH_RATE_LIMIT_PERIOD,
+                shared = settings.AUTH_RATE_LIMIT_SHARED_CACHE,
+            )
+            rules.append((limiter, key_function))
+    return rules
+
 @aanonymous_required
 async def home(request: HttpRequest) -> HttpResponse:
     return render(request, 'account/home.html')
 
+@rate_limit.arate_limited(auth_rate_limits('register', 'email'))
 @aanonymous_required
 async def register(request: HttpRequest) -> HttpResponse:
+    status = 200
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
         if await form.ais_valid():
-            await form.asave()
-            return redirect('login')
+            try:
+                await form.asave()
+                return redirect('login')
+            except HashingOverloadedError:
+                form.add_error(None, OVERLOADED_MESSAGE)
+                status = 503
     else:
         form = CustomUserCreationForm()
 
     context = { 'register_form': form }
-    return await arender(request, 'account/register.html', context)
+    return await arender(request, 'account/register.html', context, status = status)
 
+@rate_limit.arate_limited(auth_rate_limits('login', 'username'))
 @aanonymous_required
 async def login(request: HttpRequest) -> HttpResponse:
+    status = 200
     if request.method == 'POST':
         form = CustomAuthenticationForm(request, data = request.POST)
-        if await form.ais_valid():
-            email = request.POST['username']
-            passwd = request.POST['password']
-            user: CustomUser | None = await auth.aauthenticate(
-                request,
-                username = email,
-                password = passwd,
-            )
-
-            if user:
+        try:
+            # The form authenticates the user (once, in the hashing processes)
+            if await form.ais_valid():
+                user: CustomUser = form.get_user()
                 await auth.alogin(request, user)
                 return redirect(
                     'writer-dashboard' if user.is_writer else 'client-dashboard'
                     )
+        except HashingOverloadedError:
+            form.add_error(None, OVERLOADED_MESSAGE)
+            status = 503
     else:
         form = CustomAuthenticationForm()
 
     context = { 'login_form': form }
-    return await arender(request, 'account/login.html', context)
+    return await arender(request, 'account/login.html', context, status = status)
 
 @login_required(login_url='login')
 async def logout(request: HttpRequest) -> HttpResponse:
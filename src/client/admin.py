@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import PlanChoice, Subscription
+from .models import PlanChoice, Subscription, PayPalWebhookEvent, SubscriptionCancellation
 
 admin.site.register(PlanChoice)
-admin.site.register(Subscription)
\ No newline at end of file
+admin.site.register(Subscription)
+admin.site.register(PayPalWebhookEvent)
+admin.site.register(SubscriptionCancellation)
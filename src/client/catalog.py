@@ -0,0 +1,105 @@
+"""
+In-process catalog of the subscription plans (`PlanChoice`).
+
+The plans are a handful of rows that almost never change, so each process
+keeps all of them in memory, indexed by `plan_code`, `external_plan_id` and
+primary key, and serves them without any DB query or thread hop.
+
+Saving or deleting a plan (eg, in the admin) bumps a version number stored
+in Django's cache (see 'client.signals'). Each process compares its
+catalog's version with that one at most every `PLAN_CATALOG_CHECK_INTERVAL`
+seconds and reloads the catalog when they differ. With a cache shared by
+all the workers (CACHE_BACKEND 'file' or 'redis') every worker picks up the
+change. With 'locmem' each process has a version of its own, which only its
+changes bump, so there every check reloads the catalog instead (one query
+every `PLAN_CATALOG_CHECK_INTERVAL` seconds).
+
+NOTE: The `PlanChoice` instances in the catalog are shared by all the
+requests of the process. Never modify them.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/cache/#the-low-level-cache-api
+"""
+
+__all__ = (
+    'PlanCatalog',
+    'plan_catalog',
+    'aplan_catalog',
+    'invalidate_plan_catalog',
+)
+
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from django.conf import settings
+from django.core.cache import cache
+
+from asgiref.sync import sync_to_async
+
+from .models import PlanChoice
+
+PLAN_CATALOG_VERSION_KEY = 'client:plan-catalog-version'
+
+@dataclass(frozen = True)
+class PlanCatalog:
+    version: int
+    plans: tuple[PlanChoice, ...]
+    by_plan_code: Mapping[str, PlanChoice]
+    by_external_plan_id: Mapping[str, PlanChoice]
+    by_pk: Mapping[int, PlanChoice]
+
+    @property
+    def active(self) -> tuple[PlanChoice, ...]:
+        return tuple(plan for plan in self.plans if plan.is_active)
+
+    @classmethod
+    def load(cls, version: int) -> 'PlanCatalog':
+        plans = tuple(PlanChoice.objects.order_by('cost', 'id'))
+        return cls(
+            version = version,
+            plans = plans,
+            by_plan_code = MappingProxyType({plan.plan_code: plan for plan in plans}),
+            by_external_plan_id = MappingProxyType({plan.external_plan_id: plan for plan in plans}),
+            by_pk = MappingProxyType({plan.pk: plan for plan in plans}),
+        )
+
+_catalog: PlanCatalog | None = None
+_checked_at = 0.0
+
+def _initial_version() -> int:
+    # See 'writer.cache' on why we don't start from 1
+    return time.time_ns()
+
+def _is_check_due() -> bool:
+    return time.monotonic() - _checked_at >= settings.PLAN_CATALOG_CHECK_INTERVAL
+
+def _is_stale(version: int) -> bool:
+    return _catalog is None or _catalog.version != version or settings.CACHE_BACKEND == 'locmem'
+
+def plan_catalog() -> PlanCatalog:
+    global _catalog, _checked_at
+    if _catalog is None or _is_check_due():
+        version = cache.get_or_set(PLAN_CATALOG_VERSION_KEY, _initial_version, timeout = None)
+        if _is_stale(version):
+            _catalog = PlanCatalog.load(version)
+        _checked_at = time.monotonic()
+    return _catalog
+
+async def aplan_catalog() -> PlanCatalog:
+    global _catalog, _checked_at
+    if _catalog is None or _is_check_due():
+        version = await cache.aget_or_set(PLAN_CATALOG_VERSION_KEY, _initial_version, timeout = None)
+        if _is_stale(version):
+            _catalog = await sync_to_async(PlanCatalog.load)(version)
+        _checked_at = time.monotonic()
+    return _catalog
+
+def invalidate_plan_catalog():
+    global _catalog
+    _catalog = None
+    try:
+        cache.incr(PLAN_CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(PLAN_CATALOG_VERSION_KEY, _initial_version(), timeout = None)
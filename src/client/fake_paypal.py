@@ -0,0 +1,246 @@
+"""
+A fake PayPal, to run the subscription flows of 'client.paypal' offline and
+to load-test them at realistic PayPal latencies. Start it with the
+'fake_paypal' management command and point the PAYPAL_*_URL settings to it.
+
+It's a plain ASGI application (no Django involved) answering:
+
+    POST /v1/oauth2/token
+    GET  /v1/billing/subscriptions/<id>
+    POST /v1/billing/subscriptions/<id>/cancel
+    POST /v1/billing/subscriptions/<id>/revise
+    GET  /webapps/billing/approve/<id>     (the 'approve' link of a revise)
+    POST /v1/notifications/verify-webhook-signature
+
+The subscriptions live in memory. An unknown subscription id is taken as
+an active subscription to `default_plan_id`, so that the fake can serve
+any existing database.
+
+Every answer is delayed by a time drawn from a `LatencyDistribution`, and
+fails with `error_status` with probability `error_rate`.
+
+See:
+    https://asgi.readthedocs.io/en/latest/specs/www.html
+    https://developer.paypal.com/docs/api/subscriptions/v1/
+"""
+
+__all__ = (
+    'FakePayPal',
+    'LatencyDistribution',
+)
+
+import asyncio
+import json
+import random
+import re
+import secrets
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlencode
+
+ACCESS_TOKEN_EXPIRES_IN = 9 * 60 * 60
+
+@dataclass(frozen = True)
+class LatencyDistribution:
+    """
+    A distribution of response times, in seconds. Parsed from specs like
+    (times in milliseconds):
+
+        fixed:100           always 100 ms
+        uniform:50,250      between 50 and 250 ms
+        lognormal:120,0.5   median of 120 ms, long tail (sigma of 0.5)
+        exponential:100     mean of 100 ms
+    """
+    kind: str = 'fixed'
+    params: tuple[float, ...] = (0.0,)
+
+    KINDS = {
+        'fixed': (1, lambda rng, ms: ms),
+        'uniform': (2, lambda rng, low, high: rng.uniform(low, high)),
+        'lognormal': (2, lambda rng, median, sigma: rng.lognormvariate(0, sigma) * median),
+        'exponential': (1, lambda rng, mean: rng.expovariate(1 / mean) if mean else 0.0),
+    }
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyDistribution':
+        kind, _, params = spec.partition(':')
+        if kind not in cls.KINDS:
+            raise ValueError(f'Unknown latency distribution: {kind}')
+        try:
+            values = tuple(float(value) for value in params.split(',')) if params else ()
+        except ValueError:
+            raise ValueError(f'Invalid latency distribution: {spec}')
+        if len(values) != cls.KINDS[kind][0] or any(value < 0 for value in values):
+            raise ValueError(f'Invalid latency distribution: {spec}')
+        return cls(kind, values)
+
+    def sample(self, rng: random.Random) -> float:
+        return self.KINDS[self.kind][1](rng, *self.params) / 1000
+
+@dataclass
+class _Subscription:
+    id: str
+    plan_id: str
+    status: str = 'ACTIVE'
+    status_update_time: str = field(default_factory = lambda: _now())
+    # A plan change waiting for the subscriber's approval
+    pending_plan_id: str = ''
+    return_url: str = ''
+
+    def details(self) -> dict:
+        return {
+            'id': self.id,
+            'plan_id': self.plan_id,
+            'status': self.status,
+            'status_update_time': self.status_update_time,
+            'update_time': self.status_update_time,
+        }
+
+class FakePayPal:
+    def __init__(
+            self,
+            *,
+            latency: LatencyDistribution = LatencyDistribution(),
+            error_rate: float = 0.0,
+            error_status: int = 503,
+            default_plan_id: str = 'P-FAKE',
+            seed: int | None = None,
+    ):
+        if not (0 <= error_rate <= 1):
+            raise ValueError(f'Invalid error rate: {error_rate}')
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.default_plan_id = default_plan_id
+        self.rng = random.Random(seed)
+        self.subscriptions: dict[str, _Subscription] = {}
+        self.access_tokens: set[str] = set()
+        self.stats: dict[str, int] = {}
+        self.routes = (
+            ('POST', re.compile(r'/v1/oauth2/token'), self.token, False),
+            ('GET', re.compile(r'/v1/billing/subscriptions/(?P<id>[^/]+)'), self.get_subscription, True),
+            ('POST', re.compile(r'/v1/billing/subscriptions/(?P<id>[^/]+)/cancel'), self.cancel, True),
+            ('POST', re.compile(r'/v1/billing/subscriptions/(?P<id>[^/]+)/revise'), self.revise, True),
+            ('GET', re.compile(r'/webapps/billing/approve/(?P<id>[^/]+)'), self.approve, False),
+            ('POST', re.compile(r'/v1/notifications/verify-webhook-signature'), self.verify_webhook, True),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        await asyncio.sleep(self.latency.sample(self.rng))
+        status, headers, content = self.dispatch(scope, body)
+        self.stats[str(status)] = self.stats.get(str(status), 0) + 1
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), *headers],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    def dispatch(self, scope, body: bytes) -> tuple[int, list, bytes]:
+        if self.rng.random() < self.error_rate:
+            return _json(self.error_status, {'name': 'SERVICE_UNAVAILABLE', 'message': 'Injected error'})
+
+        for method, pattern, handler, needs_token in self.routes:
+            if match := pattern.fullmatch(scope['path']):
+                if scope['method'] != method:
+                    return _json(405, {'name': 'METHOD_NOT_SUPPORTED'})
+                if needs_token and not self.is_authorized(scope):
+                    return _json(401, {'error': 'invalid_token'})
+                query = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode()).items()}
+                try:
+                    data = json.loads(body) if body.strip().startswith(b'{') else {}
+                except ValueError:
+                    return _json(400, {'name': 'MALFORMED_REQUEST_JSON'})
+                return handler(data = data, query = query, base_url = _base_url(scope), **match.groupdict())
+        return _json(404, {'name': 'RESOURCE_NOT_FOUND'})
+
+    def is_authorized(self, scope) -> bool:
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                scheme, _, token = value.decode().partition(' ')
+                return scheme == 'Bearer' and token in self.access_tokens
+        return False
+
+    def subscription(self, id: str) -> _Subscription:
+        if id not in self.subscriptions:
+            self.subscriptions[id] = _Subscription(id = id, plan_id = self.default_plan_id)
+        return self.subscriptions[id]
+
+    def token(self, **kargs):
+        access_token = secrets.token_urlsafe(32)
+        self.access_tokens.add(access_token)
+        return _json(200, {
+            'access_token': access_token,
+            'token_type': 'Bearer',
+            'expires_in': ACCESS_TOKEN_EXPIRES_IN,
+        })
+
+    def get_subscription(self, id: str, **kargs):
+        return _json(200, self.subscription(id).details())
+
+    def cancel(self, id: str, **kargs):
+        subscription = self.subscription(id)
+        if subscription.status == 'CANCELLED':
+            return _json(422, {'name': 'UNPROCESSABLE_ENTITY', 'details': [{'issue': 'SUBSCRIPTION_STATUS_INVALID'}]})
+        subscription.status = 'CANCELLED'
+        subscription.status_update_time = _now()
+        return 204, [], b''
+
+    def revise(self, id: str, data: dict, base_url: str, **kargs):
+        subscription = self.subscription(id)
+        if subscription.status != 'ACTIVE' or not data.get('plan_id'):
+            return _json(422, {'name': 'UNPROCESSABLE_ENTITY'})
+        subscription.pending_plan_id = data['plan_id']
+        subscription.return_url = data.get('application_context', {}).get('return_url', '')
+        approve_url = f'{base_url}/webapps/billing/approve/{id}'
+        return _json(200, {
+            'plan_id': data['plan_id'],
+            'links': [{'rel': 'approve', 'href': approve_url, 'method': 'GET'}],
+        })
+
+    def approve(self, id: str, query: dict, **kargs):
+        """
+        Stands for the subscriber approving the plan change on PayPal: the
+        change is applied and the subscriber is sent back to the site.
+        """
+        subscription = self.subscription(id)
+        if not subscription.pending_plan_id:
+            return _json(422, {'name': 'UNPROCESSABLE_ENTITY'})
+        subscription.plan_id, subscription.pending_plan_id = subscription.pending_plan_id, ''
+        subscription.status_update_time = _now()
+        return_url = subscription.return_url
+        if return_url:
+            separator = '&' if '?' in return_url else '?'
+            location = f"{return_url}{separator}{urlencode({'subscription_id': id})}"
+            return 302, [(b'location', location.encode())], b''
+        return _json(200, subscription.details())
+
+    def verify_webhook(self, **kargs):
+        return _json(200, {'verification_status': 'SUCCESS'})
+
+def _json(status: int, data: dict) -> tuple[int, list, bytes]:
+    return status, [], json.dumps(data).encode()
+
+def _base_url(scope) -> str:
+    host = dict(scope['headers']).get(b'host', b'').decode()
+    if not host and scope.get('server'):
+        host = '{}:{}'.format(*scope['server'])
+    return f"{scope.get('scheme', 'http')}://{host}"
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
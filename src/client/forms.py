@@ -3,10 +3,10 @@ from typing import Iterable
 from django import forms
 from django.forms import Form
 from django.utils.translation import gettext_lazy as _t
-from asgiref.sync import sync_to_async
 
 from common.django_utils import AsyncModelFormMixin
 from .models import PlanChoice
+from .catalog import plan_catalog, aplan_catalog
 
 class UpdateSubscriptionForm(Form, AsyncModelFormMixin):
     plan_choices = forms.ChoiceField(label = _t('Update Plan Choices'))
@@ -16,23 +16,23 @@ class UpdateSubscriptionForm(Form, AsyncModelFormMixin):
             *args, 
             exclude: Iterable[str] | None = None, 
             format_fn = lambda plan_choice: plan_choice.name,
+            plan_choices: Iterable[PlanChoice] | None = None,
             **kargs
     ):
         super().__init__(*args, **kargs)
 
-        plan_choices = PlanChoice.objects.filter(is_active = True)
-        if exclude:
-            plan_choices = plan_choices.exclude(plan_code__in = exclude)
+        if plan_choices is None:
+            plan_choices = plan_catalog().active
+        exclude = set(exclude or ())
 
-        self.fields['plan_choices'].choices = (
+        self.fields['plan_choices'].choices = [
             (plan_choice.plan_code, format_fn(plan_choice))
             for plan_choice in plan_choices
-        )
+            if plan_choice.plan_code not in exclude
+        ]
 
     @classmethod
     async def ainit(cls, *args, **kargs) -> 'UpdateSubscriptionForm':
-        @sync_to_async
-        def call_init() -> UpdateSubscriptionForm:
-            return UpdateSubscriptionForm(*args, **kargs)
-        
-        return await call_init()
\ No newline at end of file
+        # With the plans taken from the catalog the form doesn't need the DB
+        catalog = await aplan_catalog()
+        return UpdateSubscriptionForm(*args, plan_choices = catalog.active, **kargs)
\ No newline at end of file
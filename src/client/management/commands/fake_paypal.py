@@ -0,0 +1,67 @@
+"""
+Runs a fake PayPal (see 'client.fake_paypal') with uvicorn, to use the
+site or load-test it without access to PayPal's sandbox. Then start the
+site with the PAYPAL_* settings printed by this command.
+
+Usage examples:
+    python manage.py fake_paypal
+    python manage.py fake_paypal --port 8100 --latency lognormal:150,0.5 --error-rate 0.02
+
+See:
+    https://www.uvicorn.org/deployment/#running-programmatically
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from client.fake_paypal import FakePayPal, LatencyDistribution
+
+class Command(BaseCommand):
+    help = 'Runs a fake PayPal API server for offline development and load tests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default = '127.0.0.1')
+        parser.add_argument('--port', type = int, default = 8100)
+        parser.add_argument(
+            '--latency', default = 'lognormal:120,0.5',
+            help = (
+                'Distribution of the response times, in ms: fixed:MS, uniform:MIN,MAX, '
+                'lognormal:MEDIAN,SIGMA or exponential:MEAN'
+            ),
+        )
+        parser.add_argument(
+            '--error-rate', type = float, default = 0.0,
+            help = 'Fraction of the requests that fail (eg, 0.01)',
+        )
+        parser.add_argument(
+            '--error-status', type = int, default = 503,
+            help = 'HTTP status of the failed requests (eg, 429 or 500)',
+        )
+        parser.add_argument(
+            '--plan-id', default = 'P-FAKE',
+            help = 'Plan of the subscriptions not yet known by the fake',
+        )
+        parser.add_argument('--seed', type = int, help = 'Seed of the random latencies and errors')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError("uvicorn is required: pip install 'uvicorn[standard]'")
+        try:
+            app = FakePayPal(
+                latency = LatencyDistribution.parse(options['latency']),
+                error_rate = options['error_rate'],
+                error_status = options['error_status'],
+                default_plan_id = options['plan_id'],
+                seed = options['seed'],
+            )
+        except ValueError as ex:
+            raise CommandError(str(ex))
+
+        base_url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write('Start the site with these settings to use this fake PayPal:')
+        self.stdout.write(f'    PAYPAL_AUTH_URL={base_url}/v1/oauth2/token')
+        self.stdout.write(f'    PAYPAL_BILLING_SUBSCRIPTIONS_URL={base_url}/v1/billing/subscriptions')
+        self.stdout.write(f'    PAYPAL_VERIFY_WEBHOOK_URL={base_url}/v1/notifications/verify-webhook-signature')
+        uvicorn.run(app, host = options['host'], port = options['port'], log_level = 'warning')
+        self.stdout.write(f'Responses by status: {app.stats}')
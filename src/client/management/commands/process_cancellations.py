@@ -0,0 +1,64 @@
+"""
+Cancels on PayPal the subscriptions in the cancellations outbox (see
+'client.outbox'), and reports the depth of the queue. Run it periodically
+(eg, from cron), or keep it running with `--every`, when the in-process
+workers are disabled (`CANCELLATION_INPROCESS_WORKER`) or to catch up with
+a backlog.
+
+Usage examples:
+    python manage.py process_cancellations
+    python manage.py process_cancellations --every 10 --batch-size 50
+    python manage.py process_cancellations --depth
+
+See:
+    https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+"""
+
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from client import outbox, paypal
+from contra import settings
+
+class Command(BaseCommand):
+    help = 'Cancels on PayPal the subscriptions in the cancellations outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type = float, default = 0,
+            help = 'Keep running, draining the outbox every this many seconds',
+        )
+        parser.add_argument(
+            '--batch-size', type = int, default = settings.CANCELLATION_BATCH_SIZE,
+            help = 'Cancellations processed concurrently',
+        )
+        parser.add_argument(
+            '--depth', action = 'store_true',
+            help = 'Only report the depth of the queue',
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.aprocess(options['every'], options['batch_size'], options['depth']))
+
+    async def aprocess(self, every: float, batch_size: int, depth_only: bool):
+        if depth_only:
+            self.write_depth(await outbox.aqueue_depth())
+            return
+
+        await paypal.aopen_http_client()
+        try:
+            while True:
+                processed = await outbox.adrain(batch_size)
+                self.stdout.write(f'Processed {processed} cancellations')
+                self.write_depth(await outbox.aqueue_depth())
+                if not every:
+                    break
+                await asyncio.sleep(every)
+        finally:
+            await paypal.aclose_http_client()
+
+    def write_depth(self, depth: dict[str, int]):
+        self.stdout.write(
+            f"Queue: {depth['pending']} pending ({depth['due']} due now), {depth['failed']} failed"
+        )
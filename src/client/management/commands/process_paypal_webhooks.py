@@ -0,0 +1,38 @@
+"""
+Processes the PayPal webhook events that are still pending, eg, because
+the worker that received them stopped before processing them. Run it
+periodically (eg, from cron).
+
+Usage examples:
+    python manage.py process_paypal_webhooks
+    python manage.py process_paypal_webhooks --every 60
+
+See:
+    https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+"""
+
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from client import webhooks
+
+class Command(BaseCommand):
+    help = 'Processes the pending PayPal webhook events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type = float, default = 0,
+            help = 'Keep running, processing the pending events every this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.aprocess(options['every']))
+
+    async def aprocess(self, every: float):
+        while True:
+            processed = await webhooks.aprocess_pending_events()
+            self.stdout.write(f'Processed {processed} pending PayPal webhook events')
+            if not every:
+                break
+            await asyncio.sleep(every)
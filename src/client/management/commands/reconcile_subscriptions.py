@@ -0,0 +1,194 @@
+"""
+Brings the status and plan of the local subscriptions in line with PayPal,
+for the events that the webhook (see 'client.webhooks') missed.
+
+The subscriptions are read from the DB in chunks of `--chunk-size`, in
+primary key order. The details of the subscriptions of a chunk are fetched
+from PayPal concurrently, at most `--concurrency` at a time, sharing one
+access token and the pooled HTTP client. The subscriptions that differ are
+then written back with a single `bulk_update` per chunk. The subscriptions
+whose cancellation is pending (or failed) are skipped, since PayPal still
+has them active until the outbox cancels them there. A subscription
+that PayPal fails to return (other than not finding it) is reported and
+counted as failed, and the run goes on.
+
+With `--checkpoint` the last subscription reconciled is saved to that file
+after every chunk, so that a run that was interrupted (eg, with Ctrl+C or
+because PayPal became unavailable) resumes where it stopped. The file is
+removed once the run completes.
+
+Usage examples:
+    python manage.py reconcile_subscriptions
+    python manage.py reconcile_subscriptions --concurrency 50 --checkpoint /var/tmp/reconcile.json
+
+See:
+    https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+    https://docs.djangoproject.com/en/5.1/ref/models/querysets/#bulk-update
+    https://developer.paypal.com/docs/api/subscriptions/v1/#subscriptions_get
+"""
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from client import paypal
+from client.catalog import aplan_catalog
+from client.models import Subscription, SubscriptionCancellation
+from contra import settings
+
+UPDATE_FIELDS = ('is_active', 'plan_choice', 'external_updated_at')
+
+class Command(BaseCommand):
+    help = "Updates the subscriptions' status and plan with their details on PayPal."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type = int, default = 1_000,
+            help = 'Subscriptions read from the DB (and written back) at a time',
+        )
+        parser.add_argument(
+            '--concurrency', type = int, default = settings.PAYPAL_MAX_CONNECTIONS,
+            help = 'Maximum number of concurrent requests to PayPal',
+        )
+        parser.add_argument(
+            '--checkpoint', type = Path,
+            help = 'File where the progress is saved, to resume an interrupted run',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--chunk-size and --concurrency must be positive')
+        checkpoint = Path(options['checkpoint']) if options['checkpoint'] else None
+        asyncio.run(self.areconcile(options['chunk_size'], options['concurrency'], checkpoint))
+
+    async def areconcile(self, chunk_size: int, concurrency: int, checkpoint: Path | None):
+        progress = self.load_checkpoint(checkpoint)
+        if progress['last_id']:
+            self.stdout.write(f"Resuming after the subscription {progress['last_id']}")
+        # The ones being cancelled are left alone: PayPal still has them active
+        subscriptions = Subscription.objects.exclude(
+            external_subscription_id__in = SubscriptionCancellation.requested_ids(),
+        )
+        total = progress['checked'] + await subscriptions.filter(id__gt = progress['last_id']).acount()
+        semaphore = asyncio.Semaphore(concurrency)
+        started_at = time.monotonic()
+        checked_at_start = progress['checked']
+
+        await paypal.aopen_http_client()
+        try:
+            while True:
+                chunk = [
+                    subscription async for subscription in subscriptions
+                    .filter(id__gt = progress['last_id'])
+                    .order_by('id')
+                    .only('id', 'external_subscription_id', *UPDATE_FIELDS)[:chunk_size]
+                ]
+                if not chunk:
+                    break
+
+                results = await asyncio.gather(*(
+                    self.afetch_details(semaphore, subscription) for subscription in chunk
+                ))
+                catalog = await aplan_catalog()
+                changed = []
+                missing = unavailable = failed = 0
+                for subscription, details in zip(chunk, results):
+                    if details is None:
+                        missing += 1
+                        continue
+                    if isinstance(details, paypal.PayPalUnavailableError):
+                        unavailable += 1
+                        continue
+                    if isinstance(details, httpx.HTTPStatusError):
+                        failed += 1
+                        self.stderr.write(f'Subscription {subscription.external_subscription_id}: {details}')
+                        continue
+                    # Without a time, PayPal's state isn't taken as newer than ours
+                    changed_at = parse_datetime(
+                        details.get('status_update_time') or details.get('update_time') or ''
+                    )
+                    if subscription.apply_external_state(
+                        status = details.get('status', ''),
+                        plan_choice = catalog.by_external_plan_id.get(details.get('plan_id')),
+                        changed_at = changed_at,
+                    ):
+                        changed.append(subscription)
+                if changed:
+                    await Subscription.objects.abulk_update(changed, UPDATE_FIELDS)
+                progress['updated'] += len(changed)
+
+                if unavailable:
+                    # Don't move past this chunk: it's checked again (which
+                    # is harmless) when the run is resumed
+                    self.save_checkpoint(checkpoint, progress)
+                    raise CommandError(
+                        f'PayPal is unavailable ({unavailable} requests failed, '
+                        f'circuit breaker: {paypal.circuit_breaker.state}). '
+                        + ('Run the command again to resume.' if checkpoint else '')
+                    )
+
+                progress['last_id'] = chunk[-1].id
+                progress['checked'] += len(chunk)
+                progress['missing'] += missing
+                progress['failed'] += failed
+                self.save_checkpoint(checkpoint, progress)
+                rate = (progress['checked'] - checked_at_start) / (time.monotonic() - started_at)
+                self.stdout.write(
+                    f"{progress['checked']}/{total} checked, {progress['updated']} updated, "
+                    f"{progress['missing']} not found on PayPal, {progress['failed']} failed ({rate:.0f}/s)"
+                )
+        finally:
+            await paypal.aclose_http_client()
+
+        if checkpoint:
+            checkpoint.unlink(missing_ok = True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {progress['checked']} checked, {progress['updated']} updated, "
+            f"{progress['missing']} not found on PayPal, {progress['failed']} failed"
+        ))
+
+    async def afetch_details(
+            self,
+            semaphore: asyncio.Semaphore,
+            subscription: Subscription,
+    ) -> dict | paypal.PayPalUnavailableError | httpx.HTTPStatusError | None:
+        """
+        Returns the details of `subscription` on PayPal, `None` if PayPal
+        doesn't know it, or the error if PayPal couldn't be reached or
+        failed to answer.
+        """
+        async with semaphore:
+            try:
+                # The token is cached, so this only requests one when needed
+                access_token = await paypal.get_access_token()
+                return await paypal.get_subscription_details(
+                    access_token, subscription.external_subscription_id,
+                )
+            except paypal.PayPalUnavailableError as ex:
+                return ex
+            except httpx.HTTPStatusError as ex:
+                if ex.response.status_code == httpx.codes.NOT_FOUND:
+                    return None
+                return ex
+
+    @staticmethod
+    def load_checkpoint(checkpoint: Path | None) -> dict:
+        progress = {'last_id': 0, 'checked': 0, 'updated': 0, 'missing': 0, 'failed': 0}
+        if checkpoint and checkpoint.exists():
+            progress.update(json.loads(checkpoint.read_text()))
+        return progress
+
+    @staticmethod
+    def save_checkpoint(checkpoint: Path | None, progress: dict):
+        if checkpoint:
+            # Write and rename, so that an interruption never leaves a
+            # truncated checkpoint behind
+            tmp_path = checkpoint.with_name(checkpoint.name + '.tmp')
+            tmp_path.write_text(json.dumps(progress))
+            os.replace(tmp_path, checkpoint)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0005_alter_subscription_external_subscription_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='external_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PayPalWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Event ID')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Event type')),
+                ('resource_id', models.CharField(blank=True, max_length=255, verbose_name='Resource ID')),
+                ('payload', models.JSONField(verbose_name='Payload')),
+                ('transmission', models.JSONField(verbose_name='Transmission headers')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('A', 'Applied'), ('I', 'Ignored'), ('R', 'Rejected')], default='P', max_length=1)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'received_at'], name='webhook_event_status_idx')],
+            },
+        ),
+    ]
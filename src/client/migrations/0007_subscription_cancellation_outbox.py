@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0006_paypal_webhook_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionCancellation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('external_subscription_id', models.CharField(max_length=255, unique=True, verbose_name='External subscription ID')),
+                ('reason', models.CharField(max_length=127, verbose_name='Reason')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='cancellation_status_idx')],
+            },
+        ),
+    ]
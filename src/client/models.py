@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django.utils import timezone
 from django.db import models
 from django.utils.translation import gettext_lazy as _t
@@ -14,6 +16,8 @@ PLAN_CHOICE_DESC_MAX_LEN = 300
 EXTERNAL_ID_MAX_LEN = 255
 EXTERNAL_API_MAX_LEN = 2000
 EXTERNAL_STYLE_MAX_LEN = 2000
+WEBHOOK_EVENT_TYPE_MAX_LEN = 100
+CANCELLATION_REASON_MAX_LEN = 127
 
 class PlanChoice(models.Model):
     plan_code = models.CharField(
@@ -51,11 +55,19 @@ class PlanChoice(models.Model):
     
     @classmethod
     def from_plan_code(cls, plan_code: str) -> 'PlanChoice':
-        return PlanChoice.objects.get(plan_code = plan_code)
+        from .catalog import plan_catalog
+        try:
+            return plan_catalog().by_plan_code[plan_code]
+        except KeyError:
+            raise PlanChoice.DoesNotExist(f'Unknown plan code: {plan_code}')
 
     @classmethod
     async def afrom_plan_code(cls, plan_code: str) -> 'PlanChoice':
-        return await PlanChoice.objects.aget(plan_code = plan_code)
+        from .catalog import aplan_catalog
+        try:
+            return (await aplan_catalog()).by_plan_code[plan_code]
+        except KeyError:
+            raise PlanChoice.DoesNotExist(f'Unknown plan code: {plan_code}')
 
 class Subscription(models.Model):
     cost = models.DecimalField(
@@ -66,6 +78,8 @@ class Subscription(models.Model):
     )
     is_active = models.BooleanField(default = False)
     date_added = models.DateTimeField(default = timezone.now)
+    # Time of the last change made on PayPal that we've applied locally
+    external_updated_at = models.DateTimeField(null = True, blank = True)
     user = models.OneToOneField(CustomUser, on_delete = models.CASCADE)
     plan_choice = models.ForeignKey(PlanChoice, on_delete=models.CASCADE)
 
@@ -74,20 +88,148 @@ class Subscription(models.Model):
         return f'{self.user.firstName} {self.user.lastName}: {plan_choice.name} {_t2("subscription")}'
 
     async def aplan_choice(self) -> PlanChoice:
+        if Subscription.plan_choice.is_cached(self):
+            return self.plan_choice
+
         @sync_to_async
         def call_sync_fk() -> PlanChoice:
             return self.plan_choice
         return await call_sync_fk()
 
+    def apply_external_state(
+            self,
+            *,
+            status: str,
+            plan_choice: PlanChoice | None,
+            changed_at: datetime | None,
+    ) -> list[str]:
+        """
+        Applies the state of the subscription on PayPal (its `status` and
+        plan), unless we've already applied a more recent one. Returns the
+        names of the fields that changed (without saving them), none if the
+        status and plan are already the same.
+
+        Without `changed_at` (PayPal didn't say when the state changed) the
+        state is applied, but not taken as more recent than any other.
+        """
+        if changed_at and self.external_updated_at and changed_at <= self.external_updated_at:
+            return []
+        changed_fields = []
+        if status and self.is_active != (status == 'ACTIVE'):
+            self.is_active = (status == 'ACTIVE')
+            changed_fields.append('is_active')
+        if plan_choice and self.plan_choice_id != plan_choice.pk:
+            self.plan_choice = plan_choice
+            changed_fields.append('plan_choice')
+        if changed_fields and changed_at:
+            self.external_updated_at = changed_at
+            changed_fields.append('external_updated_at')
+        return changed_fields
+
     async def ais_premium(self) -> bool:
         return (await self.aplan_choice()).plan_code == 'PR'
     
     @staticmethod
     async def afor_user(user: CustomUser, status = '') -> 'Subscription | None':
+        if CustomUser.subscription.is_cached(user):
+            # Already loaded with the user (see 'common.auth.SubscriptionModelBackend')
+            subscription = getattr(user, 'subscription', None)
+            if subscription and status in ('A', 'I') and subscription.is_active != (status == 'A'):
+                return None
+            return subscription
+
         kargs: dict = {'user': user}
         if status in ('A', 'I'):
             kargs.update(is_active = (status == 'A'))
         try:
             return await Subscription.objects.aget(**kargs)
         except ObjectDoesNotExist:
-            return None
\ No newline at end of file
+            return None
+
+class PayPalWebhookEvent(models.Model):
+    """
+    A webhook event received from PayPal (see 'client.webhooks'). PayPal
+    may deliver the same event more than once: its `event_id` makes sure
+    it's recorded, and applied, only once. Only verified deliveries are
+    recorded (REJECTED is left from when they were verified afterwards).
+    """
+    class Status(models.TextChoices):
+        PENDING = 'P', _t('Pending')
+        APPLIED = 'A', _t('Applied')
+        IGNORED = 'I', _t('Ignored')
+        REJECTED = 'R', _t('Rejected')
+
+    event_id = models.CharField(
+        max_length = EXTERNAL_ID_MAX_LEN, unique = True, verbose_name = _t('Event ID')
+    )
+    event_type = models.CharField(
+        max_length = WEBHOOK_EVENT_TYPE_MAX_LEN, verbose_name = _t('Event type')
+    )
+    resource_id = models.CharField(
+        max_length = EXTERNAL_ID_MAX_LEN, blank = True, verbose_name = _t('Resource ID')
+    )
+    payload = models.JSONField(verbose_name = _t('Payload'))
+    transmission = models.JSONField(verbose_name = _t('Transmission headers'))
+    status = models.CharField(max_length = 1, choices = Status, default = Status.PENDING)
+    received_at = models.DateTimeField(default = timezone.now)
+    processed_at = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['status', 'received_at'], name = 'webhook_event_status_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.event_type} ({self.event_id})'
+
+class SubscriptionCancellation(models.Model):
+    """
+    Outbox of the subscriptions to cancel on PayPal (see 'client.outbox').
+    The local subscription is marked as inactive, and this row created, in
+    the same transaction. The cancellation on PayPal is made later, and
+    retried until it succeeds (then the local subscription is deleted) or
+    fails for good.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'P', _t('Pending')
+        DONE = 'D', _t('Done')
+        FAILED = 'F', _t('Failed')
+
+    external_subscription_id = models.CharField(
+        max_length = EXTERNAL_ID_MAX_LEN, unique = True, verbose_name = _t('External subscription ID')
+    )
+    reason = models.CharField(max_length = CANCELLATION_REASON_MAX_LEN, verbose_name = _t('Reason'))
+    status = models.CharField(max_length = 1, choices = Status, default = Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default = 0)
+    # Not processed before this time: set when a worker claims the row and
+    # when an attempt fails, to wait before retrying
+    next_attempt_at = models.DateTimeField(default = timezone.now)
+    last_error = models.TextField(blank = True)
+    created_at = models.DateTimeField(default = timezone.now)
+    processed_at = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['status', 'next_attempt_at'], name = 'cancellation_status_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.external_subscription_id} ({self.get_status_display()})'
+
+    @staticmethod
+    def requested_ids() -> models.QuerySet:
+        """
+        Returns the external ids of the subscriptions whose cancellation is
+        pending or failed. PayPal still reports them as active, which mustn't
+        reactivate them (see 'client.webhooks' and 'reconcile_subscriptions').
+        """
+        return SubscriptionCancellation.objects.exclude(
+            status = SubscriptionCancellation.Status.DONE,
+        ).values('external_subscription_id')
+
+    @staticmethod
+    async def ahas_failed(external_subscription_id: str) -> bool:
+        return await SubscriptionCancellation.objects.filter(
+            external_subscription_id = external_subscription_id,
+            status = SubscriptionCancellation.Status.FAILED,
+        ).aexists()
@@ -0,0 +1,275 @@
+"""
+Cancellation of subscriptions on PayPal through an outbox.
+
+Cancelling a subscription marks it as inactive and records a
+`SubscriptionCancellation` in the same transaction, so the user doesn't
+wait on PayPal. The local subscription is only deleted once PayPal has
+cancelled it, in the same transaction that records the outcome: if the
+cancellation fails for good, the subscription (and its external id) is
+still there, the dashboard tells the user, and cancelling it again retries
+it. The outbox is drained in the background, in batches, either by a
+worker running inside each ASGI process (started by the lifespan, see
+'contra.asgi') or by the 'process_cancellations' management command. Both
+can run at the same time: each cancellation is claimed by a single worker.
+
+A failed attempt is retried with an exponential backoff, up to
+`CANCELLATION_MAX_ATTEMPTS` times. Cancelling on PayPal a subscription that
+is already cancelled (eg, a worker stopped after cancelling it but before
+recording it) fails with a 422, which we consider a success.
+
+See:
+    https://microservices.io/patterns/data/transactional-outbox.html
+    https://developer.paypal.com/docs/api/subscriptions/v1/#subscriptions_cancel
+"""
+
+__all__ = (
+    'arequest_cancellation',
+    'adrain',
+    'aqueue_depth',
+    'notify_worker',
+    'astart_worker',
+    'astop_worker',
+)
+
+import asyncio
+import logging
+from datetime import timedelta
+
+import httpx
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from asgiref.sync import sync_to_async
+
+from common.db_routing import create_background_task
+from contra import settings
+from . import paypal
+from .models import Subscription, SubscriptionCancellation
+
+logger = logging.getLogger(__name__)
+
+# A cancellation claimed by a worker that didn't finish processing it in
+# this time (eg, the worker was restarted) can be claimed again
+CLAIM_TIMEOUT = timedelta(minutes = 5)
+
+# PayPal's answers meaning that there's nothing left to cancel
+ALREADY_CANCELLED_STATUSES = (httpx.codes.NOT_FOUND, httpx.codes.UNPROCESSABLE_ENTITY)
+
+UPDATE_FIELDS = ('status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at')
+
+Status = SubscriptionCancellation.Status
+
+async def arequest_cancellation(
+        subscription: Subscription,
+        reason: str = 'Not specified',
+) -> SubscriptionCancellation:
+    """
+    Marks `subscription` as inactive and records its cancellation on
+    PayPal, in the same transaction.
+    """
+    @sync_to_async
+    def record() -> SubscriptionCancellation:
+        with transaction.atomic():
+            cancellation, _ = SubscriptionCancellation.objects.update_or_create(
+                external_subscription_id = subscription.external_subscription_id,
+                defaults = {
+                    'reason': reason,
+                    'status': Status.PENDING,
+                    'attempts': 0,
+                    'next_attempt_at': timezone.now(),
+                    'last_error': '',
+                    'processed_at': None,
+                },
+            )
+            Subscription.objects.filter(pk = subscription.pk).update(is_active = False)
+        return cancellation
+
+    cancellation = await record()
+    notify_worker()
+    return cancellation
+
+async def adrain(batch_size: int | None = None) -> int:
+    """
+    Processes the cancellations that are due, `batch_size` at a time (the
+    ones of a batch concurrently). Returns how many were processed.
+    """
+    batch_size = batch_size or settings.CANCELLATION_BATCH_SIZE
+    processed = 0
+    while True:
+        due = SubscriptionCancellation.objects.filter(_due()).order_by('next_attempt_at')
+        candidates = [pk async for pk in due.values_list('pk', flat = True)[:batch_size]]
+        if not candidates:
+            return processed
+
+        batch = await _aclaim(candidates)
+        await asyncio.gather(*(_aprocess(cancellation) for cancellation in batch))
+        await _asave_outcomes(batch)
+        processed += len(batch)
+
+async def aqueue_depth() -> dict[str, int]:
+    """
+    Returns the number of pending cancellations, how many of them are due
+    now, and the number of cancellations that gave up.
+    """
+    return await SubscriptionCancellation.objects.aaggregate(
+        pending = Count('pk', filter = Q(status = Status.PENDING)),
+        due = Count('pk', filter = _due()),
+        failed = Count('pk', filter = Q(status = Status.FAILED)),
+    )
+
+async def _aclaim(candidates: list[int]) -> list[SubscriptionCancellation]:
+    """
+    Claims the `candidates` that are still due, with a single UPDATE, and
+    returns them.
+    """
+    # Push the next attempt forward, so that no other worker processes them
+    # at the same time. The time (to the microsecond) tells our claims apart
+    claimed_until = timezone.now() + CLAIM_TIMEOUT
+    if not await SubscriptionCancellation.objects.filter(_due(), pk__in = candidates).aupdate(
+            next_attempt_at = claimed_until,
+    ):
+        return []
+    return [
+        cancellation async for cancellation in SubscriptionCancellation.objects.filter(
+            pk__in = candidates, status = Status.PENDING, next_attempt_at = claimed_until,
+        )
+    ]
+
+@sync_to_async
+def _asave_outcomes(batch: list[SubscriptionCancellation]):
+    """
+    Saves the outcomes of `batch` and deletes the subscriptions that PayPal
+    has cancelled, in the same transaction.
+    """
+    cancelled = [c.external_subscription_id for c in batch if c.status == Status.DONE]
+    with transaction.atomic():
+        SubscriptionCancellation.objects.bulk_update(batch, UPDATE_FIELDS)
+        if cancelled:
+            Subscription.objects.filter(external_subscription_id__in = cancelled).delete()
+
+async def _aprocess(cancellation: SubscriptionCancellation):
+    """
+    Cancels the subscription on PayPal and updates `cancellation` (without
+    saving it) with the outcome.
+    """
+    cancellation.attempts += 1
+    try:
+        access_token = await paypal.get_access_token()
+        await paypal.cancel_subscription(
+            access_token, cancellation.external_subscription_id, cancellation.reason,
+        )
+    except paypal.PayPalUnavailableError as ex:
+        _retry_later(cancellation, ex)
+        return
+    except httpx.HTTPStatusError as ex:
+        status_code = ex.response.status_code
+        if status_code == httpx.codes.UNAUTHORIZED:
+            # The token was already invalidated: the retry gets a new one
+            _retry_later(cancellation, ex)
+            return
+        if status_code not in ALREADY_CANCELLED_STATUSES:
+            cancellation.status = Status.FAILED
+            cancellation.last_error = repr(ex)
+            logger.error('Unable to cancel the PayPal subscription %s: %r', cancellation, ex)
+            return
+        cancellation.last_error = f'Already cancelled (PayPal answered {status_code})'
+    except Exception as ex:
+        # Anything else (eg, a broken connection or an unexpected answer)
+        # still counts as an attempt, so that it eventually gives up
+        logger.exception('Unexpected error cancelling the PayPal subscription %s', cancellation)
+        _retry_later(cancellation, ex)
+        return
+
+    cancellation.status = Status.DONE
+    cancellation.processed_at = timezone.now()
+
+def _retry_later(cancellation: SubscriptionCancellation, error: Exception):
+    cancellation.last_error = repr(error)
+    if cancellation.attempts >= settings.CANCELLATION_MAX_ATTEMPTS:
+        cancellation.status = Status.FAILED
+        logger.error('Giving up cancelling the PayPal subscription %s: %r', cancellation, error)
+        return
+    backoff = min(
+        settings.CANCELLATION_RETRY_BACKOFF * 2 ** (cancellation.attempts - 1),
+        settings.CANCELLATION_MAX_RETRY_BACKOFF,
+    )
+    cancellation.next_attempt_at = timezone.now() + timedelta(seconds = backoff)
+
+def _due() -> Q:
+    return Q(status = Status.PENDING, next_attempt_at__lte = timezone.now())
+
+class _Worker:
+    """
+    Drains the outbox every `poll_interval` seconds, or as soon as it's
+    woken up (ie, when a cancellation is requested).
+    """
+    def __init__(self, poll_interval: float, batch_size: int):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task = create_background_task(self._arun())
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def astop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _arun(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if processed := await adrain(self.batch_size):
+                    logger.info('Processed %d cancellations, queue: %s', processed, await aqueue_depth())
+            except Exception:
+                logger.exception('Unable to drain the cancellations outbox')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout = self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+_worker: _Worker | None = None
+_background_tasks: set[asyncio.Task] = set()
+
+def notify_worker():
+    """
+    Gets the outbox drained right away: by the in-process worker, if it's
+    running, or else by a background task.
+    """
+    if _worker is not None:
+        _worker.wake()
+        return
+    task = create_background_task(_adrain_logged())
+    # The loop only keeps weak references to its tasks
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _adrain_logged():
+    try:
+        await adrain()
+    except Exception:
+        logger.exception('Unable to drain the cancellations outbox')
+
+async def astart_worker():
+    """
+    Starts the in-process worker, if enabled. Called by the ASGI lifespan
+    startup.
+    """
+    global _worker
+    if _worker is None and settings.CANCELLATION_INPROCESS_WORKER:
+        _worker = _Worker(settings.CANCELLATION_POLL_INTERVAL, settings.CANCELLATION_BATCH_SIZE)
+
+async def astop_worker():
+    """
+    Stops the in-process worker. The cancellation it was processing, if
+    any, is claimed again by a worker after `CLAIM_TIMEOUT`.
+    """
+    global _worker
+    if _worker is not None:
+        worker, _worker = _worker, None
+        await worker.astop()
@@ -6,13 +6,157 @@ See:
     https://developer.mozilla.org/en-US/docs/Web/HTTP/Authentication
 """
 
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+
 import httpx
+from django.core.cache import cache
 
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError
 from contra import settings
 
+ACCESS_TOKEN_CACHE_KEY = 'client:paypal-access-token'
+
+logger = logging.getLogger(__name__)
+
+class PayPalUnavailableError(Exception):
+    """
+    PayPal didn't answer in time, failed with a server error or calls to it
+    are suspended by the circuit breaker.
+    """
+
+# Its state can be checked with `circuit_breaker.snapshot()`
+circuit_breaker = CircuitBreaker(
+    'paypal',
+    window = settings.PAYPAL_BREAKER_WINDOW,
+    min_calls = settings.PAYPAL_BREAKER_MIN_CALLS,
+    failure_rate = settings.PAYPAL_BREAKER_FAILURE_RATE,
+    reset_timeout = settings.PAYPAL_BREAKER_RESET_TIMEOUT,
+)
+
+_shared_client: httpx.AsyncClient | None = None
+
+def _http_client_options() -> dict:
+    return {
+        # HTTP/2 needs the 'h2' package (ie, 'pip install httpx[http2]')
+        'http2': settings.PAYPAL_HTTP2 and importlib.util.find_spec('h2') is not None,
+        'limits': httpx.Limits(
+            max_connections = settings.PAYPAL_MAX_CONNECTIONS,
+            max_keepalive_connections = settings.PAYPAL_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry = settings.PAYPAL_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(
+            settings.PAYPAL_READ_TIMEOUT,
+            connect = settings.PAYPAL_CONNECT_TIMEOUT,
+        ),
+    }
+
+async def aopen_http_client(transport: httpx.AsyncBaseTransport | None = None):
+    """
+    Creates the HTTP client shared by all the calls to PayPal made by this
+    process, keeping its connections alive between calls. Called by the
+    ASGI lifespan startup (see 'contra.asgi').
+
+    A `transport` (eg, an `httpx.MockTransport`) replaces the network, which
+    is useful to test how we deal with slow or failing responses.
+    """
+    global _shared_client
+    if _shared_client is None:
+        options = _http_client_options()
+        if transport is not None:
+            options.update(transport = transport)
+        _shared_client = httpx.AsyncClient(**options)
+
+async def aclose_http_client():
+    """
+    Closes the shared HTTP client and its connections. Called by the ASGI
+    lifespan shutdown.
+    """
+    global _shared_client
+    if _shared_client is not None:
+        client, _shared_client = _shared_client, None
+        await client.aclose()
+
+@asynccontextmanager
+async def _http_client() -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Yields the shared HTTP client. Without one (eg, with 'runserver', which
+    runs each async view in its own event loop, or in management commands)
+    a client is created and closed just for the call.
+    """
+    if _shared_client is not None:
+        yield _shared_client
+    else:
+        async with httpx.AsyncClient(**_http_client_options()) as client:
+            yield client
+
+@dataclass(frozen = True)
+class AccessToken:
+    value: str
+    expires_at: float   # seconds since the epoch (not monotonic, it's shared by processes)
+
+    def is_fresh(self) -> bool:
+        """
+        A token is renewed `PAYPAL_TOKEN_REFRESH_MARGIN` seconds before it
+        expires, so that it never expires while a request is using it.
+        """
+        return time.time() < self.expires_at - settings.PAYPAL_TOKEN_REFRESH_MARGIN
+
+_access_token: AccessToken | None = None
+_refresh_task: asyncio.Task | None = None
+
 async def get_access_token() -> str:
     """
     Returns an OAuth 2 access token from PayPal.
+
+    The token is cached by the process until it's about to expire. When it
+    has to be renewed, concurrent callers share a single request to PayPal
+    instead of each one making its own. With `PAYPAL_TOKEN_SHARED_CACHE` the
+    token is also shared with the other workers through Django's cache.
+    """
+    global _refresh_task
+    if _access_token and _access_token.is_fresh():
+        return _access_token.value
+
+    loop = asyncio.get_running_loop()
+    if _refresh_task is None or _refresh_task.done() or _refresh_task.get_loop() is not loop:
+        _refresh_task = loop.create_task(_refresh_access_token())
+    # `shield` so that a cancelled caller doesn't cancel the refresh for the
+    # other callers waiting on it
+    return (await asyncio.shield(_refresh_task)).value
+
+def invalidate_access_token():
+    """
+    Forgets the cached token (eg, after PayPal rejects it with a 401).
+    """
+    global _access_token
+    _access_token = None
+    if settings.PAYPAL_TOKEN_SHARED_CACHE:
+        cache.delete(ACCESS_TOKEN_CACHE_KEY)
+
+async def _refresh_access_token() -> AccessToken:
+    global _access_token
+    if settings.PAYPAL_TOKEN_SHARED_CACHE:
+        if (shared := await cache.aget(ACCESS_TOKEN_CACHE_KEY)) and shared.is_fresh():
+            _access_token = shared
+            return shared
+
+    token = await _fetch_access_token()
+    _access_token = token
+    if settings.PAYPAL_TOKEN_SHARED_CACHE:
+        timeout = max(int(token.expires_at - time.time() - settings.PAYPAL_TOKEN_REFRESH_MARGIN), 1)
+        await cache.aset(ACCESS_TOKEN_CACHE_KEY, token, timeout)
+    return token
+
+async def _fetch_access_token() -> AccessToken:
+    """
+    Requests a new OAuth 2 access token from PayPal.
     """
     headers = {
         'Accept': 'application/json',
@@ -22,17 +166,20 @@ async def get_access_token() -> str:
     auth = (settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID)
     data = {'grant_type': 'client_credentials'}
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            settings.PAYPAL_AUTH_URL,
-            auth = auth,
-            headers = headers,
-            data = data,
-        )
-        resp.raise_for_status()
-
-        resp_data = resp.json()
-        return resp_data['access_token']
+    # Requesting a new token has no side effects, so it can be retried
+    resp = await _arequest(
+        'POST',
+        settings.PAYPAL_AUTH_URL,
+        idempotent = True,
+        auth = auth,
+        headers = headers,
+        data = data,
+    )
+    resp_data = resp.json()
+    return AccessToken(
+        value = resp_data['access_token'],
+        expires_at = time.time() + int(resp_data.get('expires_in', 0)),
+    )
 
 """
 client.post(..) -> co-routine
@@ -52,11 +199,8 @@ async def cancel_subscription(
         'Accept': 'application/json',
     }
     cancel_data = {'reason': reason}
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, headers = headers, json = cancel_data)
-        resp.raise_for_status()
-
-        print(f'[+] {resp.status_code}')
+    resp = await _arequest('POST', url, headers = headers, json = cancel_data)
+    logger.debug('PayPal cancelled the subscription %s: %d', subscription_id, resp.status_code)
 
 async def update_subscription_plan(
         access_token: str,
@@ -81,18 +225,15 @@ async def update_subscription_plan(
     }
     approval_url = ''
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, headers = headers, json = update_data)
-        resp.raise_for_status()
+    resp = await _arequest('POST', url, headers = headers, json = update_data)
+    logger.debug('PayPal revised the subscription %s: %d', subscription_id, resp.status_code)
 
-        print(f'[+] {resp.status_code}')
+    resp_data = resp.json()
 
-        resp_data = resp.json()
-
-        for link_details in resp_data.get('links', []):
-            if link_details.get('rel') == 'approve':
-                approval_url = link_details['href']
-                break
+    for link_details in resp_data.get('links', []):
+        if link_details.get('rel') == 'approve':
+            approval_url = link_details['href']
+            break
 
     return approval_url
 
@@ -106,7 +247,104 @@ async def get_subscription_details(
         'Content-Type': 'application/json',
         'Accept': 'application/json',
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers = headers)
-        resp.raise_for_status()
-        return resp.json()
\ No newline at end of file
+    resp = await _arequest('GET', url, idempotent = True, headers = headers)
+    return resp.json()
+
+WEBHOOK_TRANSMISSION_HEADERS = (
+    'paypal-auth-algo',
+    'paypal-cert-url',
+    'paypal-transmission-id',
+    'paypal-transmission-sig',
+    'paypal-transmission-time',
+)
+
+async def verify_webhook_signature(
+        access_token: str,
+        transmission: dict,
+        webhook_event: dict,
+) -> bool:
+    """
+    Asks PayPal whether `webhook_event` was really sent by PayPal to our
+    webhook `PAYPAL_WEBHOOK_ID`. `transmission` has the
+    `WEBHOOK_TRANSMISSION_HEADERS` of the webhook request.
+
+    See:
+        https://developer.paypal.com/docs/api/webhooks/v1/#verify-webhook-signature_post
+    """
+    if not all(transmission.get(header) for header in WEBHOOK_TRANSMISSION_HEADERS):
+        return False
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+    }
+    verify_data = {
+        'auth_algo': transmission['paypal-auth-algo'],
+        'cert_url': transmission['paypal-cert-url'],
+        'transmission_id': transmission['paypal-transmission-id'],
+        'transmission_sig': transmission['paypal-transmission-sig'],
+        'transmission_time': transmission['paypal-transmission-time'],
+        'webhook_id': settings.PAYPAL_WEBHOOK_ID,
+        'webhook_event': webhook_event,
+    }
+    # Verifying has no side effects, so it can be retried
+    resp = await _arequest(
+        'POST', settings.PAYPAL_VERIFY_WEBHOOK_URL, idempotent = True, headers = headers, json = verify_data,
+    )
+    return resp.json().get('verification_status') == 'SUCCESS'
+
+async def _arequest(method: str, url: str, *, idempotent: bool = False, **kargs) -> httpx.Response:
+    """
+    Sends a request to PayPal within a deadline of `PAYPAL_CALL_DEADLINE`
+    seconds and through the circuit breaker. Idempotent requests are retried
+    up to `PAYPAL_MAX_RETRIES` times after timeouts, network errors, 429s
+    and 5xx responses, waiting a random ("full jitter") exponential backoff
+    between attempts. Other requests (eg, cancelling a subscription) are
+    never retried because we can't know whether PayPal executed them.
+
+    Raises `PayPalUnavailableError` if PayPal can't be reached and
+    `httpx.HTTPStatusError` for any other error response.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.PAYPAL_CALL_DEADLINE
+    max_attempts = 1 + (settings.PAYPAL_MAX_RETRIES if idempotent else 0)
+
+    for attempt in range(max_attempts):
+        try:
+            circuit_breaker.check()
+        except CircuitOpenError as ex:
+            raise PayPalUnavailableError(str(ex)) from ex
+
+        try:
+            async with _http_client() as client:
+                resp = await asyncio.wait_for(
+                    client.request(method, url, **kargs),
+                    timeout = deadline - loop.time(),
+                )
+        except (httpx.TransportError, asyncio.TimeoutError) as ex:
+            error = ex
+        else:
+            if not _is_unavailable(resp):
+                circuit_breaker.record_success()
+                _raise_for_status(resp)
+                return resp
+            error = httpx.HTTPStatusError(
+                f'PayPal answered {resp.status_code}', request = resp.request, response = resp,
+            )
+        circuit_breaker.record_failure()
+
+        backoff = random.uniform(0, settings.PAYPAL_RETRY_BACKOFF * 2 ** attempt)
+        if attempt + 1 == max_attempts or loop.time() + backoff >= deadline:
+            break
+        await asyncio.sleep(backoff)
+
+    raise PayPalUnavailableError(f'{method} {url} failed: {error!r}') from error
+
+def _is_unavailable(resp: httpx.Response) -> bool:
+    return resp.status_code == httpx.codes.TOO_MANY_REQUESTS or resp.is_server_error
+
+def _raise_for_status(resp: httpx.Response):
+    if resp.status_code == httpx.codes.UNAUTHORIZED:
+        # The token was revoked or has expired early: get a new one next time
+        invalidate_access_token()
+    resp.raise_for_status()
@@ -0,0 +1,19 @@
+"""
+Signal receivers that keep the data derived from the subscription plans
+in sync with them.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/signals/
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .catalog import invalidate_plan_catalog
+from .models import PlanChoice
+
+@receiver(post_save, sender = PlanChoice)
+@receiver(post_delete, sender = PlanChoice)
+def plan_choice_changed(sender, instance: PlanChoice, **kargs):
+    transaction.on_commit(invalidate_plan_catalog)
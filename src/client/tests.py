@@ -1,3 +1,536 @@
-from django.test import TestCase
+import asyncio
+import io
+import time
+from dataclasses import dataclass
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
+
+from account.models import CustomUser
+from client import catalog, outbox, paypal, webhooks
+from client.models import PayPalWebhookEvent, PlanChoice, Subscription, SubscriptionCancellation
+from common.circuit_breaker import CircuitBreaker
+from contra import settings as contra_settings
+from writer.models import Article
+
+@dataclass
+class Delayed:
+    seconds: float
+    response: httpx.Response
+
+class PayPalStub:
+    """
+    Answers the requests sent to PayPal with the given responses, one per
+    request (the last one for the rest): a response, an exception to raise
+    or a `Delayed` response. The requests are recorded.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests: list[httpx.Request] = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Delayed):
+            await asyncio.sleep(response.seconds)
+            response = response.response
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def ok(data: dict | None = None) -> httpx.Response:
+    return httpx.Response(200, json = data or {'id': 'S1', 'status': 'ACTIVE'})
+
+class PayPalClientTestCase(SimpleTestCase):
+    def setUp(self):
+        patches = (
+            mock.patch.object(contra_settings, 'PAYPAL_RETRY_BACKOFF', 0.0),
+            mock.patch.object(contra_settings, 'PAYPAL_MAX_RETRIES', 2),
+            mock.patch.object(contra_settings, 'PAYPAL_CALL_DEADLINE', 5.0),
+            mock.patch.object(paypal, 'circuit_breaker', CircuitBreaker('paypal-test', window = 4, min_calls = 4)),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def acall(self, stub: PayPalStub, call):
+        await paypal.aopen_http_client(httpx.MockTransport(stub))
+        try:
+            return await call()
+        finally:
+            await paypal.aclose_http_client()
+
+    def get_details(self):
+        return paypal.get_subscription_details('token', 'S1')
+
+    def cancel(self):
+        return paypal.cancel_subscription('token', 'S1')
+
+class PayPalRetryTests(PayPalClientTestCase):
+    async def test_idempotent_calls_are_retried(self):
+        stub = PayPalStub(httpx.Response(503), httpx.ConnectError('refused'), ok())
+        details = await self.acall(stub, self.get_details)
+        self.assertEqual(details['status'], 'ACTIVE')
+        self.assertEqual(len(stub.requests), 3)
+
+    async def test_retries_are_limited(self):
+        stub = PayPalStub(httpx.Response(503))
+        with self.assertRaises(paypal.PayPalUnavailableError):
+            await self.acall(stub, self.get_details)
+        self.assertEqual(len(stub.requests), 1 + contra_settings.PAYPAL_MAX_RETRIES)
+
+    async def test_non_idempotent_calls_are_not_retried(self):
+        stub = PayPalStub(httpx.Response(503), httpx.Response(204))
+        with self.assertRaises(paypal.PayPalUnavailableError):
+            await self.acall(stub, self.cancel)
+        self.assertEqual(len(stub.requests), 1)
+
+    async def test_client_errors_are_not_retried(self):
+        stub = PayPalStub(httpx.Response(404, json = {'name': 'RESOURCE_NOT_FOUND'}))
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.acall(stub, self.get_details)
+        self.assertEqual(len(stub.requests), 1)
+
+    async def test_unauthorized_invalidates_the_access_token(self):
+        paypal._access_token = paypal.AccessToken('old', time.time() + 3600)
+        self.addCleanup(setattr, paypal, '_access_token', None)
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.acall(PayPalStub(httpx.Response(401)), self.get_details)
+        self.assertIsNone(paypal._access_token)
+
+class PayPalDeadlineTests(PayPalClientTestCase):
+    async def test_slow_answers_are_cut_at_the_deadline(self):
+        stub = PayPalStub(Delayed(10.0, ok()))
+        started_at = time.monotonic()
+        with mock.patch.object(contra_settings, 'PAYPAL_CALL_DEADLINE', 0.2):
+            with self.assertRaises(paypal.PayPalUnavailableError):
+                await self.acall(stub, self.get_details)
+        self.assertLess(time.monotonic() - started_at, 1.0)
+
+class PayPalCircuitBreakerTests(PayPalClientTestCase):
+    async def test_breaker_opens_and_rejects_calls_without_sending_them(self):
+        stub = PayPalStub(httpx.Response(500))
+        with mock.patch.object(contra_settings, 'PAYPAL_MAX_RETRIES', 0):
+            for _ in range(4):
+                with self.assertRaises(paypal.PayPalUnavailableError):
+                    await self.acall(stub, self.get_details)
+            self.assertEqual(paypal.circuit_breaker.state, CircuitBreaker.OPEN)
+            with self.assertRaises(paypal.PayPalUnavailableError):
+                await self.acall(stub, self.get_details)
+        self.assertEqual(len(stub.requests), 4)
+
+    async def test_breaker_closes_after_a_successful_probe(self):
+        clock = mock.Mock(return_value = 0.0)
+        breaker = CircuitBreaker('paypal-test', window = 2, min_calls = 2, reset_timeout = 30, clock = clock)
+        with mock.patch.object(paypal, 'circuit_breaker', breaker), \
+                mock.patch.object(contra_settings, 'PAYPAL_MAX_RETRIES', 0):
+            for _ in range(2):
+                with self.assertRaises(paypal.PayPalUnavailableError):
+                    await self.acall(PayPalStub(httpx.Response(500)), self.get_details)
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            clock.return_value = 31.0
+            await self.acall(PayPalStub(ok()), self.get_details)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+def make_subscriber(email: str = 'c@x.com', external_id: str = 'S1') -> Subscription:
+    user = CustomUser.objects.create_user(email, None, firstName = 'C', lastName = 'L')
+    return Subscription.objects.create(
+        cost = 5,
+        external_subscription_id = external_id,
+        is_active = True,
+        user = user,
+        plan_choice = PlanChoice.objects.get(plan_code = 'ST'),
+    )
+
+def webhook_event(event_id: str, plan_id: str, status: str = 'ACTIVE', update_time: str = '2030-01-01T00:00:00Z') -> dict:
+    return {
+        'id': event_id,
+        'event_type': 'BILLING.SUBSCRIPTION.UPDATED',
+        'create_time': update_time,
+        'resource': {'id': 'S1', 'plan_id': plan_id, 'status': status, 'status_update_time': update_time},
+    }
+
+@override_settings(PAYPAL_WEBHOOK_ID = 'WH-1', PAYPAL_VERIFY_WEBHOOK_URL = 'http://paypal/verify')
+class PayPalWebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = make_subscriber()
+        cls.premium = PlanChoice.objects.get(plan_code = 'PR')
+
+    def setUp(self):
+        self.genuine = True
+        patches = (
+            mock.patch.object(webhooks, 'averify_delivery', side_effect = self.averify_delivery),
+            # Processed by the tests, not in the background
+            mock.patch.object(webhooks, 'schedule_processing'),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def averify_delivery(self, payload, headers) -> bool:
+        if self.genuine is None:
+            raise paypal.PayPalUnavailableError('down')
+        return self.genuine
+
+    async def apost(self, payload: dict):
+        return await self.async_client.post('/client/paypal-webhook/', payload, content_type = 'application/json')
+
+    async def test_forged_event_does_not_shadow_the_genuine_one(self):
+        self.genuine = False
+        response = await self.apost(webhook_event('WH-EVT-1', 'P-FORGED', status = 'CANCELLED'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await PayPalWebhookEvent.objects.aexists())
+
+        self.genuine = True
+        response = await self.apost(webhook_event('WH-EVT-1', self.premium.external_plan_id))
+        self.assertEqual(response.status_code, 200)
+        event = await PayPalWebhookEvent.objects.aget(event_id = 'WH-EVT-1')
+        self.assertTrue(await webhooks.aprocess_event(event.pk))
+
+        await event.arefresh_from_db()
+        self.assertEqual(event.status, PayPalWebhookEvent.Status.APPLIED)
+        subscription = await Subscription.objects.aget(pk = self.subscription.pk)
+        self.assertEqual(subscription.plan_choice_id, self.premium.pk)
+        self.assertTrue(subscription.is_active)
+
+    async def test_unverifiable_event_is_not_recorded(self):
+        self.genuine = None
+        response = await self.apost(webhook_event('WH-EVT-1', self.premium.external_plan_id))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(await PayPalWebhookEvent.objects.aexists())
+
+    async def test_redeliveries_are_recorded_and_applied_once(self):
+        payload = webhook_event('WH-EVT-1', self.premium.external_plan_id)
+        for _ in range(2):
+            self.assertEqual((await self.apost(payload)).status_code, 200)
+        self.assertEqual(webhooks.schedule_processing.call_count, 1)
+        event = await PayPalWebhookEvent.objects.aget(event_id = 'WH-EVT-1')
+        self.assertTrue(await webhooks.aprocess_event(event.pk))
+        self.assertFalse(await webhooks.aprocess_event(event.pk))
+
+    async def test_verified_delivery_replaces_a_rejected_event(self):
+        await PayPalWebhookEvent.objects.acreate(
+            event_id = 'WH-EVT-1',
+            event_type = 'BILLING.SUBSCRIPTION.CANCELLED',
+            payload = webhook_event('WH-EVT-1', 'P-FORGED', status = 'CANCELLED'),
+            transmission = {},
+            status = PayPalWebhookEvent.Status.REJECTED,
+        )
+        response = await self.apost(webhook_event('WH-EVT-1', self.premium.external_plan_id))
+        self.assertEqual(response.status_code, 200)
+        event = await PayPalWebhookEvent.objects.aget(event_id = 'WH-EVT-1')
+        self.assertEqual(event.status, PayPalWebhookEvent.Status.PENDING)
+        self.assertEqual(event.payload['resource']['plan_id'], self.premium.external_plan_id)
+        webhooks.schedule_processing.assert_called_once()
+
+    async def test_older_events_are_ignored(self):
+        newer = await PayPalWebhookEvent.objects.acreate(
+            event_id = 'WH-EVT-2', event_type = 'BILLING.SUBSCRIPTION.UPDATED', resource_id = 'S1',
+            payload = webhook_event('WH-EVT-2', self.premium.external_plan_id, update_time = '2030-01-02T00:00:00Z'),
+            transmission = {},
+        )
+        older = await PayPalWebhookEvent.objects.acreate(
+            event_id = 'WH-EVT-1', event_type = 'BILLING.SUBSCRIPTION.UPDATED', resource_id = 'S1',
+            payload = webhook_event('WH-EVT-1', 'P-OLD', status = 'SUSPENDED', update_time = '2030-01-01T00:00:00Z'),
+            transmission = {},
+        )
+        self.assertEqual(await webhooks.aprocess_pending_events(), 2)
+        await older.arefresh_from_db()
+        self.assertEqual(older.status, PayPalWebhookEvent.Status.IGNORED)
+        subscription = await Subscription.objects.aget(pk = self.subscription.pk)
+        self.assertTrue(subscription.is_active)
+        self.assertEqual(subscription.plan_choice_id, self.premium.pk)
+
+    async def test_events_do_not_reactivate_a_subscription_being_cancelled(self):
+        with mock.patch.object(outbox, 'notify_worker'):
+            await outbox.arequest_cancellation(self.subscription)
+        response = await self.apost(webhook_event('WH-EVT-1', self.premium.external_plan_id))
+        self.assertEqual(response.status_code, 200)
+        event = await PayPalWebhookEvent.objects.aget(event_id = 'WH-EVT-1')
+        self.assertTrue(await webhooks.aprocess_event(event.pk))
+
+        await event.arefresh_from_db()
+        self.assertEqual(event.status, PayPalWebhookEvent.Status.IGNORED)
+        subscription = await Subscription.objects.aget(pk = self.subscription.pk)
+        self.assertFalse(subscription.is_active)
+
+@override_settings(PAYPAL_WEBHOOK_ID = 'WH-1', PAYPAL_VERIFY_WEBHOOK_URL = 'http://paypal/verify')
+class PayPalWebhookVerificationTests(PayPalClientTestCase, TestCase):
+    TRANSMISSION = {header: 'x' for header in paypal.WEBHOOK_TRANSMISSION_HEADERS}
+
+    def setUp(self):
+        super().setUp()
+        patches = (
+            mock.patch.object(paypal, 'get_access_token', mock.AsyncMock(return_value = 'token')),
+            # Read by the client from its module
+            mock.patch.object(contra_settings, 'PAYPAL_WEBHOOK_ID', 'WH-1'),
+            mock.patch.object(contra_settings, 'PAYPAL_VERIFY_WEBHOOK_URL', 'http://paypal/verify'),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def apost(self, stub: PayPalStub):
+        async def post():
+            return await self.async_client.post(
+                '/client/paypal-webhook/', webhook_event('WH-EVT-1', 'P-1'),
+                content_type = 'application/json', headers = self.TRANSMISSION,
+            )
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            return await self.acall(stub, post)
+
+    async def test_paypal_errors_while_verifying_are_not_server_errors(self):
+        for status_code, expected in ((400, 400), (401, 503)):
+            with self.subTest(status_code = status_code), self.assertLogs('client', 'WARNING'):
+                response = await self.apost(PayPalStub(httpx.Response(status_code)))
+                self.assertEqual(response.status_code, expected)
+        self.assertFalse(await PayPalWebhookEvent.objects.aexists())
+
+    async def test_verified_event_is_recorded(self):
+        response = await self.apost(PayPalStub(ok({'verification_status': 'SUCCESS'})))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(await PayPalWebhookEvent.objects.filter(event_id = 'WH-EVT-1').aexists())
+
+class UpdateSubscriptionConfirmedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = make_subscriber()
+
+    def test_unknown_plan_is_an_error_not_a_crash(self):
+        self.client.force_login(self.subscription.user)
+        session = self.client.session
+        session.update({'subscription_id': self.subscription.pk, 'new_plan_id': 'P-RETIRED'})
+        session.save()
+        details = {'id': 'S1', 'status': 'ACTIVE', 'plan_id': 'P-RETIRED'}
+        with mock.patch.object(paypal, 'get_access_token', mock.AsyncMock(return_value = 'token')), \
+                mock.patch.object(paypal, 'get_subscription_details', mock.AsyncMock(return_value = details)):
+            response = self.client.get('/client/update-subscription-confirmed/')
+        self.assertContains(response, 'Invalid subscription data')
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.plan_choice.plan_code, 'ST')
+
+class PlanCatalogTests(TestCase):
+    @override_settings(CACHE_BACKEND = 'locmem', PLAN_CATALOG_CHECK_INTERVAL = 0)
+    def test_per_process_cache_reloads_the_catalog_at_every_check(self):
+        catalog.plan_catalog()
+        # Changed by another worker: this process' version isn't bumped
+        PlanChoice.objects.filter(plan_code = 'ST').update(name = 'Renamed')
+        self.assertEqual(catalog.plan_catalog().by_plan_code['ST'].name, 'Renamed')
+
+class ReconcileSubscriptionsTests(TransactionTestCase):
+    # The command runs its own event loop, so the ORM calls are made in
+    # other threads, which only see committed data
+    serialized_rollback = True  # the plans come from a data migration
+
+    def setUp(self):
+        self.subscriptions = [make_subscriber(f'c{n}@x.com', f'S{n}') for n in range(3)]
+        self.standard = PlanChoice.objects.get(plan_code = 'ST')
+        self.details = {
+            f'S{n}': {'id': f'S{n}', 'status': 'ACTIVE', 'plan_id': self.standard.external_plan_id}
+            for n in range(3)
+        }
+        patches = (
+            mock.patch.object(paypal, 'get_access_token', mock.AsyncMock(return_value = 'token')),
+            mock.patch.object(paypal, 'get_subscription_details', side_effect = self.aget_details),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def aget_details(self, access_token: str, subscription_id: str) -> dict:
+        details = self.details[subscription_id]
+        if isinstance(details, int):
+            request = httpx.Request('GET', f'http://paypal/{subscription_id}')
+            response = httpx.Response(details, request = request)
+            raise httpx.HTTPStatusError(f'PayPal answered {details}', request = request, response = response)
+        return details
+
+    def reconcile(self) -> str:
+        out = io.StringIO()
+        call_command('reconcile_subscriptions', stdout = out, stderr = io.StringIO())
+        return out.getvalue()
+
+    def test_subscriptions_in_sync_are_not_rewritten(self):
+        for _ in range(2):
+            self.assertIn('3 checked, 0 updated', self.reconcile())
+        self.assertFalse(Subscription.objects.filter(external_updated_at__isnull = False).exists())
+
+    def test_drifted_subscriptions_are_updated_without_inventing_a_time(self):
+        self.details['S1']['status'] = 'CANCELLED'
+        self.assertIn('3 checked, 1 updated', self.reconcile())
+        subscription = Subscription.objects.get(external_subscription_id = 'S1')
+        self.assertFalse(subscription.is_active)
+        self.assertIsNone(subscription.external_updated_at)
+        self.assertIn('3 checked, 0 updated', self.reconcile())
+
+    def test_http_errors_are_counted_and_the_run_goes_on(self):
+        self.details['S0'] = 400
+        self.details['S2']['status'] = 'SUSPENDED'
+        output = self.reconcile()
+        self.assertIn('3 checked, 1 updated, 0 not found on PayPal, 1 failed', output)
+        self.assertFalse(Subscription.objects.get(external_subscription_id = 'S2').is_active)
+
+    def test_subscriptions_being_cancelled_are_skipped(self):
+        with mock.patch.object(outbox, 'notify_worker'):
+            async_to_sync(outbox.arequest_cancellation)(self.subscriptions[1])
+        self.assertIn('2 checked, 0 updated', self.reconcile())
+        self.assertFalse(Subscription.objects.get(external_subscription_id = 'S1').is_active)
+
+def http_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request('POST', 'http://paypal/cancel')
+    response = httpx.Response(status_code, request = request)
+    return httpx.HTTPStatusError(f'PayPal answered {status_code}', request = request, response = response)
+
+class CancellationOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscriptions = [make_subscriber(f'c{n}@x.com', f'S{n}') for n in range(3)]
+
+    def setUp(self):
+        self.cancel_errors: dict[str, Exception] = {}
+        self.original_cancel = paypal.cancel_subscription
+        patches = (
+            mock.patch.object(paypal, 'get_access_token', mock.AsyncMock(return_value = 'token')),
+            mock.patch.object(paypal, 'cancel_subscription', side_effect = self.acancel),
+            # Drained by the tests, not in the background
+            mock.patch.object(outbox, 'notify_worker'),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def acancel(self, access_token: str, subscription_id: str, reason: str):
+        if error := self.cancel_errors.get(subscription_id):
+            raise error
+
+    async def arequest_all(self):
+        for subscription in self.subscriptions:
+            await outbox.arequest_cancellation(subscription)
+
+    async def test_subscription_is_kept_until_paypal_cancels_it(self):
+        await self.arequest_all()
+        self.assertEqual(await Subscription.objects.filter(is_active = False).acount(), 3)
+
+        self.assertEqual(await outbox.adrain(), 3)
+        self.assertFalse(await Subscription.objects.aexists())
+        self.assertEqual(
+            await SubscriptionCancellation.objects.filter(status = SubscriptionCancellation.Status.DONE).acount(), 3,
+        )
+
+    async def test_failed_cancellation_keeps_the_subscription_and_is_shown(self):
+        self.cancel_errors['S1'] = http_error(400)
+        await self.arequest_all()
+        await outbox.adrain()
+
+        cancellation = await SubscriptionCancellation.objects.aget(external_subscription_id = 'S1')
+        self.assertEqual(cancellation.status, SubscriptionCancellation.Status.FAILED)
+        subscription = await Subscription.objects.select_related('user').aget(external_subscription_id = 'S1')
+        self.assertEqual(await outbox.aqueue_depth(), {'pending': 0, 'due': 0, 'failed': 1})
+
+        await self.async_client.aforce_login(subscription.user)
+        response = await self.async_client.get('/client/dashboard/')
+        self.assertContains(response, 'the cancellation failed')
+
+        # Cancelling it again retries it
+        del self.cancel_errors['S1']
+        await outbox.arequest_cancellation(subscription)
+        self.assertEqual(await outbox.adrain(), 1)
+        self.assertFalse(await Subscription.objects.filter(external_subscription_id = 'S1').aexists())
+
+    async def test_unavailable_paypal_is_retried_later(self):
+        self.cancel_errors['S0'] = paypal.PayPalUnavailableError('down')
+        await outbox.arequest_cancellation(self.subscriptions[0])
+        self.assertEqual(await outbox.adrain(), 1)
+
+        cancellation = await SubscriptionCancellation.objects.aget(external_subscription_id = 'S0')
+        self.assertEqual(cancellation.status, SubscriptionCancellation.Status.PENDING)
+        self.assertEqual(cancellation.attempts, 1)
+        self.assertGreater(cancellation.next_attempt_at, cancellation.created_at)
+        self.assertTrue(await Subscription.objects.filter(external_subscription_id = 'S0').aexists())
+        # Not due yet
+        self.assertEqual(await outbox.adrain(), 0)
+
+    async def test_already_cancelled_on_paypal_counts_as_done(self):
+        self.cancel_errors['S0'] = http_error(422)
+        await outbox.arequest_cancellation(self.subscriptions[0])
+        await outbox.adrain()
+        cancellation = await SubscriptionCancellation.objects.aget(external_subscription_id = 'S0')
+        self.assertEqual(cancellation.status, SubscriptionCancellation.Status.DONE)
+
+    async def test_unexpected_errors_count_as_attempts_and_keep_the_batch(self):
+        async def answer(request: httpx.Request) -> httpx.Response:
+            if '/S1/' in request.url.path:
+                raise httpx.DecodingError('garbled', request = request)
+            return httpx.Response(204)
+
+        await self.arequest_all()
+        await paypal.aopen_http_client(httpx.MockTransport(answer))
+        try:
+            with mock.patch.object(paypal, 'cancel_subscription', self.original_cancel), \
+                    mock.patch.object(contra_settings, 'CANCELLATION_MAX_ATTEMPTS', 1), \
+                    self.assertLogs(outbox.logger, 'ERROR'):
+                self.assertEqual(await outbox.adrain(), 3)
+        finally:
+            await paypal.aclose_http_client()
+
+        statuses = {
+            c.external_subscription_id: (c.status, c.attempts)
+            async for c in SubscriptionCancellation.objects.all()
+        }
+        Status = SubscriptionCancellation.Status
+        self.assertEqual(statuses, {'S0': (Status.DONE, 1), 'S1': (Status.FAILED, 1), 'S2': (Status.DONE, 1)})
+        self.assertEqual(
+            [s.external_subscription_id async for s in Subscription.objects.all()], ['S1'],
+        )
+
+    def test_a_batch_is_claimed_with_a_single_update(self):
+        async_to_sync(self.arequest_all)()
+        candidates = list(SubscriptionCancellation.objects.values_list('pk', flat = True))
+        with CaptureQueriesContext(connection) as queries:
+            batch = async_to_sync(outbox._aclaim)(candidates)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+        # Claimed: no other worker gets them
+        self.assertEqual(async_to_sync(outbox._aclaim)(candidates), [])
+
+class BrowseArticlesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = make_subscriber()
+        writer = CustomUser.objects.create_user('w@x.com', None, firstName = 'W', lastName = 'R', is_writer = True)
+        cls.article = Article.objects.create(title = 'Free', content = 'body', user = writer)
+
+    async def alogin(self):
+        await cache.aclear()
+        await self.async_client.aforce_login(await CustomUser.objects.aget(email = 'c@x.com'))
+
+    async def test_etag_follows_the_articles_in_the_database(self):
+        await self.alogin()
+        response = await self.async_client.get('/client/browse-articles/')
+        etag = response['ETag']
+        response = await self.async_client.get('/client/browse-articles/', headers = {'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Changed by another worker: this one's articles version isn't bumped
+        await Article.objects.filter(pk = self.article.pk).aupdate(
+            title = 'Changed', date_changed = timezone.now(),
+        )
+        response = await self.async_client.get('/client/browse-articles/', headers = {'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    async def test_invalid_cursors_are_not_cached(self):
+        await self.alogin()
+        with mock.patch.object(cache, 'aset') as aset:
+            response = await self.async_client.get('/client/browse-articles/', {'after': 'x' * 10_000})
+        self.assertEqual(response.status_code, 400)
+        aset.assert_not_called()
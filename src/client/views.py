@@ -1,60 +1,202 @@
-from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+import json
+import logging
+
+import httpx
+
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import redirect, render
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import aget_user
 from django.utils.translation import gettext as _t
 from django.urls import reverse
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
-from client.models import Subscription, PlanChoice
+from client.models import Subscription, SubscriptionCancellation, PlanChoice
 from .forms import UpdateSubscriptionForm
-from writer.models import Article
-from common.auth import aclient_required, ensure_for_current_user
-from common.django_utils import arender
+from .catalog import aplan_catalog
+from writer.models import Article, LISTING_FIELDS
+from writer.search import asearch_articles
+from writer.cache import aarticles_version
+from common.auth import aclient_required, arequest_user, ensure_for_current_user
+from common.django_utils import arender, arender_to_string, acondition, make_etag
+from common.pagination import KeysetPaginator
+from common.fragment_cache import arender_fragments
 from . import paypal as sub_manager
+from . import outbox, webhooks
 
+logger = logging.getLogger(__name__)
 
 @aclient_required
 async def dashboard(request: HttpRequest) -> HttpResponse:
     """
     This is the client dashboard.
     """
-    user = await aget_user(request)
+    user = await arequest_user(request)
     subscription_plan = 'No subscription yet.'
     if subscription := await Subscription.afor_user(user):
         subscription_plan = (await subscription.aplan_choice()).name
-        if not subscription.is_active:
+        if await SubscriptionCancellation.ahas_failed(subscription.external_subscription_id):
+            subscription_plan += _t(' (the cancellation failed: please, cancel it again)')
+        elif not subscription.is_active:
             subscription_plan += ' (inactive)'
 
     context = {'subscription_plan': subscription_plan}
     return await arender(request, 'client/dashboard.html', context)
 
+async def _browse_articles_etag(request: HttpRequest) -> str | None:
+    """
+    The browse page only changes with the articles the subscription gives
+    access to, the requested page and the user's name shown in the navbar.
+    As for `my_articles`, creating or deleting an article changes the count
+    and updating one changes the latest `date_changed`. These come from the
+    database, not from the articles version, which a per-process cache
+    ('locmem') wouldn't share with the other workers.
+    """
+    user = await arequest_user(request)
+    if not (subscription := await Subscription.afor_user(user)):
+        return None
+    stats = await (await _articles_for(subscription)).aaggregate(
+        count = Count('id'),
+        last_changed = Max('date_changed'),
+    )
+    return make_etag(
+        user.pk,
+        user.firstName,
+        await subscription.ais_premium(),
+        stats['count'],
+        stats['last_changed'],
+        get_language(),
+        settings.ARTICLES_PAGE_SIZE,
+        request.GET.urlencode(),
+    )
+
 @aclient_required
+@acondition(etag_func = _browse_articles_etag)
 async def browse_articles(request: HttpRequest) -> HttpResponse:
     """
     This is the client's page to browse articles.
     """
-    user = await aget_user(request)
-    articles = []
+    user = await arequest_user(request)
+    articles_html = ''
     if subscription := await Subscription.afor_user(user):
-        if not await subscription.ais_premium():
-            articles = Article.objects.filter(is_premium = False)
-        else:
-            articles = Article.objects.all()
+        articles_html = await _abrowse_articles_html(request, subscription)
     
-    context = {'has_subscription': subscription is not None, 'articles': articles}
+    context = {'has_subscription': subscription is not None, 'articles_html': articles_html}
     return await arender(request, 'client/browse-articles.html', context)
 
+async def _abrowse_articles_html(request: HttpRequest, subscription: Subscription) -> str:
+    """
+    Returns the rendered list of articles for the page of `browse_articles`
+    selected by `request`. The list only depends on the subscription tier
+    (standard or premium), so the rendered HTML is cached and shared by all
+    the subscribers of the same tier. Saving or deleting any article
+    changes the articles version and, with it, the cache keys.
+    """
+    is_premium = await subscription.ais_premium()
+    queryset = (await _articles_for(subscription)).only(*LISTING_FIELDS)
+    paginator = KeysetPaginator(queryset, settings.ARTICLES_PAGE_SIZE)
+    cache_key = ':'.join((
+        'client:browse-articles',
+        str(await aarticles_version()),
+        'premium' if is_premium else 'standard',
+        get_language(),
+        str(settings.ARTICLES_PAGE_SIZE),
+        # Not the raw cursor: the client decides its length
+        paginator.page_key_for(request),
+    ))
+    if (articles_html := await cache.aget(cache_key)) is None:
+        articles = await paginator.apage_for(request)
+        context = {'articles': articles, 'cards': await _arender_cards(articles)}
+        articles_html = await arender_to_string('client/_article-list.html', context)
+        await cache.aset(cache_key, articles_html, settings.ARTICLES_CACHE_TIMEOUT)
+    return mark_safe(articles_html)
+
+@aclient_required
+async def article_detail(request: HttpRequest, id: int) -> HttpResponse:
+    """
+    This is the client's page to read the full content of an article.
+    """
+    user = await arequest_user(request)
+    if not (subscription := await Subscription.afor_user(user)):
+        return redirect('client-browse-articles')
+    try:
+        article = await (await _articles_for(subscription)).aget(id = id)
+    except ObjectDoesNotExist:
+        return redirect('client-browse-articles')
+
+    context = {'article': article}
+    return await arender(request, 'client/article-detail.html', context)
+
+@aclient_required
+async def search_articles(request: HttpRequest) -> HttpResponse:
+    """
+    This is the client's page to search articles by their title and content.
+    """
+    user = await arequest_user(request)
+    query = request.GET.get('q', '').strip()
+    try:
+        page_num = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_num = 1
+
+    articles = []
+    has_next = False
+    if (subscription := await Subscription.afor_user(user)) and query:
+        page_size = settings.ARTICLES_PAGE_SIZE
+        # One extra article tells us whether there's a next page
+        articles = await asearch_articles(
+            query,
+            include_premium = await subscription.ais_premium(),
+            limit = page_size + 1,
+            offset = (page_num - 1) * page_size,
+        )
+        has_next = len(articles) > page_size
+        articles = articles[:page_size]
+    cards = await _arender_cards(articles)
+
+    context = {
+        'has_subscription': subscription is not None,
+        'query': query,
+        'cards': cards,
+        'page_num': page_num,
+        'has_prev': page_num > 1,
+        'has_next': has_next,
+    }
+    return await arender(request, 'client/search-articles.html', context)
+
+async def _arender_cards(articles) -> list:
+    return await arender_fragments(
+        'client/_article-card.html',
+        articles,
+        object_name = 'article',
+        timeout = settings.ARTICLE_CARDS_CACHE_TIMEOUT,
+    )
+
+async def _articles_for(subscription: Subscription):
+    """
+    Returns the articles the `subscription` gives access to: standard
+    subscribers can only read the non premium articles.
+    """
+    if await subscription.ais_premium():
+        return Article.objects.all()
+    return Article.objects.filter(is_premium = False)
+
 @aclient_required
 async def subscribe_plan(request: HttpRequest) -> HttpResponse:
     """
     This is the client's page to subscription plans.
     """
-    user = await aget_user(request)
+    user = await arequest_user(request)
     if await Subscription.afor_user(user):
         return redirect('client-dashboard')
     
-    context = {'plan_choices': PlanChoice.objects.filter(is_active = True)}
+    context = {'plan_choices': (await aplan_catalog()).active}
     return await arender(request, 'client/subscribe-plan.html', context)
 
 @aclient_required
@@ -62,7 +204,7 @@ async def update_user(request: HttpRequest) -> HttpResponse:
     """
     This is the client's update account page.
     """
-    user = await aget_user(request)
+    user = await arequest_user(request)
     subscription_plan = ''
     if subscription := await Subscription.afor_user(user):
         subscription_plan = (await subscription.aplan_choice()).name
@@ -79,7 +221,7 @@ async def create_subscription(request: HttpRequest, sub_id: str, plan_code: str)
     """
     This is the client's subscription page.
     """
-    user = await aget_user(request)
+    user = await arequest_user(request)
 
     if await Subscription.afor_user(user):
         return redirect('client-dashboard')
@@ -96,19 +238,19 @@ async def create_subscription(request: HttpRequest, sub_id: str, plan_code: str)
     return await arender(request, 'client/create-subscription.html', context)
 
 @aclient_required
-@ensure_for_current_user(Subscription, redirect_if_missing = 'client-dashboard')
+@ensure_for_current_user(
+    Subscription,
+    redirect_if_missing = 'client-dashboard',
+    select_related = ('plan_choice',),
+)
 async def cancel_subscription(request: HttpRequest, subscription: Subscription) -> HttpResponse:
     """
     This is the client's cancel subscription page.
     """
     if request.method == 'POST':
-        # First, cancel the subscription on PayPal
-        access_token = await sub_manager.get_access_token()
-        sub_id = subscription.external_subscription_id
-        await sub_manager.cancel_subscription(access_token, sub_id)
-        
-        # Then, cancel it locally by removing it from the DB
-        await subscription.adelete()
+        # Mark it as inactive. The cancellation on PayPal is made in the
+        # background, and then it's removed from the DB (see 'client.outbox')
+        await outbox.arequest_cancellation(subscription)
 
         # Set the template that confirms that the subscription was cancelled
         context = {}
@@ -121,7 +263,11 @@ async def cancel_subscription(request: HttpRequest, subscription: Subscription)
     return await arender(request, template, context)
 
 @aclient_required
-@ensure_for_current_user(Subscription, redirect_if_missing = 'client-dashboard')
+@ensure_for_current_user(
+    Subscription,
+    redirect_if_missing = 'client-dashboard',
+    select_related = ('plan_choice',),
+)
 async def update_subscription(request: HttpRequest, subscription: Subscription) -> HttpResponse:
     """
     This is the client's update subscription page.
@@ -133,14 +279,17 @@ async def update_subscription(request: HttpRequest, subscription: Subscription)
         new_plan_choice = await PlanChoice.afrom_plan_code(new_plan_code)
         new_plan_id = new_plan_choice.external_plan_id
 
-        access_token = await sub_manager.get_access_token()
-        approval_url = await sub_manager.update_subscription_plan(
-            access_token,
-            subscription_id = subscription.external_subscription_id,
-            new_plan_id = new_plan_id,
-            return_url = request.build_absolute_uri(reverse('client-update-subscription-confirmed')),
-            cancel_url = request.build_absolute_uri(reverse('client-update-user'))
-        )
+        try:
+            access_token = await sub_manager.get_access_token()
+            approval_url = await sub_manager.update_subscription_plan(
+                access_token,
+                subscription_id = subscription.external_subscription_id,
+                new_plan_id = new_plan_id,
+                return_url = request.build_absolute_uri(reverse('client-update-subscription-confirmed')),
+                cancel_url = request.build_absolute_uri(reverse('client-update-user'))
+            )
+        except sub_manager.PayPalUnavailableError:
+            return _paypal_unavailable_response()
 
         if approval_url:
             http_response = redirect(approval_url)
@@ -173,25 +322,77 @@ async def update_subscription_confirmed(request: HttpRequest) -> HttpResponse:
             f"{ex.args} is missing from the request"
         )
         return HttpResponse(error_msg)
-    else:
-        del session['subscription_id']
-        del session['new_plan_id']
     
-    subscription = await Subscription.objects.aget(id = int(subscription_db_id))
+    subscription = await Subscription.objects.select_related('plan_choice').aget(
+        id = int(subscription_db_id)
+    )
     subscription_id = subscription.external_subscription_id
 
+    # The PayPal webhook may have already told us about the new plan
+    if subscription.is_active and subscription.plan_choice.external_plan_id == new_plan_id:
+        del session['subscription_id']
+        del session['new_plan_id']
+        return await arender(request, 'client/update-subscription-confirmed.html')
+
     # Verify the subscription status (optional, but recommended)
-    access_token = await sub_manager.get_access_token()
-    sub_details = await sub_manager.get_subscription_details(access_token, subscription_id)
+    try:
+        access_token = await sub_manager.get_access_token()
+        sub_details = await sub_manager.get_subscription_details(access_token, subscription_id)
+    except sub_manager.PayPalUnavailableError:
+        # Keep the session keys so that the user can retry later
+        return _paypal_unavailable_response()
+    del session['subscription_id']
+    del session['new_plan_id']
 
-    if not (sub_details['status'] == 'ACTIVE' and sub_details['plan_id'] == new_plan_id):
+    # The plan may be unknown, or retired since the catalog was loaded
+    new_plan_choice = (await aplan_catalog()).by_external_plan_id.get(new_plan_id)
+    if not (sub_details['status'] == 'ACTIVE' and sub_details['plan_id'] == new_plan_id and new_plan_choice):
         error_msg = f'ERROR: Invalid subscription data during plan update'
         return HttpResponse(error_msg)
     
     # Update locally the subscription
-    new_plan_choice = await PlanChoice.objects.aget(external_plan_id = new_plan_id)
     subscription.plan_choice = new_plan_choice
     await subscription.asave()
 
     return await arender(request, 'client/update-subscription-confirmed.html')
 
+@csrf_exempt
+@require_POST
+async def paypal_webhook(request: HttpRequest) -> HttpResponse:
+    """
+    Receives the webhook events sent by PayPal (see 'client.webhooks').
+    The events are only verified and recorded here, and processed in the
+    background, so that PayPal gets its answer right away.
+    """
+    if not (settings.PAYPAL_WEBHOOK_ID and settings.PAYPAL_VERIFY_WEBHOOK_URL):
+        return HttpResponse('ERROR: PayPal webhooks are not configured', status = 503)
+    try:
+        payload = json.loads(request.body)
+        payload['id']
+    except (ValueError, TypeError, KeyError):
+        return HttpResponseBadRequest('ERROR: Invalid webhook event')
+
+    try:
+        is_genuine = await webhooks.averify_delivery(payload, request.headers)
+    except sub_manager.PayPalUnavailableError:
+        # PayPal delivers the event again later
+        return _paypal_unavailable_response()
+    except httpx.HTTPStatusError as ex:
+        logger.warning('Unable to verify the PayPal webhook event %s: %r', payload['id'], ex)
+        status_code = ex.response.status_code
+        if status_code == httpx.codes.UNAUTHORIZED or status_code >= 500:
+            # Our access token (already invalidated) or PayPal's fault: the
+            # redelivery is verified again
+            return _paypal_unavailable_response()
+        return HttpResponseBadRequest('ERROR: Unable to verify the webhook event')
+    if not is_genuine:
+        return HttpResponseBadRequest('ERROR: Invalid webhook signature')
+
+    event, created = await webhooks.arecord_event(payload, request.headers)
+    if created:
+        webhooks.schedule_processing(event)
+    return HttpResponse(status = 200)
+
+def _paypal_unavailable_response() -> HttpResponse:
+    error_msg = _t('ERROR: PayPal is unavailable right now. Please, try again later.')
+    return HttpResponse(error_msg, status = 503)
@@ -0,0 +1,183 @@
+"""
+Ingestion of the PayPal webhook events about subscriptions
+(BILLING.SUBSCRIPTION.*), which keep the local `Subscription`s in sync with
+PayPal without having to poll it.
+
+The webhook view first has the delivery's signature verified by PayPal
+(`averify_delivery`), so that a forged event can never be recorded, nor
+take the event id of a genuine one. Then it records the event
+(deduplicated by its event id) and answers PayPal right away. If PayPal
+can't verify it right now, the view fails and PayPal delivers the event
+again later.
+
+The recorded events are processed in the background: the subscription's
+status and plan are updated. Events that couldn't be processed (eg, the
+worker stopped) stay pending and are retried by the
+'process_paypal_webhooks' management command.
+
+See:
+    https://developer.paypal.com/api/rest/webhooks/
+    https://developer.paypal.com/docs/api/subscriptions/v1/#subscriptions_get
+"""
+
+__all__ = (
+    'averify_delivery',
+    'arecord_event',
+    'aprocess_event',
+    'aprocess_pending_events',
+    'schedule_processing',
+)
+
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from common.db_routing import create_background_task
+from . import paypal
+from .catalog import aplan_catalog
+from .models import PayPalWebhookEvent, Subscription, SubscriptionCancellation
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_EVENTS_PREFIX = 'BILLING.SUBSCRIPTION.'
+
+# An event claimed by a worker that didn't finish processing it in this
+# time (eg, the worker was restarted) can be claimed again
+CLAIM_TIMEOUT = timedelta(minutes = 5)
+
+_background_tasks: set[asyncio.Task] = set()
+
+async def averify_delivery(payload: dict, headers) -> bool:
+    """
+    Returns whether PayPal sent the event in `payload`, with the
+    transmission `headers` (see `paypal.verify_webhook_signature`). Raises
+    `paypal.PayPalUnavailableError` if PayPal can't tell right now.
+    """
+    access_token = await paypal.get_access_token()
+    return await paypal.verify_webhook_signature(access_token, _transmission(headers), payload)
+
+async def arecord_event(payload: dict, headers) -> tuple[PayPalWebhookEvent, bool]:
+    """
+    Records the (already verified) event in `payload`, if it wasn't already
+    recorded. Returns the event and whether it's new, ie, has to be
+    processed.
+    """
+    resource = payload.get('resource') or {}
+    fields = {
+        'event_type': payload.get('event_type', ''),
+        'resource_id': resource.get('id', ''),
+        'payload': payload,
+        'transmission': _transmission(headers),
+    }
+    # In a savepoint, and retried as a `get` if another delivery won the race
+    event, created = await PayPalWebhookEvent.objects.aget_or_create(event_id = payload['id'], defaults = fields)
+    if created or event.status != PayPalWebhookEvent.Status.REJECTED:
+        # New, or else already delivered before (and not to be processed again)
+        return event, created
+
+    # Events rejected when deliveries were verified after being recorded
+    # may have taken the id of this genuine one: this delivery replaces them
+    replaced = await PayPalWebhookEvent.objects.filter(
+        event_id = payload['id'], status = PayPalWebhookEvent.Status.REJECTED,
+    ).aupdate(
+        **fields,
+        status = PayPalWebhookEvent.Status.PENDING,
+        received_at = timezone.now(),
+        processed_at = None,
+    )
+    return await PayPalWebhookEvent.objects.aget(event_id = payload['id']), bool(replaced)
+
+def schedule_processing(event: PayPalWebhookEvent):
+    """
+    Processes the event in the background, after the response to PayPal.
+    """
+    task = create_background_task(aprocess_event(event.pk))
+    # The loop only keeps weak references to its tasks
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def aprocess_pending_events() -> int:
+    """
+    Processes the pending events, oldest first. Returns how many were.
+    """
+    processed = 0
+    pending = PayPalWebhookEvent.objects.filter(_claimable()).order_by('received_at')
+    async for event_pk in pending.values_list('pk', flat = True):
+        processed += await aprocess_event(event_pk)
+    return processed
+
+async def aprocess_event(event_pk: int) -> bool:
+    """
+    Applies the event, unless it's already being (or was) processed.
+    Returns whether it was processed now.
+    """
+    # Claim the event, so that no other worker processes it at the same time
+    claimed = await PayPalWebhookEvent.objects.filter(_claimable(), pk = event_pk).aupdate(
+        processed_at = timezone.now(),
+    )
+    if not claimed:
+        return False
+    event = await PayPalWebhookEvent.objects.aget(pk = event_pk)
+
+    try:
+        if not event.event_type.startswith(SUBSCRIPTION_EVENTS_PREFIX):
+            event.status = PayPalWebhookEvent.Status.IGNORED
+        elif await _aapply_subscription_event(event):
+            event.status = PayPalWebhookEvent.Status.APPLIED
+        else:
+            event.status = PayPalWebhookEvent.Status.IGNORED
+    except Exception:
+        logger.exception('Unable to process the PayPal webhook event %s', event)
+        # Release the claim: the event will be retried
+        await PayPalWebhookEvent.objects.filter(pk = event_pk).aupdate(processed_at = None)
+        return False
+
+    event.processed_at = timezone.now()
+    await event.asave(update_fields = ['status', 'processed_at'])
+    return True
+
+async def _aapply_subscription_event(event: PayPalWebhookEvent) -> bool:
+    """
+    Updates the subscription with the status and plan of the subscription
+    resource in the event. Events older than the last one applied (PayPal
+    doesn't guarantee the delivery order) are ignored. Returns whether the
+    subscription was updated.
+    """
+    resource = event.payload.get('resource') or {}
+    try:
+        # Not the ones being cancelled: PayPal still has them active
+        subscription = await Subscription.objects.exclude(
+            external_subscription_id__in = SubscriptionCancellation.requested_ids(),
+        ).aget(external_subscription_id = event.resource_id)
+    except Subscription.DoesNotExist:
+        return False
+
+    changed_at = parse_datetime(
+        resource.get('status_update_time')
+        or resource.get('update_time')
+        or event.payload.get('create_time')
+        or ''
+    ) or event.received_at
+
+    catalog = await aplan_catalog()
+    update_fields = subscription.apply_external_state(
+        status = resource.get('status', ''),
+        plan_choice = catalog.by_external_plan_id.get(resource.get('plan_id')),
+        changed_at = changed_at,
+    )
+    if not update_fields:
+        return False
+    await subscription.asave(update_fields = update_fields)
+    return True
+
+def _transmission(headers) -> dict:
+    return {header: headers.get(header, '') for header in paypal.WEBHOOK_TRANSMISSION_HEADERS}
+
+def _claimable() -> Q:
+    return Q(status = PayPalWebhookEvent.Status.PENDING) & (
+        Q(processed_at__isnull = True) | Q(processed_at__lt = timezone.now() - CLAIM_TIMEOUT)
+    )
@@ -5,6 +5,8 @@ See:
 """
 
 __all__ = (
+    'SubscriptionModelBackend',
+    'arequest_user',
     'aclient_required',
     'awriter_required',
     'aanonymous_required',
@@ -15,13 +17,92 @@ from functools import wraps
 
 from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import aget_user
+from django.contrib.auth.backends import ModelBackend
 from django.shortcuts import redirect
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 
+from account import hashing
 from account.models import CustomUser
 from common.django_utils import AsyncViewT
 
+class SubscriptionModelBackend(ModelBackend):
+    """
+    Authenticates like Django's `ModelBackend` but, when loading the user of
+    a request from its session, the user's subscription and plan come along
+    in the same query. Together with `arequest_user`, which keeps the user
+    for the rest of the request, this means that the decorators below,
+    the views, `Subscription.afor_user` and `Subscription.aplan_choice`
+    don't need any other query (nor thread hop) to get them.
+
+    `aauthenticate` verifies the password in the processes of
+    `account.hashing.executor` instead of on the event loop (where Django's
+    `acheck_password` runs the hasher).
+
+    `ModelBackend` stays listed after this backend so that the sessions it
+    logged in still load their user. It must not check the credentials
+    again (for `aauthenticate`, on the event loop): once this backend has
+    checked them, a failure stops there (`PermissionDenied`).
+    """
+    RELATED = ('subscription__plan_choice',)
+
+    def authenticate(self, request, username = None, password = None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        return self._checked(user, password)
+
+    async def aauthenticate(self, request, username = None, password = None, **kwargs):
+        user = await self._aauthenticate(request, username, password, **kwargs)
+        return self._checked(user, password)
+
+    @staticmethod
+    def _checked(user: CustomUser | None, password: str | None) -> CustomUser | None:
+        if user is None and password is not None:
+            raise PermissionDenied
+        return user
+
+    async def _aauthenticate(self, request, username = None, password = None, **kwargs):
+        if username is None:
+            username = kwargs.get(CustomUser.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await CustomUser._default_manager.aget_by_natural_key(username)
+        except CustomUser.DoesNotExist:
+            # Hash anyway, so that unknown emails don't answer faster (Django's #20760)
+            await hashing.amake_password(password)
+            return None
+
+        is_correct, must_update = await hashing.averify_password(password, user.password)
+        if not is_correct:
+            return None
+        if must_update:
+            user.password = await hashing.amake_password(password)
+            await user.asave(update_fields = ['password'])
+        return user if self.user_can_authenticate(user) else None
+
+    def get_user(self, user_id):
+        try:
+            user = CustomUser._default_manager.select_related(*self.RELATED).get(pk = user_id)
+        except CustomUser.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await CustomUser._default_manager.select_related(*self.RELATED).aget(pk = user_id)
+        except CustomUser.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+async def arequest_user(request: HttpRequest) -> CustomUser:
+    """
+    Returns the user of `request`, loaded at most once per request. The
+    user is also stored in `request.user` so that the sync code paths (eg,
+    the 'auth' context processor of the templates) don't load it again.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
 def aclient_required(client_view: AsyncViewT):
     return aprofile_required('client')(client_view)
 
@@ -42,7 +123,7 @@ def aprofile_required(profile: str, login_url: str = 'login'):
         @login_required(login_url = login_url)
         @wraps(original_view)
         async def decorated_view(request: HttpRequest, *args, **kargs) -> HttpResponse:
-            user: CustomUser = await aget_user(request)
+            user: CustomUser = await arequest_user(request)
             if user.is_authenticated and is_of_profile(user):
                 return await original_view(request, *args, **kargs)
             return HttpResponseForbidden(f"Only members of '{profile}' can access this view")
@@ -52,7 +133,7 @@ def aprofile_required(profile: str, login_url: str = 'login'):
 def aanonymous_required(original_view: AsyncViewT):
     @wraps(original_view)
     async def decorated_view(request: HttpRequest, *args, **kargs) -> HttpResponse:
-        user = await aget_user(request)
+        user = await arequest_user(request)
         redirect_to = (
             'writer-dashboard' if user.is_authenticated and user.is_writer else
             'client-dashboard' if user.is_authenticated else
@@ -63,13 +144,20 @@ def aanonymous_required(original_view: AsyncViewT):
         return await original_view(request, *args, **kargs)
     return decorated_view
 
-def ensure_for_current_user(model: type, *, id_in_url: str = 'id', redirect_if_missing: str):
+def ensure_for_current_user(
+        model: type,
+        *,
+        id_in_url: str = 'id',
+        redirect_if_missing: str,
+        select_related: tuple[str, ...] = (),
+):
     def decorator(view: AsyncViewT):
         async def async_view(request: HttpRequest, *args, **kargs) -> HttpResponse:
             obj_id = kargs[id_in_url]
-            current_user = await aget_user(request)
+            current_user = await arequest_user(request)
+            objects = model.objects.select_related(*select_related)
             try:
-                obj = await model.objects.aget(id = obj_id, user = current_user)
+                obj = await objects.aget(id = obj_id, user = current_user)
                 del kargs[id_in_url]
                 return await view(request, obj, *args, **kargs)
             except ObjectDoesNotExist:
@@ -0,0 +1,104 @@
+"""
+A circuit breaker for calls to external services.
+
+While the service works, the breaker is 'closed' and lets every call
+through, recording whether it failed. Once at least `min_calls` outcomes
+are recorded and the failure rate of the last `window` of them reaches
+`failure_rate`, the breaker 'opens': calls are rejected right away, without
+waiting for the service to time out, so that a slow or unavailable service
+can't tie up our workers. After `reset_timeout` seconds a single probe call
+is let through ('half-open'). If it succeeds, the breaker closes again;
+otherwise it stays open for another `reset_timeout`.
+
+See:
+    https://martinfowler.com/bliki/CircuitBreaker.html
+"""
+
+__all__ = (
+    'CircuitBreaker',
+    'CircuitOpenError',
+)
+
+import time
+from collections import deque
+from typing import Callable
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+            self,
+            name: str,
+            *,
+            window: int = 20,
+            min_calls: int = 10,
+            failure_rate: float = 0.5,
+            reset_timeout: float = 30.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        if not (0 < failure_rate <= 1):
+            raise ValueError(f'Invalid failure rate: {failure_rate}')
+        self.name = name
+        self.min_calls = min(min_calls, window)
+        self.failure_rate_threshold = failure_rate
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._outcomes: deque[bool] = deque(maxlen = window)    # True means success
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        return self.HALF_OPEN if self._probing else self.OPEN
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def snapshot(self) -> dict:
+        return {
+            'name': self.name,
+            'state': self.state,
+            'failure_rate': self.failure_rate,
+            'calls': len(self._outcomes),
+        }
+
+    def check(self):
+        """
+        Raises `CircuitOpenError` if a call can't be made right now.
+        """
+        if self._opened_at is None:
+            return
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            # Let this call through as a probe and keep rejecting the other
+            # ones until it finishes (or another `reset_timeout` elapses)
+            self._opened_at = self.clock()
+            self._probing = True
+            return
+        raise CircuitOpenError(f"Circuit '{self.name}' is open: calls are suspended")
+
+    def record_success(self):
+        if self._opened_at is not None:
+            if not self._probing:
+                return
+            self._opened_at = None
+            self._probing = False
+            self._outcomes.clear()
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        self._outcomes.append(False)
+        if self._opened_at is not None:
+            self._opened_at = self.clock()
+            self._probing = False
+        elif len(self._outcomes) >= self.min_calls and self.failure_rate >= self.failure_rate_threshold:
+            self._opened_at = self.clock()
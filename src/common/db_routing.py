@@ -0,0 +1,124 @@
+"""
+Routing of the queries of the requests between the primary database
+('default') and its read replicas ('DATABASE_REPLICAS' in the settings).
+
+During a request (ie, with `ReplicaStickinessMiddleware` installed) reads go
+to a random replica and writes to the primary. Replicas lag behind the
+primary, so once a request writes anything (an article, a subscription,
+the session, ...), its reads go to the primary for the rest of the request,
+and so do the reads of the user's next requests for `DB_REPLICA_STICKINESS`
+seconds. That way users always see their own writes.
+
+Outside of requests (management commands, background workers, the shell)
+every query goes to the primary, since those often read what they are
+about to write. Tasks started by a request copy its context, and with it
+its routing: background work started by a request must be started with
+`create_background_task`, which runs it outside of the request.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/db/multi-db/#automatic-database-routing
+    https://docs.djangoproject.com/en/5.1/topics/http/middleware/#asynchronous-support
+"""
+
+__all__ = (
+    'PrimaryReplicaRouter',
+    'ReplicaStickinessMiddleware',
+    'create_background_task',
+)
+
+import asyncio
+import random
+import time
+from asyncio import iscoroutinefunction
+from contextvars import Context, ContextVar
+from typing import Coroutine
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+STICKINESS_COOKIE = 'primary_until'
+
+@dataclass
+class _RequestRouting:
+    use_primary: bool
+    wrote: bool = False
+
+# Set by the middleware for each request. The ORM calls run in other threads
+# (through `sync_to_async`), but with a copy of this context, so they see
+# (and update) the same `_RequestRouting`
+_request_routing: ContextVar[_RequestRouting | None] = ContextVar('request_routing', default = None)
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints) -> str:
+        routing = _request_routing.get()
+        if (
+            routing is None
+            or routing.use_primary
+            or routing.wrote
+            or not settings.DATABASE_REPLICAS
+            # Reads in a transaction must see its writes
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints) -> str:
+        if routing := _request_routing.get():
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name: str | None = None, **hints) -> bool:
+        # The replicas get the schema changes from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+@sync_and_async_middleware
+def ReplicaStickinessMiddleware(get_response):
+    """
+    Must come before 'SessionMiddleware' and any other middleware that may
+    write, so that their writes count.
+    """
+    def begin(request: HttpRequest):
+        try:
+            use_primary = float(request.COOKIES.get(STICKINESS_COOKIE, 0)) > time.time()
+        except ValueError:
+            use_primary = False
+        routing = _RequestRouting(use_primary = use_primary)
+        return routing, _request_routing.set(routing)
+
+    def end(response: HttpResponse, routing: _RequestRouting, token):
+        _request_routing.reset(token)
+        if routing.wrote:
+            stickiness = settings.DB_REPLICA_STICKINESS
+            response.set_cookie(
+                STICKINESS_COOKIE,
+                str(time.time() + stickiness),
+                max_age = stickiness,
+                httponly = True,
+                samesite = 'Lax',
+            )
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest) -> HttpResponse:
+            routing, token = begin(request)
+            return end(await get_response(request), routing, token)
+    else:
+        def middleware(request: HttpRequest) -> HttpResponse:
+            routing, token = begin(request)
+            return end(get_response(request), routing, token)
+    return middleware
+
+def create_background_task(coroutine: Coroutine) -> asyncio.Task:
+    """
+    Creates a task running `coroutine` in a new, empty, context: even when
+    started by a request, its queries are routed like those of any other
+    background work (ie, to the primary).
+    """
+    return Context().run(asyncio.get_running_loop().create_task, coroutine)
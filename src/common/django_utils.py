@@ -8,14 +8,25 @@ __all__ = (
     'AsyncModelFormMixin',
     'AsyncViewT',
     'arender',
+    'arender_to_string',
+    'astream_render',
     'alogout',
+    'acondition',
+    'make_etag',
 )
 
-from typing import Protocol
+import hashlib
+import secrets
+from functools import wraps
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Protocol
 
 from django import forms
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 import django.contrib.auth as auth
 
 from asgiref.sync import sync_to_async
@@ -52,6 +63,55 @@ async def arender(*render_args, **render_kargs) -> HttpResponse:
         return render(*render_args, **render_kargs)
     return await sync_call_render()
 
+async def arender_to_string(*render_args, **render_kargs) -> str:
+
+    @sync_to_async
+    def sync_call_render_to_string() -> str:
+        return render_to_string(*render_args, **render_kargs)
+    return await sync_call_render_to_string()
+
+async def astream_render(
+        request: HttpRequest,
+        template_name: str,
+        context: dict | None = None,
+        *,
+        items: AsyncIterable,
+        render_chunk: Callable[[list], Awaitable[Iterable[str]]],
+        chunk_size: int = 100,
+) -> StreamingHttpResponse:
+    """
+    Streams a page whose (long) list of items is rendered as it's read.
+
+    `template_name` is rendered first, with `{{ stream_placeholder }}` where
+    the items go. Everything before the placeholder is sent right away, then
+    `items` (eg, `queryset.aiterator()`) is consumed in chunks of
+    `chunk_size` items, each chunk rendered by `render_chunk` and sent, and
+    finally the rest of the page is sent. Only one chunk of items is kept
+    in memory at any time and the time to first byte doesn't depend on how
+    many items there are.
+
+    See:
+        https://docs.djangoproject.com/en/5.1/ref/request-response/#streaminghttpresponse-objects
+    """
+    marker = f'<!-- stream-{secrets.token_hex(8)} -->'
+    context = {**(context or {}), 'stream_placeholder': mark_safe(marker)}
+    page = await arender_to_string(template_name, context, request)
+    head, _, tail = page.partition(marker)
+
+    async def stream_content():
+        yield head
+        chunk = []
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                yield ''.join(await render_chunk(chunk))
+                chunk = []
+        if chunk:
+            yield ''.join(await render_chunk(chunk))
+        yield tail
+
+    return StreamingHttpResponse(stream_content())
+
 async def alogout(*render_args, **render_kargs):
 
     @sync_to_async
@@ -59,3 +119,39 @@ async def alogout(*render_args, **render_kargs):
         auth.logout(*render_args, **render_kargs)
     await sync_call_logout()
 
+def make_etag(*parts) -> str:
+    """
+    Returns a (quoted) strong ETag identifying the given `parts`.
+    """
+    digest = hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+    return quote_etag(digest)
+
+def acondition(etag_func: Callable[..., Awaitable[str | None]]):
+    """
+    Asynchronous version of Django's `condition(etag_func = ...)` decorator
+    (`django.views.decorators.http.condition`), whose validator functions
+    can't be coroutines and so can't use the ORM in an async view.
+
+    `etag_func` is awaited with the same arguments as the view. When the
+    ETag it returns matches the request's 'If-None-Match' header, a 304 is
+    returned without calling the view at all. Responses to GET/HEAD carry
+    the ETag and are marked 'private, no-cache' so that browsers always
+    revalidate them (instead of showing a stale page) and shared caches
+    never store them.
+
+    See:
+        https://docs.djangoproject.com/en/5.1/topics/conditional-view-processing/
+    """
+    def decorator(original_view: AsyncViewT):
+        @wraps(original_view)
+        async def decorated_view(request: HttpRequest, *args, **kargs) -> HttpResponse:
+            etag = await etag_func(request, *args, **kargs)
+            response = get_conditional_response(request, etag = etag)
+            if response is None:
+                response = await original_view(request, *args, **kargs)
+            if etag and request.method in ('GET', 'HEAD'):
+                response.headers.setdefault('ETag', etag)
+                patch_cache_control(response, private = True, no_cache = True)
+            return response
+        return decorated_view
+    return decorator
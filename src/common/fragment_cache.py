@@ -0,0 +1,74 @@
+"""
+Cache of rendered template fragments, one per model instance and version.
+
+A listing page renders the same "card" template for each of its objects.
+Instead of rendering all the cards on every request, each card is cached
+under a key made of the template, the object's primary key and a version
+stamp of the object (eg, a `date_changed` field updated on every save).
+Editing an object changes its key, so only its card is rendered again and
+the cards of the other objects keep being served from the cache.
+
+Cards are fetched and stored with `get_many`/`set_many`, so a listing
+costs two cache round trips no matter how many cards it has.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/cache/#template-fragment-caching
+    https://docs.djangoproject.com/en/5.1/topics/cache/#the-low-level-cache-api
+"""
+
+__all__ = (
+    'render_fragments',
+    'arender_fragments',
+)
+
+from typing import Iterable
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Model
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+from django.utils.translation import get_language
+
+from asgiref.sync import sync_to_async
+
+DEFAULT_TIMEOUT = 60 * 60
+
+def render_fragments(
+        template_name: str,
+        objects: Iterable[Model],
+        *,
+        object_name: str,
+        version_field: str = 'date_changed',
+        timeout: int = DEFAULT_TIMEOUT,
+) -> list[SafeString]:
+    """
+    Renders `template_name` once for each object in `objects`, passing the
+    object in the context as `object_name`, and returns the rendered
+    fragments in the same order as `objects`.
+
+    The template must only depend on the object itself (and on the active
+    language): nothing specific to the current user or request.
+    """
+    objects = list(objects)
+    language = get_language()
+    keys = [
+        make_template_fragment_key(
+            template_name, [language, obj.pk, getattr(obj, version_field)]
+        )
+        for obj in objects
+    ]
+    fragments = cache.get_many(keys)
+    rendered = {
+        key: render_to_string(template_name, {object_name: obj})
+        for key, obj in zip(keys, objects)
+        if key not in fragments
+    }
+    if rendered:
+        cache.set_many(rendered, timeout)
+        fragments.update(rendered)
+    return [mark_safe(fragments[key]) for key in keys]
+
+@sync_to_async
+def arender_fragments(*args, **kargs) -> list[SafeString]:
+    return render_fragments(*args, **kargs)
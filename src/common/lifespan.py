@@ -0,0 +1,62 @@
+"""
+ASGI lifespan support for the Django ASGI application.
+
+Django's ASGI handler only speaks the 'http' protocol, so it can't run code
+when the server starts or stops a worker. `LifespanMiddleware` answers the
+'lifespan' protocol itself, running the given startup and shutdown
+coroutines (eg, to create and close long-lived HTTP clients), and passes
+every other connection to the wrapped application.
+
+See:
+    https://asgi.readthedocs.io/en/latest/specs/lifespan.html
+    https://www.uvicorn.org/settings/#application-interface
+"""
+
+__all__ = (
+    'LifespanMiddleware',
+)
+
+import traceback
+from typing import Awaitable, Callable, Iterable
+
+LifespanHook = Callable[[], Awaitable[None]]
+
+class LifespanMiddleware:
+    def __init__(
+            self,
+            application,
+            *,
+            on_startup: Iterable[LifespanHook] = (),
+            on_shutdown: Iterable[LifespanHook] = (),
+    ):
+        self.application = application
+        self.on_startup = tuple(on_startup)
+        self.on_shutdown = tuple(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    for hook in self.on_startup:
+                        await hook()
+                except Exception:
+                    await send({'type': 'lifespan.startup.failed', 'message': traceback.format_exc()})
+                    raise
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    for hook in self.on_shutdown:
+                        await hook()
+                except Exception:
+                    await send({'type': 'lifespan.shutdown.failed', 'message': traceback.format_exc()})
+                    raise
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,176 @@
+"""
+Keyset (a.k.a. cursor or "seek") pagination for Django querysets.
+
+Unlike offset pagination (`LIMIT n OFFSET m`), the database never has to
+skip over the rows of the previous pages: each page is a range scan that
+starts right after (or right before) the last row the user has seen. The
+cost of fetching a page is therefore the same for the first and for the
+thousandth page.
+
+The page boundaries are opaque, URL safe, cursors built from the values
+of the ordering fields of the first and last rows of each page.
+
+See:
+    https://use-the-index-luke.com/no-offset
+    https://docs.djangoproject.com/en/5.1/ref/models/querysets/#django.db.models.Q
+"""
+
+__all__ = (
+    'KeysetPage',
+    'KeysetPaginator',
+)
+
+import base64
+import binascii
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+
+
+@dataclass(frozen = True)
+class KeysetPage:
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+class KeysetPaginator:
+    """
+    Paginates `queryset` in descending order of `key_fields`. The last key
+    field must be unique (eg, the primary key) so that rows sharing the
+    same values for the other fields are never skipped nor repeated.
+    """
+
+    AFTER_PARAM = 'after'
+    BEFORE_PARAM = 'before'
+
+    def __init__(
+            self,
+            queryset: QuerySet,
+            page_size: int,
+            key_fields: Sequence[str] = ('date_posted', 'id'),
+    ):
+        if page_size < 1:
+            raise ValueError(f'Invalid page size: {page_size}')
+        self.queryset = queryset
+        self.page_size = page_size
+        self.key_fields = tuple(key_fields)
+
+    async def apage_for(self, request: HttpRequest) -> KeysetPage:
+        """
+        Returns the page selected by the `after`/`before` cursor found in the
+        query string of `request`, or the first page if there's none.
+        """
+        if after := request.GET.get(self.AFTER_PARAM):
+            return await self.apage(after = after)
+        if before := request.GET.get(self.BEFORE_PARAM):
+            return await self.apage(before = before)
+        return await self.apage()
+
+    def page_key_for(self, request: HttpRequest) -> str:
+        """
+        Returns a short key of the page that `apage_for` selects for
+        `request` (eg, for a cache key). It's built from the decoded cursor,
+        so it's of bounded length whatever the client sends, and an invalid
+        cursor raises `BadRequest` as `apage_for` does.
+        """
+        if after := request.GET.get(self.AFTER_PARAM):
+            direction, cursor = 'after', after
+        elif before := request.GET.get(self.BEFORE_PARAM):
+            direction, cursor = 'before', before
+        else:
+            return 'first'
+        values = json.dumps([str(value) for value in self._decode(cursor)])
+        return f'{direction}:{hashlib.sha256(values.encode()).hexdigest()}'
+
+    async def apage(self, *, after: str = '', before: str = '') -> KeysetPage:
+        if after and before:
+            raise BadRequest('Only one of after/before cursors can be given')
+
+        queryset = self.queryset
+        backwards = bool(before)
+        if cursor := after or before:
+            queryset = queryset.filter(
+                self._seek_condition(self._decode(cursor), backwards)
+            )
+        ordering = [
+            field if backwards else f'-{field}' for field in self.key_fields
+        ]
+        # One extra row tells us whether there's another page beyond this one
+        rows = [
+            row async for row in queryset.order_by(*ordering)[:self.page_size + 1]
+        ]
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+
+        has_next = has_more if not backwards else True
+        has_prev = has_more if backwards else bool(after)
+        return KeysetPage(
+            items = rows,
+            next_cursor = self._encode(rows[-1]) if rows and has_next else None,
+            prev_cursor = self._encode(rows[0]) if rows and has_prev else None,
+        )
+
+    def _seek_condition(self, values: list, backwards: bool) -> Q:
+        """
+        Builds the row-value comparison `(f1, f2, ...) < (v1, v2, ...)`
+        (or `>` when going backwards) expanded into plain `Q` objects so that
+        it works on every DB backend:
+            f1 < v1 OR (f1 = v1 AND f2 < v2) OR ...
+        """
+        lookup = 'gt' if backwards else 'lt'
+        condition = Q()
+        for i, field in enumerate(self.key_fields):
+            equal_prefix = {
+                prev_field: values[j] for j, prev_field in enumerate(self.key_fields[:i])
+            }
+            condition |= Q(**equal_prefix, **{f'{field}__{lookup}': values[i]})
+        return condition
+
+    def _encode(self, row: Any) -> str:
+        # NOTE: `value_to_string` keeps the full precision of the values
+        # (DjangoJSONEncoder would truncate datetimes to milliseconds)
+        model = self.queryset.model
+        values = [
+            model._meta.get_field(field).value_to_string(row) for field in self.key_fields
+        ]
+        raw = json.dumps(values, separators = (',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def _decode(self, cursor: str) -> list:
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw_values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+            if not isinstance(raw_values, list) or len(raw_values) != len(self.key_fields):
+                raise ValueError(cursor)
+            # `_encode` only makes strings: anything else (eg, a null, which
+            # can't be compared) is a forged cursor
+            if not all(isinstance(value, str) for value in raw_values):
+                raise ValueError(cursor)
+            model = self.queryset.model
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.key_fields, raw_values)
+            ]
+        except (binascii.Error, TypeError, ValueError, ValidationError) as ex:
+            raise BadRequest(f'Invalid pagination cursor: {cursor}') from ex
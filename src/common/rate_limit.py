@@ -0,0 +1,188 @@
+"""
+Rate limiting of views with token buckets.
+
+Each key (eg, a client IP or a submitted email) has a bucket of `capacity`
+tokens, refilled at `capacity` tokens per `period` seconds. Every request
+takes a token, and is rejected with a 429 when its bucket is empty. So a
+key can make bursts of up to `capacity` requests, but no more than
+`capacity` per `period` in the long run.
+
+`TokenBucketLimiter` keeps the buckets in the memory of the process, so
+with several workers each one allows its own `capacity`.
+`CacheTokenBucketLimiter` keeps them in Django's cache, shared by all the
+workers. The cache has no atomic read-modify-write, so concurrent requests
+of the same key on different workers may now and then both get the last
+token: the limit is approximate, but still bounds a flood.
+
+Every limiter counts the requests it allows and rejects. Their counters can
+be checked with `snapshot()`.
+
+See:
+    https://en.wikipedia.org/wiki/Token_bucket
+    https://docs.djangoproject.com/en/5.1/topics/cache/#the-low-level-cache-api
+"""
+
+__all__ = (
+    'TokenBucketLimiter',
+    'CacheTokenBucketLimiter',
+    'token_bucket',
+    'client_ip',
+    'post_field',
+    'arate_limited',
+    'snapshot',
+)
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Callable, Iterable
+
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+
+from common.django_utils import AsyncViewT
+
+KeyFunction = Callable[[HttpRequest], str | None]
+
+@dataclass
+class _Bucket:
+    tokens: float
+    updated_at: float
+
+_limiters: list['TokenBucketLimiter'] = []
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, *, capacity: int, period: float, max_keys: int = 100_000):
+        if capacity < 1 or period <= 0:
+            raise ValueError(f'Invalid rate limit: {capacity} per {period} seconds')
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+        # Least recently used first. Evicting a bucket only gives its key a
+        # full one, which idle keys would have anyway
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+        _limiters.append(self)
+
+    def take(self, bucket: _Bucket | None, now: float) -> tuple[_Bucket, float]:
+        """
+        Takes a token from `bucket` (a full one if `None`). Returns the
+        updated bucket and 0 if there was a token, or else the seconds until
+        there is one.
+        """
+        if bucket is None:
+            bucket = _Bucket(tokens = self.capacity, updated_at = now)
+        tokens = min(self.capacity, bucket.tokens + (now - bucket.updated_at) * self.rate)
+        if tokens >= 1:
+            self.allowed += 1
+            return _Bucket(tokens = tokens - 1, updated_at = now), 0.0
+        self.rejected += 1
+        return _Bucket(tokens = tokens, updated_at = now), (1 - tokens) / self.rate
+
+    async def atake(self, key: str) -> float:
+        # Only the event loop's thread gets here: no lock needed
+        now = time.monotonic()
+        bucket, wait = self.take(self._buckets.pop(key, None), now)
+        self._buckets[key] = bucket
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last = False)
+        return wait
+
+    def snapshot(self) -> dict:
+        return {
+            'name': self.name,
+            'capacity': self.capacity,
+            'period': self.period,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'keys': len(self._buckets),
+        }
+
+class CacheTokenBucketLimiter(TokenBucketLimiter):
+    def cache_key(self, key: str) -> str:
+        # Keys may hold anything (eg, emails), but not every cache backend accepts them
+        return f'rate_limit:{self.name}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    async def atake(self, key: str) -> float:
+        # The clocks of the workers must agree: wall-clock time, not monotonic
+        now = time.time()
+        cache_key = self.cache_key(key)
+        state = await cache.aget(cache_key)
+        bucket, wait = self.take(_Bucket(*state) if state else None, now)
+        # After `period` seconds the bucket is full again, like a missing one
+        await cache.aset(cache_key, (bucket.tokens, bucket.updated_at), math.ceil(self.period))
+        return wait
+
+    def snapshot(self) -> dict:
+        return super().snapshot() | {'keys': None}
+
+def token_bucket(name: str, *, capacity: int, period: float, shared: bool = False) -> TokenBucketLimiter:
+    """
+    Returns a limiter that keeps its buckets in Django's cache if `shared`,
+    or in memory otherwise.
+    """
+    limiter_class = CacheTokenBucketLimiter if shared else TokenBucketLimiter
+    return limiter_class(name, capacity = capacity, period = period)
+
+def client_ip(request: HttpRequest) -> str | None:
+    """
+    Returns the address of the peer of the connection (REMOTE_ADDR).
+    Headers like X-Forwarded-For are ignored, since any client can send
+    them: behind a reverse proxy, the peer is the proxy, and so all the
+    clients share its bucket.
+    """
+    return request.META.get('REMOTE_ADDR') or None
+
+def post_field(field_name: str) -> KeyFunction:
+    """
+    Returns a key function giving the value of the field `field_name` of
+    the submitted form (lower-cased, eg, for emails).
+    """
+    def key(request: HttpRequest) -> str | None:
+        return request.POST.get(field_name, '').strip().lower() or None
+    return key
+
+def arate_limited(
+        rules: Iterable[tuple[TokenBucketLimiter, KeyFunction]],
+        *,
+        methods: Iterable[str] = ('POST',),
+):
+    """
+    Decorates an asynchronous view so that its requests with one of
+    `methods` take a token, for each (limiter, key function) of `rules`,
+    from the bucket of their key. Requests without a key (ie, the key
+    function returns `None`) skip the rule. Once a bucket is empty, the
+    request is rejected with a 429 before the view runs.
+    """
+    rules = tuple(rules)
+    methods = frozenset(methods)
+
+    def decorator(original_view: AsyncViewT):
+        @wraps(original_view)
+        async def decorated_view(request: HttpRequest, *args, **kargs) -> HttpResponse:
+            if request.method in methods:
+                for limiter, key_function in rules:
+                    if (key := key_function(request)) is None:
+                        continue
+                    if wait := await limiter.atake(key):
+                        return HttpResponse(
+                            'Too many attempts. Please try again later.',
+                            status = 429,
+                            content_type = 'text/plain',
+                            headers = {'Retry-After': str(math.ceil(wait))},
+                        )
+            return await original_view(request, *args, **kargs)
+        return decorated_view
+    return decorator
+
+def snapshot() -> list[dict]:
+    """
+    Returns the counters of every limiter of this process.
+    """
+    return [limiter.snapshot() for limiter in _limiters]
@@ -0,0 +1,134 @@
+import asyncio
+import base64
+import json
+import time
+from datetime import timedelta
+
+from django.core.exceptions import BadRequest
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from account.models import CustomUser
+from common import db_routing
+from common.pagination import KeysetPaginator
+from writer.models import Article
+
+def make_cursor(values) -> str:
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        writer = CustomUser.objects.create_user('w@x.com', None, firstName = 'W', lastName = 'R', is_writer = True)
+        now = timezone.now()
+        # Pairs of articles with the same date, so that the id breaks the ties
+        Article.objects.bulk_create([
+            Article(title = f'T{n}', content = 'body', user = writer, date_posted = now - timedelta(minutes = n // 2))
+            for n in range(7)
+        ])
+
+    def paginator(self) -> KeysetPaginator:
+        return KeysetPaginator(Article.objects.all(), page_size = 3)
+
+    async def test_pages_forwards_and_backwards(self):
+        paginator = self.paginator()
+        expected = [
+            article.id async for article in Article.objects.order_by('-date_posted', '-id')
+        ]
+
+        seen = []
+        page = await paginator.apage()
+        self.assertFalse(page.has_prev)
+        while True:
+            seen += [article.id for article in page]
+            if not page.has_next:
+                break
+            last_page = page
+            page = await paginator.apage(after = page.next_cursor)
+        self.assertEqual(seen, expected)
+
+        previous = await paginator.apage(before = page.prev_cursor)
+        self.assertEqual([article.id for article in previous], [article.id for article in last_page])
+
+    async def test_invalid_cursors_are_bad_requests(self):
+        paginator = self.paginator()
+        for cursor in (
+                'not base64!',
+                make_cursor({'date_posted': 1}),
+                make_cursor(['2025-01-01T00:00:00+00:00']),
+                make_cursor([[1], 1]),
+                make_cursor([None, None]),
+                make_cursor(['yesterday', '1']),
+        ):
+            with self.subTest(cursor = cursor), self.assertRaises(BadRequest):
+                await paginator.apage(after = cursor)
+
+    def test_page_keys_are_short_and_only_for_valid_cursors(self):
+        paginator = self.paginator()
+        factory = RequestFactory()
+        self.assertEqual(paginator.page_key_for(factory.get('/')), 'first')
+        cursor = make_cursor(['2025-01-01T00:00:00+00:00', '1' + '0' * 1_000])
+        key = paginator.page_key_for(factory.get('/', {'before': cursor}))
+        self.assertTrue(key.startswith('before:'))
+        self.assertLess(len(key), 100)
+        with self.assertRaises(BadRequest):
+            paginator.page_key_for(factory.get('/', {'after': 'x' * 1_000}))
+
+@override_settings(DATABASE_REPLICAS = ['replica1'], DB_REPLICA_STICKINESS = 10)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """
+    The replica alias is only used for the routing decisions (`QuerySet.db`
+    asks the router), so no replica database is needed: a second
+    connection to the in-memory test database would lock it.
+    """
+    def setUp(self):
+        self.router = db_routing.PrimaryReplicaRouter()
+        patch = override_settings(DATABASE_ROUTERS = [self.router])
+        patch.enable()
+        self.addCleanup(patch.disable)
+
+    async def arequest(self, view, cookies: dict | None = None) -> HttpResponse:
+        request = AsyncRequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return await db_routing.ReplicaStickinessMiddleware(view)(request)
+
+    def test_reads_outside_requests_go_to_the_primary(self):
+        self.assertEqual(Article.objects.all().db, 'default')
+
+    async def test_reads_go_to_the_replica_until_the_request_writes(self):
+        seen = []
+
+        async def view(request):
+            seen.append(Article.objects.all().db)
+            self.router.db_for_write(Article)
+            seen.append(Article.objects.all().db)
+            return HttpResponse()
+
+        response = await self.arequest(view)
+        self.assertEqual(seen, ['replica1', 'default'])
+        self.assertIn(db_routing.STICKINESS_COOKIE, response.cookies)
+
+    async def test_reads_stick_to_the_primary_after_a_write(self):
+        async def view(request):
+            return HttpResponse(Article.objects.all().db)
+
+        response = await self.arequest(view, {db_routing.STICKINESS_COOKIE: str(time.time() + 10)})
+        self.assertEqual(response.content, b'default')
+        response = await self.arequest(view, {db_routing.STICKINESS_COOKIE: str(time.time() - 1)})
+        self.assertEqual(response.content, b'replica1')
+        response = await self.arequest(view, {db_routing.STICKINESS_COOKIE: 'garbage'})
+        self.assertEqual(response.content, b'replica1')
+
+    async def test_background_tasks_started_by_a_request_use_the_primary(self):
+        async def read_alias() -> str:
+            return Article.objects.all().db
+
+        async def view(request):
+            background = db_routing.create_background_task(read_alias())
+            inherited = asyncio.get_running_loop().create_task(read_alias())
+            return HttpResponse(f'{await background},{await inherited}')
+
+        response = await self.arequest(view)
+        self.assertEqual(response.content, b'default,replica1')
@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'contra.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# These imports need Django to be already set up by 'get_asgi_application'
+from common.lifespan import LifespanMiddleware
+from account import hashing
+from client import outbox, paypal
+
+application = LifespanMiddleware(
+    django_application,
+    on_startup = [paypal.aopen_http_client, outbox.astart_worker, hashing.executor.astart],
+    on_shutdown = [outbox.astop_worker, paypal.aclose_http_client, hashing.executor.ashutdown],
+)
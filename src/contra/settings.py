@@ -11,8 +11,11 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import tempfile
 import decouple
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,8 +53,15 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 AUTH_USER_MODEL = 'account.CustomUser'
 
+AUTHENTICATION_BACKENDS = [
+    'common.auth.SubscriptionModelBackend',
+    # Only loads the users of the sessions logged in before the backend above
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'common.db_routing.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -87,14 +97,144 @@ WSGI_APPLICATION = 'contra.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# https://docs.djangoproject.com/en/5.1/ref/databases/#persistent-connections
+# https://docs.djangoproject.com/en/5.1/ref/databases/#connection-pool
+#
+# NOTE: Under ASGI each request runs its ORM calls in a thread of its own,
+# so connections kept open by `CONN_MAX_AGE` aren't reused by the next
+# requests (they only help 'runserver', WSGI and management commands), and
+# every thread may keep one open. So DB_CONN_MAX_AGE defaults to 0: set it
+# only to serve with WSGI. A connection pool (DB_POOL, only available for
+# PostgreSQL) is what removes the connection setup from every request.
+
+DB_ENGINE: str = decouple.config('DB_ENGINE', default = 'django.db.backends.sqlite3')
+DB_NAME: str = decouple.config('DB_NAME', default = str(BASE_DIR / 'db.sqlite3'))
+DB_POOL: bool = decouple.config('DB_POOL', default = False, cast = bool)
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': DB_ENGINE,
+        'NAME': DB_NAME,
+        'USER': decouple.config('DB_USER', default = ''),
+        'PASSWORD': decouple.config('DB_PASSWORD', default = ''),
+        'HOST': decouple.config('DB_HOST', default = ''),
+        'PORT': decouple.config('DB_PORT', default = ''),
+        # Seconds a connection is kept open for the next requests (pooled
+        # connections can't also be persistent)
+        'CONN_MAX_AGE': 0 if DB_POOL else decouple.config('DB_CONN_MAX_AGE', default = 0, cast = int),
+        # Check that a persistent connection still works before reusing it
+        'CONN_HEALTH_CHECKS': decouple.config('DB_CONN_HEALTH_CHECKS', default = True, cast = bool),
+        'OPTIONS': {},
     }
 }
 
+if DB_ENGINE == 'django.db.backends.mysql':
+    DATABASES['default']['OPTIONS'].update(charset = 'utf8mb4')
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    # Production profile: with WAL journaling readers don't block the
+    # writer (nor the writer the readers), and writers wait for each other
+    # (`busy_timeout`) instead of failing with "database is locked". An
+    # IMMEDIATE transaction takes the write lock when it begins, so it
+    # can't fail on the lock halfway through (after reading)
+    # https://www.sqlite.org/wal.html
+    # https://www.sqlite.org/pragma.html
+    # https://docs.djangoproject.com/en/5.1/ref/databases/#sqlite-init-command
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL' if decouple.config('SQLITE_WAL', default = True, cast = bool) else 'DELETE',
+        'synchronous': decouple.config('SQLITE_SYNCHRONOUS', default = 'NORMAL'),
+        'busy_timeout': decouple.config('SQLITE_BUSY_TIMEOUT', default = 5_000, cast = int),    # ms
+        'mmap_size': decouple.config('SQLITE_MMAP_SIZE', default = 256 * 1024 * 1024, cast = int),
+        'cache_size': decouple.config('SQLITE_CACHE_SIZE', default = -64 * 1024, cast = int),  # < 0: KiB
+        'temp_store': 'MEMORY',
+    }
+    DATABASES['default']['OPTIONS'].update(
+        init_command = ';'.join(f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()),
+        transaction_mode = decouple.config('SQLITE_TRANSACTION_MODE', default = 'IMMEDIATE'),
+    )
+if DB_POOL:
+    if DB_ENGINE != 'django.db.backends.postgresql':
+        raise ImproperlyConfigured('DB_POOL is only supported by PostgreSQL (psycopg[pool])')
+    DATABASES['default']['OPTIONS'].update(pool = {
+        'min_size': decouple.config('DB_POOL_MIN_SIZE', default = 2, cast = int),
+        'max_size': decouple.config('DB_POOL_MAX_SIZE', default = 20, cast = int),
+        'timeout': decouple.config('DB_POOL_TIMEOUT', default = 10.0, cast = float),
+    })
+
+# Read replicas: a comma separated list with the HOST of each replica (or
+# the NAME, ie, the file, with SQLite). They get the aliases 'replica1',
+# 'replica2', ... (see 'common.db_routing')
+for n, replica in enumerate(decouple.config('DB_REPLICAS', default = '', cast = decouple.Csv()), 1):
+    DATABASES[f'replica{n}'] = {
+        **DATABASES['default'],
+        'NAME' if DB_ENGINE == 'django.db.backends.sqlite3' else 'HOST': replica,
+        'TEST': {'MIRROR': 'default'},
+    }
+# A read-only connection to the SQLite file for the listings, which can
+# never take the write lock (it's a 'replica' with no lag)
+if DB_ENGINE == 'django.db.backends.sqlite3' and decouple.config('SQLITE_READ_ALIAS', default = False, cast = bool):
+    read_pragmas = {**SQLITE_PRAGMAS, 'query_only': 'ON'}
+    del read_pragmas['journal_mode']    # it can't be changed by a read-only connection
+    DATABASES['sqlite_read'] = {
+        **DATABASES['default'],
+        'NAME': f'{Path(DB_NAME).resolve().as_uri()}?mode=ro',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name} = {value}' for name, value in read_pragmas.items()),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['common.db_routing.PrimaryReplicaRouter'] if DATABASE_REPLICAS else []
+# Seconds during which a user's reads go to the primary after they wrote
+DB_REPLICA_STICKINESS: int = decouple.config('DB_REPLICA_STICKINESS', default = 10, cast = int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+#
+# CACHE_BACKEND is 'locmem' (a cache per process), 'file' (shared by the
+# processes of a host) or 'redis' (shared by every host; needs the 'redis'
+# package). The PayPal token, the rate limits and the sessions can only be
+# shared between workers through 'file' or 'redis'. The 'file' cache is kept
+# out of the source tree, in the temporary directory, unless CACHE_LOCATION
+# says otherwise.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'contra'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(Path(tempfile.gettempdir()) / 'contra-cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/0'),
+}
+CACHE_BACKEND: str = decouple.config('CACHE_BACKEND', default = 'locmem')
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"Unknown CACHE_BACKEND: '{CACHE_BACKEND}' (use {', '.join(CACHE_BACKENDS)})")
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': decouple.config('CACHE_LOCATION', default = CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'TIMEOUT': decouple.config('CACHE_TIMEOUT', default = 300, cast = int),
+        'OPTIONS': {
+            'MAX_ENTRIES': decouple.config('CACHE_MAX_ENTRIES', default = 10_000, cast = int),
+        } if CACHE_BACKEND != 'redis' else {},
+    }
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/#configuring-the-session-engine
+#
+# SESSION_BACKEND is 'cached_db' (read from the cache, and only from the
+# database on a miss; written to both), 'cache' (only in the cache, so it
+# needs 'file' or 'redis'), 'signed_cookies' (in the cookie itself, so no
+# storage at all, but sessions can't be revoked before they expire) or 'db'.
+
+SESSION_BACKEND: str = decouple.config('SESSION_BACKEND', default = 'cached_db')
+if SESSION_BACKEND not in ('cached_db', 'cache', 'signed_cookies', 'db'):
+    raise ImproperlyConfigured(f"Unknown SESSION_BACKEND: '{SESSION_BACKEND}'")
+if SESSION_BACKEND == 'cache' and CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured("SESSION_BACKEND 'cache' needs a CACHE_BACKEND shared by the workers")
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
+SESSION_COOKIE_AGE: int = decouple.config('SESSION_COOKIE_AGE', default = 2 * 7 * 24 * 60 * 60, cast = int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -114,6 +254,24 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing of the requests (see 'account.hashing'): processes of the
+# pool and hashes that may wait for one of them before new ones are rejected
+PASSWORD_HASHING_WORKERS: int = decouple.config('PASSWORD_HASHING_WORKERS', default = 2, cast = int)
+PASSWORD_HASHING_MAX_QUEUE: int = decouple.config('PASSWORD_HASHING_MAX_QUEUE', default = 32, cast = int)
+
+# Attempts to log in or register allowed per client IP and per email (0: no
+# limit) in bursts, and refilled every AUTH_RATE_LIMIT_PERIOD seconds (see
+# 'common.rate_limit'). Each worker counts its own attempts, so N workers
+# allow N times these, unless AUTH_RATE_LIMIT_SHARED_CACHE keeps the counts
+# in Django's cache (which needs 'file' or 'redis'). The client IP is
+# REMOTE_ADDR: behind a proxy, every client has the proxy's
+AUTH_RATE_LIMIT_PER_IP: int = decouple.config('AUTH_RATE_LIMIT_PER_IP', default = 30, cast = int)
+AUTH_RATE_LIMIT_PER_EMAIL: int = decouple.config('AUTH_RATE_LIMIT_PER_EMAIL', default = 10, cast = int)
+AUTH_RATE_LIMIT_PERIOD: float = decouple.config('AUTH_RATE_LIMIT_PERIOD', default = 60.0, cast = float)
+AUTH_RATE_LIMIT_SHARED_CACHE: bool = decouple.config('AUTH_RATE_LIMIT_SHARED_CACHE', default = False, cast = bool)
+if AUTH_RATE_LIMIT_SHARED_CACHE and CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured("AUTH_RATE_LIMIT_SHARED_CACHE needs a CACHE_BACKEND shared by the workers")
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -143,4 +301,54 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PAYPAL_CLIENT_ID: str = decouple.config('PAYPAL_CLIENT_ID')
 PAYPAL_SECRET_ID: str = decouple.config('PAYPAL_SECRET_ID')
 PAYPAL_AUTH_URL: str = decouple.config('PAYPAL_AUTH_URL')
-PAYPAL_BILLING_SUBSCRIPTIONS_URL: str = decouple.config('PAYPAL_BILLING_SUBSCRIPTIONS_URL')
\ No newline at end of file
+PAYPAL_BILLING_SUBSCRIPTIONS_URL: str = decouple.config('PAYPAL_BILLING_SUBSCRIPTIONS_URL')
+# Webhook receiving the BILLING.SUBSCRIPTION.* events (see 'client.webhooks')
+PAYPAL_WEBHOOK_ID: str = decouple.config('PAYPAL_WEBHOOK_ID', default = '')
+PAYPAL_VERIFY_WEBHOOK_URL: str = decouple.config('PAYPAL_VERIFY_WEBHOOK_URL', default = '')
+# Renew the OAuth access token this many seconds before it expires
+PAYPAL_TOKEN_REFRESH_MARGIN: int = decouple.config('PAYPAL_TOKEN_REFRESH_MARGIN', default = 300, cast = int)
+# Share the access token with the other workers through Django's cache
+PAYPAL_TOKEN_SHARED_CACHE: bool = decouple.config('PAYPAL_TOKEN_SHARED_CACHE', default = False, cast = bool)
+# Connection pool and timeouts (in seconds) of the HTTP client used to call PayPal
+PAYPAL_HTTP2: bool = decouple.config('PAYPAL_HTTP2', default = True, cast = bool)
+PAYPAL_MAX_CONNECTIONS: int = decouple.config('PAYPAL_MAX_CONNECTIONS', default = 20, cast = int)
+PAYPAL_MAX_KEEPALIVE_CONNECTIONS: int = decouple.config('PAYPAL_MAX_KEEPALIVE_CONNECTIONS', default = 10, cast = int)
+PAYPAL_KEEPALIVE_EXPIRY: float = decouple.config('PAYPAL_KEEPALIVE_EXPIRY', default = 30.0, cast = float)
+PAYPAL_CONNECT_TIMEOUT: float = decouple.config('PAYPAL_CONNECT_TIMEOUT', default = 5.0, cast = float)
+PAYPAL_READ_TIMEOUT: float = decouple.config('PAYPAL_READ_TIMEOUT', default = 10.0, cast = float)
+# Total time for a call to PayPal, retries included, and the retries of idempotent calls
+PAYPAL_CALL_DEADLINE: float = decouple.config('PAYPAL_CALL_DEADLINE', default = 15.0, cast = float)
+PAYPAL_MAX_RETRIES: int = decouple.config('PAYPAL_MAX_RETRIES', default = 2, cast = int)
+PAYPAL_RETRY_BACKOFF: float = decouple.config('PAYPAL_RETRY_BACKOFF', default = 0.2, cast = float)
+# Circuit breaker: open when the failure rate of the last calls reaches the threshold
+PAYPAL_BREAKER_WINDOW: int = decouple.config('PAYPAL_BREAKER_WINDOW', default = 20, cast = int)
+PAYPAL_BREAKER_MIN_CALLS: int = decouple.config('PAYPAL_BREAKER_MIN_CALLS', default = 10, cast = int)
+PAYPAL_BREAKER_FAILURE_RATE: float = decouple.config('PAYPAL_BREAKER_FAILURE_RATE', default = 0.5, cast = float)
+PAYPAL_BREAKER_RESET_TIMEOUT: float = decouple.config('PAYPAL_BREAKER_RESET_TIMEOUT', default = 30.0, cast = float)
+
+### ARTICLES SETTINGS ###
+
+ARTICLES_PAGE_SIZE: int = decouple.config('ARTICLES_PAGE_SIZE', default = 20, cast = int)
+ARTICLES_CACHE_TIMEOUT: int = decouple.config('ARTICLES_CACHE_TIMEOUT', default = 300, cast = int)
+ARTICLE_CARDS_CACHE_TIMEOUT: int = decouple.config('ARTICLE_CARDS_CACHE_TIMEOUT', default = 60 * 60, cast = int)
+ARTICLES_STREAM_CHUNK_SIZE: int = decouple.config('ARTICLES_STREAM_CHUNK_SIZE', default = 100, cast = int)
+
+### SUBSCRIPTION PLANS SETTINGS ###
+
+# Seconds between checks for changes of the plans (see 'client.catalog'). With
+# CACHE_BACKEND 'locmem' the workers can't tell each other about the changes,
+# so each check reloads the plans
+PLAN_CATALOG_CHECK_INTERVAL: float = decouple.config('PLAN_CATALOG_CHECK_INTERVAL', default = 5.0, cast = float)
+
+### SUBSCRIPTION CANCELLATIONS SETTINGS ###
+
+# Cancellations on PayPal are made in the background (see 'client.outbox'),
+# by a worker running inside each ASGI process and/or by the
+# 'process_cancellations' management command
+CANCELLATION_INPROCESS_WORKER: bool = decouple.config('CANCELLATION_INPROCESS_WORKER', default = True, cast = bool)
+CANCELLATION_POLL_INTERVAL: float = decouple.config('CANCELLATION_POLL_INTERVAL', default = 10.0, cast = float)
+CANCELLATION_BATCH_SIZE: int = decouple.config('CANCELLATION_BATCH_SIZE', default = 20, cast = int)
+# Failed attempts are retried after an exponential backoff (in seconds)
+CANCELLATION_MAX_ATTEMPTS: int = decouple.config('CANCELLATION_MAX_ATTEMPTS', default = 10, cast = int)
+CANCELLATION_RETRY_BACKOFF: float = decouple.config('CANCELLATION_RETRY_BACKOFF', default = 30.0, cast = float)
+CANCELLATION_MAX_RETRY_BACKOFF: float = decouple.config('CANCELLATION_MAX_RETRY_BACKOFF', default = 60.0 * 60, cast = float)
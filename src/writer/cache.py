@@ -0,0 +1,42 @@
+"""
+Version stamp of the whole set of articles, stored in Django's cache.
+
+Anything cached that depends on more than one article (eg, a rendered
+listing page) includes the current version in its cache key. Whenever an
+article is saved or deleted the version is bumped (see 'writer.signals' and
+`Article.delete`) and those entries are never looked up again, expiring by
+themselves.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/cache/#the-low-level-cache-api
+    https://docs.djangoproject.com/en/5.1/topics/cache/#cache-versioning
+"""
+
+__all__ = (
+    'articles_version',
+    'aarticles_version',
+    'bump_articles_version',
+)
+
+import time
+
+from django.core.cache import cache
+
+ARTICLES_VERSION_KEY = 'writer:articles-version'
+
+def _initial_version() -> int:
+    # If the key is evicted, restarting from the current time (instead of
+    # from 1) makes sure that we never reuse an old version
+    return time.time_ns()
+
+def articles_version() -> int:
+    return cache.get_or_set(ARTICLES_VERSION_KEY, _initial_version, timeout = None)
+
+async def aarticles_version() -> int:
+    return await cache.aget_or_set(ARTICLES_VERSION_KEY, _initial_version, timeout = None)
+
+def bump_articles_version():
+    try:
+        cache.incr(ARTICLES_VERSION_KEY)
+    except ValueError:
+        cache.set(ARTICLES_VERSION_KEY, _initial_version(), timeout = None)
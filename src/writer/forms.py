@@ -12,6 +12,10 @@ class ArticleForm(ModelForm, AsyncModelFormMixin):
             'title', 'content', 'is_premium',
         )
 
+    def save(self, commit = True) -> Article:
+        self.instance.excerpt = Article.excerpt_for(self.instance.content)
+        return super().save(commit = commit)
+
 class UpdateUserForm(ModelForm, AsyncModelFormMixin):
     class Meta:
         model = CustomUser
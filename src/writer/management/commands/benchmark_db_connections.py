@@ -0,0 +1,138 @@
+"""
+Measures how much of each request is spent opening database connections,
+first without persistent connections nor pooling (Django's defaults) and
+then with the configured DB_* settings (see 'contra.settings').
+
+Each simulated request sends `request_started`, loads a page of the
+article listing and sends `request_finished` (which closes or keeps the
+connection, depending on `CONN_MAX_AGE`). With `--server asgi` each
+request runs in a thread of its own, like with Django's ASGI handler, so
+only a pool (PostgreSQL) avoids a new connection per request. With
+`--server wsgi` the requests share a fixed set of threads, like with a
+threaded WSGI server, where persistent connections are reused.
+
+Usage examples:
+    python manage.py benchmark_db_connections
+    DB_CONN_MAX_AGE=60 python manage.py benchmark_db_connections --server wsgi --requests 2000 --concurrency 20
+    DB_ENGINE=django.db.backends.postgresql DB_POOL=1 DB_NAME=contra python manage.py benchmark_db_connections
+
+See:
+    https://docs.djangoproject.com/en/5.1/ref/databases/#persistent-connections
+    https://docs.djangoproject.com/en/5.1/ref/databases/#connection-pool
+"""
+
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+
+from writer.models import Article, LISTING_FIELDS
+
+class Command(BaseCommand):
+    help = 'Shows the per-request connection overhead with and without the configured DB settings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type = int, default = 500, help = 'Requests per run')
+        parser.add_argument('--concurrency', type = int, default = 10, help = 'Concurrent requests')
+        parser.add_argument('--database', default = 'default', help = 'Database alias to benchmark')
+        parser.add_argument(
+            '--server', choices = ('asgi', 'wsgi'), default = 'asgi',
+            help = 'Threading model of the server to simulate',
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        settings_dict = connections.settings[alias]
+        configured = {
+            'CONN_MAX_AGE': settings_dict['CONN_MAX_AGE'],
+            'OPTIONS': dict(settings_dict['OPTIONS']),
+        }
+        baseline_options = {key: value for key, value in configured['OPTIONS'].items() if key != 'pool'}
+
+        runs = (
+            ('baseline (no persistent connections, no pool)', {'CONN_MAX_AGE': 0, 'OPTIONS': baseline_options}),
+            (
+                f"configured (CONN_MAX_AGE={configured['CONN_MAX_AGE']}, "
+                f"pool={'pool' in configured['OPTIONS']})",
+                configured,
+            ),
+        )
+        for title, overrides in runs:
+            # The connections created from now on use these settings
+            connections.close_all()
+            settings_dict.update(overrides)
+            results = asyncio.run(self.arun(
+                alias, options['server'], options['requests'], options['concurrency'],
+            ))
+            self.report(title, options['requests'], *results)
+        connections.close_all()
+
+    async def arun(self, alias: str, server: str, requests: int, concurrency: int) -> tuple[int, float, list[float]]:
+        new_connections = 0
+        connect_time = 0.0
+
+        def on_connection_created(sender, connection, **kargs):
+            nonlocal new_connections
+            if connection.alias == alias:
+                new_connections += 1
+
+        def timed_connect(connect):
+            def wrapper(*args, **kargs):
+                nonlocal connect_time
+                started_at = time.perf_counter()
+                try:
+                    return connect(*args, **kargs)
+                finally:
+                    connect_time += time.perf_counter() - started_at
+            return wrapper
+
+        def query():
+            connection = connections[alias]
+            if not getattr(connection.connect, 'is_timed', False):
+                connection.connect = timed_connect(connection.connect)
+                connection.connect.is_timed = True
+            list(Article.objects.using(alias).only(*LISTING_FIELDS).order_by('-date_posted', '-id')[:20])
+
+        latencies = []
+
+        def handle_request():
+            started_at = time.perf_counter()
+            request_started.send(sender = self.__class__)
+            query()
+            request_finished.send(sender = self.__class__)
+            latencies.append(time.perf_counter() - started_at)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        executor = ThreadPoolExecutor(max_workers = concurrency)
+
+        async def request():
+            async with semaphore:
+                if server == 'asgi':
+                    # Like Django's ASGI handler: a thread for each request
+                    async with ThreadSensitiveContext():
+                        await sync_to_async(handle_request)()
+                else:
+                    # Like a threaded WSGI server: a fixed set of threads
+                    await asyncio.get_running_loop().run_in_executor(executor, handle_request)
+
+        connection_created.connect(on_connection_created)
+        try:
+            await asyncio.gather(*(request() for _ in range(requests)))
+        finally:
+            connection_created.disconnect(on_connection_created)
+            executor.shutdown()
+        return new_connections, connect_time, latencies
+
+    def report(self, title: str, requests: int, new_connections: int, connect_time: float, latencies: list[float]):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(f'  new connections:          {new_connections} ({new_connections / requests:.2f} per request)')
+        self.stdout.write(f'  connect time per request: {connect_time / requests * 1000:.3f} ms')
+        self.stdout.write(f'  request latency:          median {statistics.median(latencies) * 1000:.3f} ms, '
+                          f'p95 {statistics.quantiles(latencies, n = 20)[-1] * 1000:.3f} ms')
@@ -0,0 +1,173 @@
+"""
+Seeds the database with (fake) articles and shows how the hot article
+and subscription queries are executed with and without the indexes
+declared in `writer.models.Article.Meta.indexes`.
+
+Usage examples:
+    python manage.py benchmark_indexes --articles 1000000
+    python manage.py benchmark_indexes --articles 50000 --repeat 50 --keep-data
+
+WARNING: the data is seeded into the configured 'default' database. It's
+removed at the end, unless `--keep-data` is given, but run this against a
+development or staging database, never against production.
+
+See:
+    https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+    https://docs.djangoproject.com/en/5.1/ref/models/querysets/#explain
+"""
+
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from account.models import CustomUser
+from client.models import PlanChoice, Subscription
+from writer import search
+from writer.models import Article, LISTING_FIELDS
+
+BENCH_EMAIL_DOMAIN = 'benchmark.contra.invalid'
+
+class Command(BaseCommand):
+    help = 'Seeds articles and prints EXPLAIN output and timings with and without the article indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type = int, default = 100_000, help = 'Number of articles to seed')
+        parser.add_argument('--writers', type = int, default = 100, help = 'Number of writers owning the articles')
+        parser.add_argument('--batch-size', type = int, default = 5_000, help = 'Rows per INSERT')
+        parser.add_argument('--page-size', type = int, default = 20, help = 'LIMIT of the listing queries')
+        parser.add_argument('--repeat', type = int, default = 20, help = 'Executions per query to time')
+        parser.add_argument('--keep-data', action = 'store_true', help = "Don't delete the seeded data at the end")
+
+    def handle(self, *args, **options):
+        writers, client = self.seed(options['articles'], options['writers'], options['batch_size'])
+        try:
+            queries = self.hot_queries(writers[0], client, options['page_size'])
+
+            self.drop_indexes()
+            self.stdout.write(self.style.MIGRATE_HEADING('\n=== WITHOUT article indexes ==='))
+            before = self.run_queries(queries, options['repeat'])
+
+            self.create_indexes()
+            self.stdout.write(self.style.MIGRATE_HEADING('\n=== WITH article indexes ==='))
+            after = self.run_queries(queries, options['repeat'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING('\n=== Summary (median ms) ==='))
+            for name in queries:
+                self.stdout.write(
+                    f'{name:<24} {before[name]:>10.3f} -> {after[name]:>10.3f}'
+                    f'  ({before[name] / max(after[name], 1e-6):.1f}x)'
+                )
+        finally:
+            # Never leave the DB without the indexes the migrations created
+            self.create_indexes()
+            if not options['keep_data']:
+                self.stdout.write('\nRemoving the seeded data...')
+                CustomUser.objects.filter(email__endswith = f'@{BENCH_EMAIL_DOMAIN}').delete()
+                # Their articles went in cascade, with a single DELETE
+                search.prune_index()
+
+    def seed(self, num_articles: int, num_writers: int, batch_size: int):
+        self.stdout.write(f'Seeding {num_writers} writers and {num_articles} articles...')
+        start = time.perf_counter()
+        with transaction.atomic():
+            writers = CustomUser.objects.bulk_create(
+                CustomUser(
+                    email = f'writer{i}@{BENCH_EMAIL_DOMAIN}',
+                    firstName = 'Bench',
+                    lastName = f'Writer {i}',
+                    is_writer = True,
+                    password = '!',     # unusable password
+                )
+                for i in range(num_writers)
+            )
+            client = CustomUser.objects.create(
+                email = f'client@{BENCH_EMAIL_DOMAIN}',
+                firstName = 'Bench',
+                lastName = 'Client',
+                password = '!',
+            )
+            plan_choice = PlanChoice.objects.filter(is_active = True).first()
+            if plan_choice:
+                Subscription.objects.create(
+                    cost = plan_choice.cost,
+                    external_subscription_id = f'BENCH-{client.pk}',
+                    is_active = True,
+                    user = client,
+                    plan_choice = plan_choice,
+                )
+
+        now = timezone.now()
+        content = 'Lorem ipsum dolor sit amet. ' * 50
+        excerpt = Article.excerpt_for(content)
+        for offset in range(0, num_articles, batch_size):
+            with transaction.atomic():
+                Article.objects.bulk_create(
+                    Article(
+                        title = f'Benchmark article {i}',
+                        content = content,
+                        excerpt = excerpt,
+                        date_posted = now - timedelta(minutes = random.randrange(5_000_000)),
+                        is_premium = random.random() < 0.3,
+                        user = random.choice(writers),
+                    )
+                    for i in range(offset, min(offset + batch_size, num_articles))
+                )
+        self.stdout.write(f'Seeded in {time.perf_counter() - start:.1f}s')
+        return writers, client
+
+    def hot_queries(self, writer: CustomUser, client: CustomUser, page_size: int) -> dict:
+        listing = Article.objects.only(*LISTING_FIELDS).order_by('-date_posted', '-id')
+        return {
+            'browse (standard)': listing.filter(is_premium = False)[:page_size + 1],
+            'browse (premium)': listing.all()[:page_size + 1],
+            'writer my_articles': listing.filter(user = writer)[:page_size + 1],
+            'subscription for user': Subscription.objects.filter(user = client, is_active = True),
+        }
+
+    def run_queries(self, queries: dict, repeat: int) -> dict[str, float]:
+        timings = {}
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.SQL_KEYWORD(f'\n--- {name} ---'))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain())
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())    # .all() makes a fresh, unevaluated, clone
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[name] = statistics.median(samples)
+            self.stdout.write(f'median: {timings[name]:.3f} ms')
+        return timings
+
+    def drop_indexes(self):
+        existing = self.existing_indexes()
+        with connection.schema_editor() as schema_editor:
+            for index in Article._meta.indexes:
+                if index.name in existing:
+                    schema_editor.remove_index(Article, index)
+
+    def create_indexes(self):
+        existing = self.existing_indexes()
+        with connection.schema_editor() as schema_editor:
+            for index in Article._meta.indexes:
+                if index.name not in existing:
+                    schema_editor.add_index(Article, index)
+        # Refresh the planner statistics
+        analyze = {
+            'sqlite': 'ANALYZE {}',
+            'postgresql': 'ANALYZE {}',
+            'mysql': 'ANALYZE TABLE {}',
+        }.get(connection.vendor)
+        if analyze:
+            with connection.cursor() as cursor:
+                cursor.execute(analyze.format(connection.ops.quote_name(Article._meta.db_table)))
+
+    def existing_indexes(self) -> set[str]:
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Article._meta.db_table)
+        return set(constraints)
@@ -0,0 +1,148 @@
+"""
+Measures the throughput of concurrent readers and writers on SQLite, with
+SQLite's (and Django's) defaults and with the production profile of
+'contra.settings' (WAL journaling, `synchronous = NORMAL`, `busy_timeout`,
+`mmap_size`, `cache_size` and IMMEDIATE transactions).
+
+The readers load pages of the article listing while the writers insert
+articles, each in a transaction that reads before it writes (like
+`ArticleForm.save` and the signal receivers do). Both run in threads, on a
+temporary copy of the 'writer_article' schema, never on the real database.
+
+Usage examples:
+    python manage.py benchmark_sqlite_concurrency
+    python manage.py benchmark_sqlite_concurrency --readers 16 --writers 4 --seconds 10
+
+See:
+    https://www.sqlite.org/wal.html
+    https://www.sqlite.org/lang_transaction.html
+"""
+
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SCHEMA = """
+    CREATE TABLE article (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title VARCHAR(100) NOT NULL,
+        content TEXT NOT NULL,
+        is_premium BOOL NOT NULL,
+        date_posted DATETIME NOT NULL
+    );
+    CREATE INDEX article_date_idx ON article (date_posted DESC, id DESC);
+"""
+INSERT = 'INSERT INTO article (title, content, is_premium, date_posted) VALUES (?, ?, ?, ?)'
+LISTING = 'SELECT id, title, date_posted FROM article WHERE NOT is_premium ORDER BY date_posted DESC, id DESC LIMIT 20'
+
+@dataclass
+class Profile:
+    title: str
+    init_command: str
+    transaction_mode: str
+
+@dataclass
+class Counters:
+    reads: int = 0
+    writes: int = 0
+    locked: int = 0
+
+class Command(BaseCommand):
+    help = 'Compares the concurrent throughput of SQLite with its defaults and with the production profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type = int, default = 8, help = 'Reader threads')
+        parser.add_argument('--writers', type = int, default = 4, help = 'Writer threads')
+        parser.add_argument('--seconds', type = float, default = 5.0, help = 'Duration of each run')
+        parser.add_argument('--rows', type = int, default = 10_000, help = 'Articles seeded before each run')
+
+    def handle(self, *args, **options):
+        db_options = settings.DATABASES['default']['OPTIONS']
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('The default database is not SQLite')
+        profiles = (
+            Profile('defaults (rollback journal, synchronous = FULL, DEFERRED)', '', 'DEFERRED'),
+            Profile(
+                'production profile (contra.settings)',
+                db_options.get('init_command', ''),
+                db_options.get('transaction_mode') or 'DEFERRED',
+            ),
+        )
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir) / 'benchmark.sqlite3'
+                self.seed(path, profile, options['rows'])
+                counters = self.run(path, profile, options['readers'], options['writers'], options['seconds'])
+            self.report(profile, counters, options['seconds'])
+
+    @staticmethod
+    def connect(path: Path, profile: Profile) -> sqlite3.Connection:
+        # Python's default busy timeout (5 s), as Django uses it
+        connection = sqlite3.connect(path, isolation_level = None, check_same_thread = False)
+        if profile.init_command:
+            connection.executescript(profile.init_command)
+        return connection
+
+    def seed(self, path: Path, profile: Profile, rows: int):
+        connection = self.connect(path, profile)
+        connection.executescript(SCHEMA)
+        connection.execute('BEGIN')
+        connection.executemany(INSERT, (
+            (f'Article {n}', 'body ' * 100, n % 3 == 0, f'2025-01-01 00:00:{n % 60:02}') for n in range(rows)
+        ))
+        connection.execute('COMMIT')
+        connection.close()
+
+    def run(self, path: Path, profile: Profile, readers: int, writers: int, seconds: float) -> Counters:
+        counters = Counters()
+        lock = threading.Lock()
+        stop_at = time.monotonic() + seconds
+
+        def count(field: str):
+            with lock:
+                setattr(counters, field, getattr(counters, field) + 1)
+
+        def reader():
+            connection = self.connect(path, profile)
+            while time.monotonic() < stop_at:
+                try:
+                    connection.execute(LISTING).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError:
+                    count('locked')
+            connection.close()
+
+        def writer():
+            connection = self.connect(path, profile)
+            while time.monotonic() < stop_at:
+                try:
+                    connection.execute(f'BEGIN {profile.transaction_mode}')
+                    connection.execute('SELECT MAX(date_posted) FROM article').fetchone()
+                    connection.execute(INSERT, ('New article', 'body ' * 100, False, '2026-01-01 00:00:00'))
+                    connection.execute('COMMIT')
+                    count('writes')
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+                    count('locked')
+            connection.close()
+
+        threads = [threading.Thread(target = reader) for _ in range(readers)]
+        threads += [threading.Thread(target = writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counters
+
+    def report(self, profile: Profile, counters: Counters, seconds: float):
+        self.stdout.write(self.style.MIGRATE_HEADING(profile.title))
+        self.stdout.write(f'  reads/s:  {counters.reads / seconds:10.0f}')
+        self.stdout.write(f'  writes/s: {counters.writes / seconds:10.0f}')
+        self.stdout.write(f'  "database is locked" errors: {counters.locked}')
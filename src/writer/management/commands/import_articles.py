@@ -0,0 +1,183 @@
+"""
+Imports articles (eg, back catalogs of research reports) from a JSONL or
+CSV file, much faster than through `ArticleForm` or the admin.
+
+Each row has the fields 'title', 'content', 'author' (the email of a
+writer) and, optionally, 'is_premium' and 'date_posted' (ISO 8601). The
+file is streamed, row by row, so its size doesn't matter. Valid rows are
+inserted with `bulk_create`, `--batch-size` rows per INSERT, in
+transactions of `--chunk-size` rows. Invalid rows are reported (with their
+line number) and skipped.
+
+`bulk_create` doesn't send the model signals, so the search index and the
+articles version (see 'writer.signals') are refreshed once at the end, or
+when the import stops after some chunks were committed.
+
+Usage examples:
+    python manage.py import_articles reports.jsonl
+    python manage.py import_articles reports.csv --batch-size 2000 --chunk-size 20000
+    python manage.py import_articles reports.jsonl --dry-run
+
+See:
+    https://docs.djangoproject.com/en/5.1/ref/models/querysets/#bulk-create
+    https://docs.djangoproject.com/en/5.1/topics/db/transactions/
+"""
+
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from account.models import CustomUser
+from writer import search
+from writer.cache import bump_articles_version
+from writer.models import Article, TITLE_MAXLEN, CONTENT_MAXLEN
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', 'f'}
+
+class InvalidRow(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Imports articles from a JSONL or CSV file with bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type = Path, help = 'JSONL or CSV file to import')
+        parser.add_argument(
+            '--format', choices = ('jsonl', 'csv'),
+            help = "Format of the file (by default, from its extension)",
+        )
+        parser.add_argument('--batch-size', type = int, default = 1_000, help = 'Rows per INSERT')
+        parser.add_argument('--chunk-size', type = int, default = 10_000, help = 'Rows per transaction')
+        parser.add_argument(
+            '--max-errors', type = int, default = 1_000,
+            help = 'Stop after this many invalid rows',
+        )
+        parser.add_argument('--dry-run', action = 'store_true', help = 'Only validate the rows')
+
+    def handle(self, *args, **options):
+        path: Path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('jsonl', 'csv'):
+            raise CommandError(f'Unknown file format: {file_format} (use --format)')
+        if options['batch_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--batch-size and --chunk-size must be positive')
+
+        # Writers are few: one query maps all their emails to their ids
+        authors = {
+            email.lower(): id
+            for email, id in CustomUser.objects.filter(is_writer = True).values_list('email', 'id')
+        }
+        imported = committed = self.invalid_rows = 0
+        started_at = time.monotonic()
+
+        try:
+            with path.open(newline = '', encoding = 'utf-8') as file:
+                rows = self.read_jsonl(file) if file_format == 'jsonl' else self.read_csv(file)
+                articles = self.valid_articles(rows, authors, options['max_errors'])
+                while chunk := list(islice(articles, options['chunk_size'])):
+                    if not options['dry_run']:
+                        with transaction.atomic():
+                            Article.objects.bulk_create(chunk, batch_size = options['batch_size'])
+                        committed += len(chunk)
+                    imported += len(chunk)
+                    rate = imported / (time.monotonic() - started_at)
+                    self.stdout.write(f'{imported} articles imported ({rate:.0f} rows/s)')
+        finally:
+            # Also when the import stops halfway (eg, too many invalid rows):
+            # the chunks already committed stay
+            if committed:
+                self.stdout.write('Rebuilding the search index...')
+                search.rebuild_index()
+                bump_articles_version()
+
+        elapsed = time.monotonic() - started_at
+        verb = 'validated' if options['dry_run'] else 'imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} articles {verb} in {elapsed:.1f}s ({imported / elapsed:.0f} rows/s), '
+            f'{self.invalid_rows} invalid rows skipped'
+        ))
+
+    def valid_articles(
+            self,
+            rows: Iterator[tuple[int, dict | None]],
+            authors: dict[str, int],
+            max_errors: int,
+    ) -> Iterator[Article]:
+        for line_number, row in rows:
+            try:
+                if row is None:
+                    raise InvalidRow('Not a JSON object')
+                yield self.article_from(row, authors)
+            except InvalidRow as ex:
+                self.invalid_rows += 1
+                self.stderr.write(f'Line {line_number}: {ex}')
+                if self.invalid_rows >= max_errors:
+                    raise CommandError(f'Too many invalid rows ({self.invalid_rows}), stopping')
+
+    @staticmethod
+    def article_from(row: dict, authors: dict[str, int]) -> Article:
+        title = str(row.get('title') or '').strip()
+        content = str(row.get('content') or '').strip()
+        if not title or len(title) > TITLE_MAXLEN:
+            raise InvalidRow(f'The title must have between 1 and {TITLE_MAXLEN} characters')
+        if not content or len(content) > CONTENT_MAXLEN:
+            raise InvalidRow(f'The content must have between 1 and {CONTENT_MAXLEN} characters')
+
+        email = str(row.get('author') or '').strip().lower()
+        if email not in authors:
+            raise InvalidRow(f"Unknown writer: '{email}'")
+
+        is_premium = row.get('is_premium', False)
+        if not isinstance(is_premium, bool):
+            value = str(is_premium).strip().lower()
+            if value not in TRUE_VALUES | FALSE_VALUES:
+                raise InvalidRow(f"Invalid is_premium: '{is_premium}'")
+            is_premium = value in TRUE_VALUES
+
+        date_posted = timezone.now()
+        if row.get('date_posted'):
+            try:
+                date_posted = parse_datetime(str(row['date_posted']))
+            except ValueError:
+                date_posted = None
+            if date_posted is None:
+                raise InvalidRow(f"Invalid date_posted: '{row['date_posted']}'")
+            if timezone.is_naive(date_posted):
+                date_posted = timezone.make_aware(date_posted)
+
+        return Article(
+            title = title,
+            content = content,
+            excerpt = Article.excerpt_for(content),
+            is_premium = is_premium,
+            date_posted = date_posted,
+            user_id = authors[email],
+        )
+
+    def read_jsonl(self, file) -> Iterator[tuple[int, dict | None]]:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # Anything but an object is reported as an invalid row
+            yield line_number, row if isinstance(row, dict) else None
+
+    def read_csv(self, file) -> Iterator[tuple[int, dict]]:
+        reader = csv.DictReader(file)
+        missing = {'title', 'content', 'author'} - set(reader.fieldnames or ())
+        if missing:
+            raise CommandError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
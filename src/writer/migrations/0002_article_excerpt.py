@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:14
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+EXCERPT_MAXLEN = 300
+
+def populate_excerpt(apps, schema_editor):
+    # We can't import the Article model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    Article = apps.get_model('writer', 'Article')
+    articles = Article.objects.only('id', 'content')
+    for article in articles.iterator(chunk_size = 500):
+        article.excerpt = Truncator(' '.join(article.content.split())).chars(EXCERPT_MAXLEN)
+        article.save(update_fields = ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300, verbose_name='Excerpt'),
+        ),
+        migrations.RunPython(populate_excerpt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writer', '0002_article_excerpt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-date_posted', '-id'], name='article_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['is_premium', '-date_posted', '-id'], name='article_premium_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['user', '-date_posted', '-id'], name='article_user_date_idx'),
+        ),
+    ]
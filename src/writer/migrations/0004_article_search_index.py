@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:30
+
+from django.db import migrations
+
+FTS_TABLE = 'writer_article_fts'
+MYSQL_FULLTEXT_INDEX = 'article_fulltext_idx'
+
+def create_search_index(apps, schema_editor):
+    # See 'writer.search' for how these are queried and kept in sync
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            "USING fts5(title, content, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, content) '
+            'SELECT id, title, content FROM writer_article'
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            f'ALTER TABLE writer_article ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (title, content)'
+        )
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'mysql':
+        schema_editor.execute(f'ALTER TABLE writer_article DROP INDEX {MYSQL_FULLTEXT_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writer', '0003_article_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.utils import timezone
+from django.utils.text import Truncator
 from django.utils.translation import gettext_lazy as _t
 
 # Create your models here.
@@ -9,11 +10,49 @@ from account.models import CustomUser
 
 TITLE_MAXLEN = 150
 CONTENT_MAXLEN = 10_000
+EXCERPT_MAXLEN = 300
+
+# Fields needed to render an article in a listing (ie, everything but the
+# full content). Use them with `QuerySet.only(...)`.
+LISTING_FIELDS = ('id', 'title', 'excerpt', 'date_posted', 'date_changed', 'is_premium')
 
 class Article(models.Model):
     title = models.CharField(max_length=TITLE_MAXLEN, verbose_name=_t('Title'))
     content = models.TextField(max_length=CONTENT_MAXLEN, verbose_name=_t('Content'))
+    excerpt = models.CharField(max_length=EXCERPT_MAXLEN, blank=True, editable=False, verbose_name=_t('Excerpt'))
     date_posted = models.DateTimeField(default=timezone.now)
+    # Version stamp of the article, eg, for the rendered fragments cache
+    date_changed = models.DateTimeField(auto_now=True)
     is_premium = models.BooleanField(default=False, verbose_name=_t('Is this a premium article?'))
 
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
\ No newline at end of file
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            # Premium subscribers browse all articles, newest first
+            models.Index(fields=['-date_posted', '-id'], name='article_date_idx'),
+            # Standard subscribers only browse the non premium ones
+            models.Index(fields=['is_premium', '-date_posted', '-id'], name='article_premium_date_idx'),
+            # Writers list their own articles, newest first
+            models.Index(fields=['user', '-date_posted', '-id'], name='article_user_date_idx'),
+        ]
+
+    def delete(self, using = None, keep_parents = False):
+        """
+        Deletes the article and unindexes it (see 'writer.search'), in the
+        same transaction. Not a `post_delete` receiver, see 'writer.signals'.
+        """
+        from . import search
+        from .cache import bump_articles_version
+
+        using = using or router.db_for_write(Article, instance = self)
+        article_id = self.pk
+        with transaction.atomic(using = using):
+            deleted = super().delete(using, keep_parents)
+            search.unindex_article(article_id, using)
+        transaction.on_commit(bump_articles_version, using)
+        return deleted
+
+    @staticmethod
+    def excerpt_for(content: str) -> str:
+        return Truncator(' '.join(content.split())).chars(EXCERPT_MAXLEN)
@@ -0,0 +1,182 @@
+"""
+Full-text search over the articles, backed by the inverted index of the
+database engine in use:
+
+    SQLite: an FTS5 virtual table, 'writer_article_fts', whose rowid is the
+        article id. It's kept in sync with the articles by the signal
+        receivers in 'writer.signals'.
+    MySQL: a FULLTEXT index on 'writer_article(title, content)' maintained
+        by InnoDB itself.
+
+The tables/indexes are created by the migration '0004_article_search_index'.
+For any other engine we fall back to a (slow) `icontains` scan.
+
+NOTE: `QuerySet.bulk_create` and `QuerySet.update` don't send the model
+signals: call `rebuild_index` after using them. `Article.delete` unindexes
+the article, but the articles deleted by `QuerySet.delete` or in cascade
+(eg, with their writer) are only left out of the results (the search joins
+the articles table): `prune_index` removes them in a single statement.
+
+See:
+    https://www.sqlite.org/fts5.html
+    https://dev.mysql.com/doc/refman/8.4/en/fulltext-search.html
+"""
+
+__all__ = (
+    'FTS_TABLE',
+    'search_articles',
+    'asearch_articles',
+    'index_article',
+    'unindex_article',
+    'prune_index',
+    'aprune_index',
+    'rebuild_index',
+)
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+
+from asgiref.sync import sync_to_async
+
+from .models import Article, LISTING_FIELDS
+
+FTS_TABLE = 'writer_article_fts'
+ARTICLE_TABLE = Article._meta.db_table
+
+def search_articles(
+        text: str,
+        *,
+        include_premium: bool,
+        limit: int,
+        offset: int = 0,
+) -> list[Article]:
+    """
+    Returns the articles matching `text`, best matches first. Only the
+    listing fields of the articles are loaded.
+    """
+    if not text.strip():
+        return []
+    backend = _BACKENDS.get(connection.vendor, _FallbackBackend)
+    article_ids = backend.search_ids(text, include_premium, limit, offset)
+    articles = Article.objects.only(*LISTING_FIELDS).in_bulk(article_ids)
+    return [articles[id] for id in article_ids if id in articles]
+
+@sync_to_async
+def asearch_articles(*args, **kargs) -> list[Article]:
+    return search_articles(*args, **kargs)
+
+def index_article(article: Article, using: str = DEFAULT_DB_ALIAS):
+    _backend(using).index(connections[using], article)
+
+def unindex_article(article_id: int, using: str = DEFAULT_DB_ALIAS):
+    _backend(using).unindex(connections[using], article_id)
+
+def prune_index(using: str = DEFAULT_DB_ALIAS):
+    _backend(using).prune(connections[using])
+
+@sync_to_async
+def aprune_index(*args, **kargs):
+    prune_index(*args, **kargs)
+
+def rebuild_index(using: str = DEFAULT_DB_ALIAS):
+    _backend(using).rebuild(connections[using])
+
+def _backend(using: str):
+    return _BACKENDS.get(connections[using].vendor, _FallbackBackend)
+
+class _FallbackBackend:
+    @staticmethod
+    def search_ids(text: str, include_premium: bool, limit: int, offset: int) -> list[int]:
+        articles = Article.objects.filter(Q(title__icontains = text) | Q(content__icontains = text))
+        if not include_premium:
+            articles = articles.filter(is_premium = False)
+        articles = articles.order_by('-date_posted', '-id').values_list('id', flat = True)
+        return list(articles[offset:offset + limit])
+
+    @staticmethod
+    def index(connection, article: Article):
+        pass
+
+    @staticmethod
+    def unindex(connection, article_id: int):
+        pass
+
+    @staticmethod
+    def prune(connection):
+        pass
+
+    @staticmethod
+    def rebuild(connection):
+        pass
+
+class _SQLiteBackend:
+    @staticmethod
+    def search_ids(text: str, include_premium: bool, limit: int, offset: int) -> list[int]:
+        premium_filter = '' if include_premium else 'AND NOT a.is_premium'
+        sql = f"""
+            SELECT a.id FROM {FTS_TABLE} f
+            JOIN {ARTICLE_TABLE} a ON a.id = f.rowid
+            WHERE {FTS_TABLE} MATCH %s {premium_filter}
+            ORDER BY bm25({FTS_TABLE}) LIMIT %s OFFSET %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [_SQLiteBackend.fts_query(text), limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def fts_query(text: str) -> str:
+        """
+        Quotes every word so that the user's text is never interpreted as
+        FTS5 query syntax (AND, OR, NEAR, column filters, ...). The words
+        are implicitly ANDed.
+        """
+        return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+    @staticmethod
+    def index(connection, article: Article):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [article.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+                [article.pk, article.title, article.content],
+            )
+
+    @staticmethod
+    def unindex(connection, article_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [article_id])
+
+    @staticmethod
+    def prune(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM {ARTICLE_TABLE})'
+            )
+
+    @staticmethod
+    def rebuild(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, content) '
+                f'SELECT id, title, content FROM {ARTICLE_TABLE}'
+            )
+
+class _MySQLBackend(_FallbackBackend):
+    @staticmethod
+    def search_ids(text: str, include_premium: bool, limit: int, offset: int) -> list[int]:
+        premium_filter = '' if include_premium else 'AND NOT is_premium'
+        match = 'MATCH (title, content) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+        sql = f"""
+            SELECT id FROM {ARTICLE_TABLE}
+            WHERE {match} {premium_filter}
+            ORDER BY {match} DESC LIMIT %s OFFSET %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [text, text, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+_BACKENDS = {
+    'sqlite': _SQLiteBackend,
+    'mysql': _MySQLBackend,
+}
@@ -0,0 +1,28 @@
+"""
+Signal receivers that keep the data derived from the articles in sync
+with them.
+
+There's no `post_delete` receiver: any would make Django load, and signal,
+the articles deleted in cascade (eg, with their writer) one by one instead
+of deleting them with a single statement. `Article.delete` does it instead.
+
+See:
+    https://docs.djangoproject.com/en/5.1/topics/signals/
+    https://docs.djangoproject.com/en/5.1/ref/signals/#post-save
+"""
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import search
+from .cache import bump_articles_version
+from .models import Article
+
+SEARCHABLE_FIELDS = {'title', 'content'}
+
+@receiver(post_save, sender = Article)
+def article_saved(sender, instance: Article, update_fields = None, using = DEFAULT_DB_ALIAS, **kargs):
+    if update_fields is None or SEARCHABLE_FIELDS & set(update_fields):
+        search.index_article(instance, using)
+    transaction.on_commit(bump_articles_version, using)
@@ -1,3 +1,67 @@
+import io
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from account.models import CustomUser
+from writer import search
+from writer.cache import articles_version
+from writer.models import Article
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.writer = CustomUser.objects.create_user('w@x.com', None, firstName = 'W', lastName = 'R', is_writer = True)
+        cls.articles = [
+            Article.objects.create(title = f'Zebra {n}', content = 'stripes', user = cls.writer) for n in range(3)
+        ]
+
+    def indexed_ids(self) -> set[int]:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {search.FTS_TABLE}')
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_deleting_an_article_unindexes_it(self):
+        self.articles[0].delete()
+        self.assertEqual(self.indexed_ids(), {article.pk for article in self.articles[1:]})
+        found = search.search_articles('zebra', include_premium = True, limit = 10)
+        self.assertEqual(len(found), 2)
+
+    def test_articles_deleted_with_their_writer_are_deleted_at_once_then_pruned(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.writer.delete()
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(sum(Article._meta.db_table in sql for sql in deletes), 1)
+        self.assertFalse(any(search.FTS_TABLE in sql for sql in deletes))
+
+        self.assertEqual(search.search_articles('zebra', include_premium = True, limit = 10), [])
+        search.prune_index()
+        self.assertEqual(self.indexed_ids(), set())
+
+class ImportArticlesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create_user('w@x.com', None, firstName = 'W', lastName = 'R', is_writer = True)
+
+    def test_committed_chunks_are_indexed_when_the_import_stops(self):
+        rows = [{'title': f'Okapi {n}', 'content': 'forest', 'author': 'w@x.com'} for n in range(2)]
+        rows += [{'title': '', 'content': 'no title', 'author': 'w@x.com'}] * 2
+        path = Path(tempfile.mkdtemp()) / 'articles.jsonl'
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
 
-# Create your tests here.
+        version = articles_version()
+        with self.assertRaises(CommandError):
+            call_command(
+                'import_articles', path, chunk_size = 1, max_errors = 2,
+                stdout = io.StringIO(), stderr = io.StringIO(),
+            )
+        found = search.search_articles('okapi', include_premium = True, limit = 10)
+        self.assertEqual(len(found), 2)
+        self.assertNotEqual(articles_version(), version)
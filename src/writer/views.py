@@ -6,12 +6,19 @@ See also:
 from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect, render
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import aget_user
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.translation import get_language
 
+from asgiref.sync import sync_to_async
+
+from . import search
+from .cache import bump_articles_version
 from .forms import ArticleForm, UpdateUserForm
-from .models import Article
-from common.auth import awriter_required, ensure_for_current_user
-from common.django_utils import arender
+from .models import Article, LISTING_FIELDS
+from common.auth import awriter_required, arequest_user, ensure_for_current_user
+from common.django_utils import arender, astream_render, acondition, make_etag
+from common.fragment_cache import arender_fragments
 
 @awriter_required
 async def dashboard(request: HttpRequest) -> HttpResponse:
@@ -29,7 +36,7 @@ async def create_article(request: HttpRequest) -> HttpResponse:
         form = ArticleForm(request.POST)
         if await form.ais_valid():
             article = await form.asave(commit = False)
-            article.user = await aget_user(request)
+            article.user = await arequest_user(request)
             await article.asave()
             return redirect('writer-my-articles')
     else:
@@ -38,15 +45,56 @@ async def create_article(request: HttpRequest) -> HttpResponse:
     context = {'create_article_form': form}
     return await arender(request, 'writer/create-article.html', context)
 
+async def _my_articles_etag(request: HttpRequest) -> str:
+    """
+    Creating or deleting an article changes the count, updating one changes
+    the latest `date_changed`.
+    """
+    current_user = await arequest_user(request)
+    stats = await Article.objects.filter(user = current_user).aaggregate(
+        count = Count('id'),
+        last_changed = Max('date_changed'),
+    )
+    return make_etag(
+        current_user.pk,
+        current_user.firstName,
+        stats['count'],
+        stats['last_changed'],
+        get_language(),
+    )
+
 @awriter_required
+@acondition(etag_func = _my_articles_etag)
 async def my_articles(request: HttpRequest) -> HttpResponse:
     """
     This is the writer's articles.
     """
-    current_user = await aget_user(request)
-    articles = Article.objects.filter(user = current_user)
-    context = {'my_articles': articles}
-    return await arender(request, 'writer/my-articles.html', context)
+    current_user = await arequest_user(request)
+    articles = (
+        Article.objects
+            .filter(user = current_user)
+            .only(*LISTING_FIELDS)
+            .order_by('-date_posted', '-id')
+    )
+    # The cards are streamed (and fetched from the cache) one chunk of
+    # articles at a time, no matter how many articles the writer has.
+    async def render_cards(chunk: list[Article]) -> list[str]:
+        return await arender_fragments(
+            'writer/_article-card.html',
+            chunk,
+            object_name = 'article',
+            timeout = settings.ARTICLE_CARDS_CACHE_TIMEOUT,
+        )
+
+    context = {'has_articles': await articles.aexists()}
+    return await astream_render(
+        request,
+        'writer/my-articles.html',
+        context,
+        items = articles.aiterator(chunk_size = settings.ARTICLES_STREAM_CHUNK_SIZE),
+        render_chunk = render_cards,
+        chunk_size = settings.ARTICLES_STREAM_CHUNK_SIZE,
+    )
 
 @awriter_required
 @ensure_for_current_user(Article, redirect_if_missing = 'writer-my-articles')
@@ -80,7 +128,7 @@ async def delete_article(request: HttpRequest, article: Article) -> HttpResponse
 
 @awriter_required
 async def update_user(request: HttpRequest) -> HttpResponse:
-    user = await aget_user(request)
+    user = await arequest_user(request)
     if request.method == 'POST':
         form = UpdateUserForm(request.POST, instance = user)
         if await form.ais_valid():
@@ -93,9 +141,12 @@ async def update_user(request: HttpRequest) -> HttpResponse:
 
 @awriter_required
 async def delete_account(request: HttpRequest) -> HttpResponse:
-    user = await aget_user(request)
+    user = await arequest_user(request)
     if request.method == 'POST':
         await user.adelete()
+        # Their articles were deleted in cascade, not by `Article.delete`
+        await search.aprune_index()
+        await sync_to_async(bump_articles_version)()
         return redirect('home')
     context = {'user': user}
     return await arender(request, 'writer/delete-account.html', context)
\ No newline at end of file